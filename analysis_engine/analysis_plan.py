@@ -0,0 +1,310 @@
+'''
+Precompiled analysis plans.
+
+Flights recorded with the same data frame (LFL) and aircraft attributes have
+the same operable nodes, so the dependency graph only needs to be resolved
+once per frame. An analysis plan stores the result of resolving the graph
+for a representative HDF file so that process_flight can skip graph work for
+other flights of the same frame. Plans are validated against the parameters
+and attributes available for each flight and are only used when the graph
+would be resolved identically.
+'''
+import argparse
+import hashlib
+import logging
+import os
+import simplejson as json
+
+from analysis_engine import __version__
+from analysis_engine.dependency_graph import (
+    dependency_order,
+    dumps_dependency_tree,
+    graph_template,
+)
+from analysis_engine.node import _can_operate_attribute_names
+
+
+logger = logging.getLogger(__name__)
+
+ANALYSIS_PLAN_VERSION = 1
+
+
+def _node_set_hash(derived_nodes):
+    '''
+    :returns: Hash of the derived node names and the classes which define them.
+    :rtype: str
+    '''
+    return hashlib.sha1('\n'.join(sorted(
+        '%s:%s.%s' % (name, node.__module__, node.__name__)
+        for name, node in derived_nodes.iteritems()))).hexdigest()
+
+
+def _available_names(node_mgr, template):
+    '''
+    Only parameters and attributes within the graph of derived nodes can
+    change the process order; other parameters in the HDF file are ignored.
+
+    :returns: Names of parameters and attributes within the graph which are available.
+    :rtype: [str]
+    '''
+    names = set(node_mgr.hdf_keys)
+    # Attributes with None values are unavailable, see NodeManager.operational.
+    for attributes in (node_mgr.aircraft_info,
+                       node_mgr.achieved_flight_record):
+        names.update(name for name, value in attributes.iteritems()
+                     if value is not None)
+    return sorted(name for name in names if name in template)
+
+
+def _json_value(value):
+    '''
+    :returns: The value as loaded from JSON, with tuples converted to lists, so that values compare equal once a plan has been saved and loaded.
+    '''
+    if isinstance(value, (list, tuple)):
+        return [_json_value(v) for v in value]
+    if isinstance(value, dict):
+        return dict((k, _json_value(v)) for k, v in value.iteritems())
+    return value
+
+
+def _attribute_values(node_mgr, derived_nodes):
+    '''
+    :returns: Values of aircraft and flight attributes passed to can_operate.
+    :rtype: dict
+    '''
+    names = set()
+    for node in derived_nodes.itervalues():
+        names.update(_can_operate_attribute_names(node))
+    values = {}
+    for name in names:
+        if name in node_mgr.aircraft_info:
+            values[name] = _json_value(node_mgr.aircraft_info[name])
+        elif name in node_mgr.achieved_flight_record:
+            values[name] = _json_value(node_mgr.achieved_flight_record[name])
+    return values
+
+
+def _alignment(node, available):
+    '''
+    :returns: Name, frequency and offset the node's dependencies are aligned to.
+    :rtype: dict or None
+    '''
+    if not getattr(node, 'align', False):
+        return None
+    dependencies = [name for name in node.get_dependency_names()
+                    if name in available]
+    return {
+        'target': dependencies[0] if dependencies else None,
+        'frequency': node.align_frequency,
+        'offset': node.align_offset,
+    }
+
+
+class AnalysisPlan(object):
+    '''
+    The result of resolving the dependency graph for a data frame.
+
+    Attributes:
+
+     * process_order: Node names in the order they are processed.
+     * lfl_parameters: Parameters within the HDF file which are processed.
+     * alignment: Alignment target of each derived node. The target is the first available dependency unless the node declares align_frequency or align_offset.
+     * nodes: Metadata of each derived node processed, its node type, module and available dependencies.
+     * usage: Number of processed nodes which depend upon each node.
+     * dependency_tree: Compact dependency tree, see dumps_dependency_tree.
+
+    The remaining attributes are used to validate the plan.
+    '''
+    def __init__(self, process_order, lfl_parameters, alignment, nodes, usage,
+                 dependency_tree, requested, required, available,
+                 attribute_values, node_set, version=ANALYSIS_PLAN_VERSION,
+                 analysis_version=__version__):
+        self.process_order = process_order
+        self.lfl_parameters = lfl_parameters
+        self.alignment = alignment
+        self.nodes = nodes
+        self.usage = usage
+        self.dependency_tree = dependency_tree
+        self.requested = requested
+        self.required = required
+        self.available = available
+        self.attribute_values = attribute_values
+        self.node_set = node_set
+        self.version = version
+        self.analysis_version = analysis_version
+
+    def __repr__(self):
+        return 'AnalysisPlan: x%d nodes, x%d LFL parameters' % (
+            len(self.process_order), len(self.lfl_parameters))
+
+    def todict(self):
+        '''
+        :returns: JSON serialisable representation of the plan.
+        :rtype: dict
+        '''
+        return dict(self.__dict__)
+
+    @classmethod
+    def fromdict(cls, plan):
+        '''
+        :param plan: Representation of the plan returned by todict.
+        :type plan: dict
+        :raises ValueError: If the plan was created by a different version.
+        '''
+        if plan.get('version') != ANALYSIS_PLAN_VERSION:
+            raise ValueError("Unsupported analysis plan version '%s'." %
+                             plan.get('version'))
+        return cls(**dict((str(k), v) for k, v in plan.iteritems()))
+
+    def validate(self, node_mgr):
+        '''
+        Checks whether the plan applies to a flight. This only compares sets
+        of names and a few attribute values so is much cheaper than
+        resolving the dependency graph.
+
+        :param node_mgr: Node manager of the flight.
+        :type node_mgr: NodeManager
+        :returns: Reasons the plan does not apply, empty if it is valid.
+        :rtype: [str]
+        '''
+        errors = []
+        if self.analysis_version != __version__:
+            errors.append("Plan was created by analysis version '%s'." %
+                          self.analysis_version)
+        if self.node_set != _node_set_hash(node_mgr.derived_nodes):
+            errors.append('Derived nodes differ.')
+        if set(self.requested) != set(node_mgr.requested) \
+           or set(self.required) != set(node_mgr.required):
+            errors.append('Requested or required nodes differ.')
+        if errors:
+            return errors
+        template, _ = graph_template(node_mgr.derived_nodes)
+        available = set(_available_names(node_mgr, template))
+        planned = set(self.available)
+        if available != planned:
+            errors.append('Available parameters differ: missing %s, '
+                          'additional %s.' % (sorted(planned - available),
+                                              sorted(available - planned)))
+        attribute_values = _attribute_values(node_mgr,
+                                             node_mgr.derived_nodes)
+        if attribute_values != self.attribute_values:
+            errors.append('Attribute values differ: %s.' % sorted(
+                name for name in set(attribute_values) |
+                set(self.attribute_values)
+                if attribute_values.get(name) !=
+                self.attribute_values.get(name)))
+        return errors
+
+    def is_valid(self, node_mgr):
+        '''
+        :returns: Whether the plan applies to the flight.
+        :rtype: bool
+        '''
+        errors = self.validate(node_mgr)
+        for error in errors:
+            logger.info('Analysis plan does not apply: %s', error)
+        return not errors
+
+
+def create_analysis_plan(node_mgr):
+    '''
+    Resolves the dependency graph of a representative flight.
+
+    :param node_mgr: Node manager of the representative flight.
+    :type node_mgr: NodeManager
+    :returns: Plan which can be used for flights with the same parameters and attributes.
+    :rtype: AnalysisPlan
+    '''
+    process_order, gr_st = dependency_order(node_mgr, draw=False)
+    template, _ = graph_template(node_mgr.derived_nodes)
+    available = set(process_order)
+    hdf_keys = set(node_mgr.hdf_keys)
+    alignment = {}
+    nodes = {}
+    usage = {}
+    for name in process_order:
+        if name not in node_mgr.derived_nodes:
+            continue
+        usage[name] = len(gr_st.predecessors(name))
+        if name in hdf_keys:
+            continue
+        node = node_mgr.derived_nodes[name]
+        nodes[name] = {
+            'node_type': node.__base__.__name__,
+            'module': node.__module__,
+            'dependencies': [d for d in node.get_dependency_names()
+                             if d in available],
+        }
+        alignment[name] = _alignment(node, available)
+    return AnalysisPlan(
+        process_order=process_order,
+        lfl_parameters=[name for name in process_order if name in hdf_keys],
+        alignment=alignment,
+        nodes=nodes,
+        usage=usage,
+        dependency_tree=dumps_dependency_tree(gr_st),
+        requested=sorted(node_mgr.requested),
+        required=sorted(node_mgr.required),
+        available=_available_names(node_mgr, template),
+        attribute_values=_attribute_values(node_mgr, node_mgr.derived_nodes),
+        node_set=_node_set_hash(node_mgr.derived_nodes),
+    )
+
+
+def dump_analysis_plan(plan, dest):
+    '''
+    Save an analysis plan to a destination path as JSON.
+
+    :type plan: AnalysisPlan
+    :type dest: str
+    '''
+    with open(dest, 'wb') as fh:
+        json.dump(plan.todict(), fh, sort_keys=True)
+
+
+def load_analysis_plan(path):
+    '''
+    Load an analysis plan saved with dump_analysis_plan.
+
+    :type path: str
+    :rtype: AnalysisPlan
+    '''
+    with open(path, 'rb') as fh:
+        return AnalysisPlan.fromdict(json.load(fh))
+
+
+def main():
+    from analysis_engine.process_flight import build_analysis_plan
+    parser = argparse.ArgumentParser(
+        description='Create an analysis plan from a representative HDF file '
+        'of a data frame.')
+    parser.add_argument('input_file_path', help='Input hdf filename.')
+    parser.add_argument('output_file_path', help='Output plan filename.')
+    parser.add_argument('--aircraft-info', dest='aircraft_info',
+                        required=True,
+                        help='JSON file containing the aircraft info.')
+    parser.add_argument('-tail', dest='tail_number',
+                        help='Aircraft tail number, if not within the '
+                        'aircraft info.')
+    parser.add_argument('-r', '--requested', type=str, nargs='+',
+                        dest='requested', default=[],
+                        help='Requested nodes.')
+    parser.add_argument('--required', type=str, nargs='+', dest='required',
+                        default=[], help='Required nodes.')
+    args = parser.parse_args()
+    if not os.path.isfile(args.input_file_path):
+        parser.error("Input file path '%s' does not exist." %
+                     args.input_file_path)
+    with open(args.aircraft_info, 'rb') as fh:
+        aircraft_info = json.load(fh)
+    tail_number = args.tail_number or aircraft_info.get('Tail Number')
+    plan = build_analysis_plan(args.input_file_path, tail_number,
+                               aircraft_info,
+                               requested=args.requested,
+                               required=args.required)
+    dump_analysis_plan(plan, args.output_file_path)
+    print '%r written to %s' % (plan, args.output_file_path)
+
+
+if __name__ == '__main__':
+    main()
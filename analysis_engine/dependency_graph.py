@@ -1,11 +1,16 @@
+import base64
+import hashlib
 import os
+import struct
 import sys
 import logging 
+import zlib
 import networkx as nx # pip install networkx or /opt/epd/bin/easy_install networkx
+import numpy as np
+import simplejson as json
 
 from collections import deque
-
-from flightdatautilities.dict_helpers import dict_filter
+from networkx.readwrite import json_graph
 
 from analysis_engine.node import (
     ApproachNode,
@@ -20,6 +25,13 @@ from analysis_engine.node import (
 logger = logging.getLogger(__name__)
 not_windows = sys.platform not in ('win32', 'win64') # False for Windows :-(
 
+# Compact dependency tree encoding, see dumps_dependency_tree().
+DEPENDENCY_TREE_PREFIX = 'dtg1:'
+DEPENDENCY_TREE_HASH_PREFIX = 'dtg1-sha1:'
+DEPENDENCY_TREE_EXTENSION = '.dtg'
+# Node attributes stored as indices into tables of their distinct values.
+DEPENDENCY_TREE_ATTRIBUTES = ('color', 'node_type')
+
 """
 TODO:
 =====
@@ -120,6 +132,15 @@ def dependencies3(di_graph, root, node_mgr):
     Heading -> Heading True + Magnetic Variation
     Heading True -> Heading - Magnetic Variation
     
+    The search is iterative rather than recursive so that deep dependency
+    chains cannot exceed Python's recursion limit. Nodes found to be
+    inoperable are remembered along with the nodes which were visited to
+    establish this and the circular dependencies which were avoided. The
+    outcome is reused rather than searching the same branch again while none
+    of the visited nodes have since become operational and the circular
+    dependencies are still within the current path, as searching the branch
+    again would not change the outcome.
+    
     :param di_graph: Directed graph of all nodes and their dependencies.
     :type di_graph: nx.DiGraph
     :param root: Root node to start traversing from, usually named 'root'
@@ -127,42 +148,84 @@ def dependencies3(di_graph, root, node_mgr):
     :param node_mgr: Node manager which can assess whether nodes are operational with the available dependencies at each layer of the tree.
     :type node_mgr: analysis_engine.node.NodeManager
     '''
-    def traverse_tree(node):
-        "Begin the recursion at this node's position in the dependency tree"
-        if node in path:
-            # add node for it to be removed (pop'd) in a moment
-            path.append(node)
+    def visit(node):
+        '''
+        Returns the outcome of visiting this node if already known, otherwise
+        adds the node to the path and stack to search its dependencies.
+        
+        Outcomes are a tuple of whether the node is available, the inoperable
+        nodes visited and the circular dependencies avoided (nodes in the
+        path at the time).
+        '''
+        if node in path_nodes:
             # we've met this node before; start of circular dependency?
             logger.info("Circular dependency avoided at node '%s'. "
-                        "Branch path: %s", node, path)
-            return False  # establishing if available; cannot yet be available
-        # we're recursing down
-        path.append(node)
+                        "Branch path: %s", node, list(path) + [node])
+            # establishing if available; cannot yet be available
+            return False, set(), set([node])
         if node in active_nodes:
             # node already discovered operational
-            return True
-        
-        layer = []  # layer of current node's available dependencies
-        for dependency in di_graph.successors(node):
-            # traverse again, 'like we did last summer'
-            if traverse_tree(dependency):
-                layer.append(dependency)
-            # each time traverse_tree returns, remove node from visited path
-            path.pop()
-            
-        if node_mgr.operational(node, layer):
-            # node will work at this level with the available dependencies
-            active_nodes.add(node)
-            ordering.append(node)
-            return True  # layer below works
-        else:
-            # node will not work with available dependencies
-            return False
-        
+            return True, None, None
+        if node in inoperable:
+            visited, circular, version = inoperable[node]
+            if circular <= path_nodes and \
+               visited.isdisjoint(ordering[version:]):
+                # node will still not work with available dependencies
+                inoperable[node][2] = len(ordering)
+                return False, visited, circular
+            del inoperable[node]
+        # we're searching down
+        path.append(node)
+        path_nodes.add(node)
+        stack.append((node, iter(di_graph.successors(node)), [],
+                      set([node]), set(), len(ordering)))
+        return None
+    
     ordering = []
     path = deque()  # current branch path
+    path_nodes = set()  # nodes within the current branch path
     active_nodes = set()  # operational nodes visited for fast lookup
-    traverse_tree(root)  # start recursion
+    inoperable = {}  # inoperable nodes: [visited, circular, len(ordering)]
+    stack = []  # nodes with dependencies being searched
+    visit(root)
+    while stack:
+        node, dependencies, layer, visited, circular, version = stack[-1]
+        for dependency in dependencies:
+            outcome = visit(dependency)
+            if outcome is None:
+                # search the dependency's dependencies first
+                break
+            available, dep_visited, dep_circular = outcome
+            if available:
+                layer.append(dependency)
+            else:
+                visited.update(dep_visited)
+                circular.update(dep_circular)
+        else:
+            # all dependencies searched; remove node from the path
+            stack.pop()
+            path.pop()
+            path_nodes.discard(node)
+            if node_mgr.operational(node, layer):
+                # node will work at this level with the available dependencies
+                active_nodes.add(node)
+                ordering.append(node)
+                available = True
+            else:
+                # node will not work with available dependencies
+                circular.discard(node)
+                if len(ordering) == version:
+                    # no nodes became operational during the search
+                    inoperable[node] = [visited, circular, version]
+                available = False
+            if stack:
+                # pass the outcome to the dependent node
+                dependent = stack[-1]
+                if available:
+                    dependent[2].append(node)
+                else:
+                    dependent[3].update(visited)
+                    dependent[4].update(circular)
     return ordering
 
 
@@ -234,6 +297,107 @@ def any_predecessors_in_requested(node_name, requested, graph):
         return False
 
 
+def _components(graph, sources):
+    '''
+    Labels the strongly connected components of the nodes reachable from
+    sources, i.e. nodes within circular dependencies of each other share a
+    component. Uses Tarjan's algorithm without recursion, as implemented by
+    nx.strongly_connected_components, but only searches the successors of the
+    sources rather than the whole graph.
+    
+    :param graph: Directed graph of all nodes and their dependencies.
+    :type graph: nx.DiGraph or GraphOverlay
+    :param sources: Nodes to search from.
+    :type sources: List of Strings/objects
+    :returns: Component index of each node reachable from sources.
+    :rtype: dict
+    '''
+    preorder = {}
+    lowlink = {}
+    component = {}
+    scc_queue = []
+    for source in sources:
+        if source in component:
+            continue
+        queue = [source]
+        while queue:
+            node = queue[-1]
+            if node not in preorder:
+                preorder[node] = len(preorder)
+            successors = graph.successors(node)
+            for successor in successors:
+                if successor not in preorder:
+                    queue.append(successor)
+                    break
+            else:
+                lowlink[node] = preorder[node]
+                for successor in successors:
+                    if successor not in component:
+                        if preorder[successor] > preorder[node]:
+                            lowlink[node] = min(lowlink[node],
+                                                lowlink[successor])
+                        else:
+                            lowlink[node] = min(lowlink[node],
+                                                preorder[successor])
+                queue.pop()
+                if lowlink[node] == preorder[node]:
+                    index = len(component)
+                    component[node] = index
+                    while scc_queue and \
+                          preorder[scc_queue[-1]] > preorder[node]:
+                        component[scc_queue.pop()] = index
+                else:
+                    scc_queue.append(node)
+    return component
+
+
+def requested_roots(graph, requested):
+    '''
+    Finds the requested nodes which must be linked to the root of the tree,
+    i.e. those which are not dependencies of another requested node. Linking
+    the other requested nodes to the root is unnecessary as the tree will be
+    built inclusive of them.
+    
+    Requested nodes within circular dependencies of each other are
+    dependencies of one another, so only the first of them to be requested
+    is linked to the root when none of them are otherwise dependencies. The
+    graph is searched once from all the requested nodes, in O(V+E) time.
+    
+    :param graph: Directed graph of all nodes and their dependencies.
+    :type graph: nx.DiGraph or GraphOverlay
+    :param requested: List of nodes requested
+    :type requested: List of Strings/objects
+    :returns: Requested nodes to link to the root in the order requested.
+    :rtype: List of Strings/objects
+    '''
+    for node in requested:
+        if node not in graph:
+            raise nx.NetworkXError("The node %s is not in the digraph." % node)
+    # nodes within circular dependencies share a component
+    component = _components(graph, requested)
+    # components which are dependencies of a requested node in another
+    # component
+    dependencies = set()
+    visited = set(requested)
+    queue = deque(visited)
+    while queue:
+        node = queue.popleft()
+        for dependency in graph.successors(node):
+            if component[dependency] != component[node]:
+                dependencies.add(component[dependency])
+            if dependency not in visited:
+                visited.add(dependency)
+                queue.append(dependency)
+    roots = []
+    linked = set()  # components linked to the root
+    for node in requested:
+        if component[node] not in dependencies and \
+           component[node] not in linked:
+            roots.append(node)
+            linked.add(component[node])
+    return roots
+
+
 def graph_adjacencies(graph):
     '''
     Create a dictionary of each nodes adjacencies within the graph. Useful for
@@ -255,19 +419,28 @@ def graph_adjacencies(graph):
     return data
 
 
-def graph_nodes(node_mgr):
+# Template graphs keyed by the derived nodes they were built from.
+_graph_templates = {}
+
+
+def graph_template(derived_nodes):
     """
-    :param node_mgr:
-    :type node_mgr: NodeManager
+    Builds the static graph of all derived nodes and their dependencies.
+    
+    The template only depends upon the derived nodes so is built once per
+    process and shared between flights. It must not be modified; flights
+    are overlaid upon it by GraphOverlay.
+    
+    :param derived_nodes: Derived node classes keyed by name.
+    :type derived_nodes: dict
+    :returns: Template graph and the dependency names of each derived node in order.
+    :rtype: (nx.DiGraph, dict)
     """
-    # gr_all will contain all nodes
-    gr_all = nx.DiGraph()
-    # create nodes without attributes now as you can only add attributes once
-    # (limitation of add_node_attribute())
-    gr_all.add_nodes_from(node_mgr.hdf_keys, color='#72f4eb', # turquoise
-                          node_type='HDFNode')
-    derived_minus_lfl = dict_filter(node_mgr.derived_nodes,
-                                    remove=node_mgr.hdf_keys)
+    key = frozenset(derived_nodes.iteritems())
+    if key in _graph_templates:
+        return _graph_templates[key]
+    
+    template = nx.DiGraph()
     # Group into node types to apply colour. TODO: Make colours less garish.
     colors = {
         ApproachNode: '#663399', # purple
@@ -278,80 +451,178 @@ def graph_nodes(node_mgr):
         KeyPointValueNode: '#bed630',  # fds-green
         KeyTimeInstanceNode: '#fdbb30',  # fds-orange
     }
-    derived_nodes = []
-    for name, node in derived_minus_lfl.items():
+    dependencies = {}
+    for name, node in derived_nodes.iteritems():
         # the default is gray, if you see it, something is wrong
         color = '#888888'
         for base in node.__bases__:
             if base in colors:
                 color = colors[base]
                 break
+        template.add_node(name, color=color,
+                          node_type=node.__base__.__name__)
+        dependencies[name] = node.get_dependency_names()
+        template.add_edges_from((name, dep) for dep in dependencies[name])
+    
+    _graph_templates[key] = template, dependencies
+    return template, dependencies
+
 
-        node_info = (name, {'color': color,
-                            'node_type': node.__base__.__name__})
-        derived_nodes.append(node_info)
-    gr_all.add_nodes_from(derived_nodes)
+class _OverlayAttributes(dict):
+    '''
+    Node attributes of a GraphOverlay, created from the template or the
+    flight when first accessed.
+    '''
+    def __init__(self, overlay):
+        super(_OverlayAttributes, self).__init__()
+        self.overlay = overlay
     
-    # build list of dependencies
-    derived_deps = set()  # list of derived dependencies
-    for node_name, node_obj in derived_minus_lfl.iteritems():
-        derived_deps.update(node_obj.get_dependency_names())
-        # Create edges between node and its dependencies
-        edges = [(node_name, dep, {}) for dep in node_obj.get_dependency_names()]
-        gr_all.add_edges_from(edges)
-            
-    # add root - the top level application dependency structure based on required nodes
-    # filter only nodes which are at the top of the tree (no predecessors)
-    # TODO: Ask Chris about this causing problems with the trimmer.
-    gr_all.add_node('root', color='#ffffff')
-    root_edges = []
-    for node_req in node_mgr.requested:
-        if any_predecessors_in_requested(node_req, node_mgr.requested, gr_all):
-            # no need to link root to this requested node as one of it's
-            # predecessors will have the link therefore the tree will be
-            # built inclusive of this node.
-            continue
+    def __missing__(self, node):
+        overlay = self.overlay
+        if node not in overlay:
+            raise KeyError(node)
+        if node == 'root':
+            attributes = {'color': '#ffffff'}
+        elif node in overlay.hdf_keys:
+            attributes = {'color': '#72f4eb', # turquoise
+                          'node_type': 'HDFNode'}
+        elif node in overlay.missing:
+            attributes = {'color': '#6a6e70'}  # fds-grey
         else:
-            # This node is required to build the tree
-            root_edges.append(('root', node_req))
-    gr_all.add_edges_from(root_edges) ##, color='red')
-    
-    #TODO: Split this up into the following lists of nodes
-    # * LFL used
-    # * LFL unused
-    # * Derived used
-    # * Derived not operational
-    # * Derived not used -- coz not referenced by a dependency kpv etc therefore not part of the spanning tree
-    
-    # Note: It's hard to tell whether a missing dependency is a mistyped
-    # reference to another derived parameter or a parameter not available on
-    # this LFL
-    # Set of all derived and LFL Nodes.
-    ##available_nodes = set(node_mgr.derived_nodes.keys()).union(set(node_mgr.hdf_keys))
-    available_nodes = set(node_mgr.keys())
-    # Missing dependencies.
-    missing_derived_dep = list(derived_deps - available_nodes)
-    # Missing dependencies which are requested.
-    missing_requested = list(set(node_mgr.requested) - available_nodes)
-    
-    if missing_derived_dep:
-        logger.warning("Found %s dependencies which don't exist in LFL "
-                       "or Node modules.", len(missing_derived_dep))
-        logger.debug("The missing dependencies: %s", missing_derived_dep)
-    if missing_requested:
-        raise ValueError("Missing requested parameters: %s" % missing_requested)
-
-    # Add missing nodes to graph so it shows everything. These should all be
-    # RAW parameters missing from the LFL unless something has gone wrong with
-    # the derived_nodes dict!
-    gr_all.add_nodes_from(missing_derived_dep, color='#6a6e70')  # fds-grey
+            attributes = dict(overlay.template.node[node])
+        self[node] = attributes
+        return attributes
+
+
+class GraphOverlay(object):
+    '''
+    Graph of all nodes for a flight, overlaying the available HDF parameters
+    and requested nodes onto the template graph of derived nodes without
+    copying it.
+    
+    HDF parameters replace derived nodes of the same name, so the template's
+    dependencies of those nodes are ignored. Node attributes are copied from
+    the template when first accessed so that the template is not modified.
+    Only the parts of the nx.DiGraph interface used to search the graph and
+    take the spanning tree of active nodes are provided; graph_nodes creates
+    the complete graph, e.g. to draw it.
+    '''
+    def __init__(self, node_mgr):
+        '''
+        :param node_mgr:
+        :type node_mgr: NodeManager
+        :raises ValueError: If requested nodes are not available.
+        '''
+        self.template, self.dependencies = \
+            graph_template(node_mgr.derived_nodes)
+        self.hdf_keys = set(node_mgr.hdf_keys)
+        # HDF parameters replace derived nodes of the same name.
+        self.derived = set(node_mgr.derived_nodes) - self.hdf_keys
+        derived_deps = set()  # list of derived dependencies
+        for node_name in self.derived:
+            derived_deps.update(self.dependencies[node_name])
+        self._nodes = self.hdf_keys | self.derived | derived_deps
+        self._nodes.add('root')
+        self.node = _OverlayAttributes(self)
+        
+        # add root - the top level application dependency structure based
+        # on requested nodes
+        self.roots = []
+        self.roots = requested_roots(self, node_mgr.requested)
+        # successors of the root in the order a graph iterates them
+        self._root_successors = list(dict.fromkeys(self.roots))
+        
+        # Note: It's hard to tell whether a missing dependency is a mistyped
+        # reference to another derived parameter or a parameter not available
+        # on this LFL
+        available_nodes = set(node_mgr.keys())
+        # Missing dependencies. These should all be RAW parameters missing
+        # from the LFL unless something has gone wrong with the derived_nodes
+        # dict!
+        self.missing = derived_deps - available_nodes
+        # Missing dependencies which are requested.
+        missing_requested = list(set(node_mgr.requested) - available_nodes)
+        if self.missing:
+            logger.warning("Found %s dependencies which don't exist in LFL "
+                           "or Node modules.", len(self.missing))
+            logger.debug("The missing dependencies: %s", list(self.missing))
+        if missing_requested:
+            raise ValueError(
+                "Missing requested parameters: %s" % missing_requested)
+    
+    def __contains__(self, node):
+        return node in self._nodes
+    
+    def __iter__(self):
+        return iter(self._nodes)
+    
+    def __len__(self):
+        return len(self._nodes)
+    
+    def nodes(self):
+        return list(self._nodes)
+    
+    def successors(self, node):
+        '''
+        :returns: Dependencies of the node in the order of the template.
+        :rtype: list
+        '''
+        if node == 'root':
+            return list(self._root_successors)
+        if node in self.derived:
+            return self.template.successors(node)
+        if node in self._nodes:
+            return []
+        raise nx.NetworkXError("The node %s is not in the digraph." % (node,))
+    
+    def subgraph(self, nbunch):
+        '''
+        Creates the graph of the nodes in nbunch and the edges between them.
+        Node attributes are shared with the overlay as with
+        nx.DiGraph.subgraph.
+        
+        :param nbunch: Nodes to include.
+        :type nbunch: iterable
+        :rtype: nx.DiGraph
+        '''
+        # add nodes and edges in the same order as nx.DiGraph.subgraph so that
+        # the graph is iterated, and encoded, identically
+        nodes = list(dict.fromkeys(nbunch))
+        graph = nx.DiGraph()
+        graph.add_nodes_from(nodes)
+        for node in nodes:
+            graph.node[node] = self.node[node]
+        graph.add_edges_from([(node, dep) for node in nodes
+                              for dep in self.successors(node)
+                              if dep in graph])
+        return graph
+
+
+def graph_nodes(node_mgr):
+    """
+    Creates the complete graph of all nodes for the flight from the
+    GraphOverlay of the template graph of derived nodes, e.g. to draw it.
+    
+    :param node_mgr:
+    :type node_mgr: NodeManager
+    :rtype: nx.DiGraph
+    """
+    overlay = GraphOverlay(node_mgr)
+    # gr_all will contain all nodes
+    gr_all = nx.DiGraph()
+    gr_all.add_nodes_from((node, overlay.node[node]) for node in overlay)
+    for node_name in overlay.derived:
+        # Create edges between node and its dependencies
+        gr_all.add_edges_from((node_name, dep)
+                              for dep in overlay.dependencies[node_name])
+    gr_all.add_edges_from(('root', node) for node in overlay.roots)
     return gr_all
 
 
 def process_order(gr_all, node_mgr, raise_inoperable_requested=False):
     """
     :param gr_all:
-    :type gr_all: nx.DiGraph
+    :type gr_all: nx.DiGraph or GraphOverlay
     :param node_mgr: 
     :type node_mgr: NodeManager
     :returns:
@@ -366,15 +637,18 @@ def process_order(gr_all, node_mgr, raise_inoperable_requested=False):
         
     inactive_nodes = set(gr_all.nodes()) - set(process_order)
     logger.debug("Inactive nodes: %s", list(sorted(inactive_nodes)))
-    gr_st = gr_all.copy()
-    gr_st.remove_nodes_from(inactive_nodes)
+    # spanning tree of active nodes; shares node and edge attributes with
+    # gr_all rather than copying the whole graph.
+    gr_st = gr_all.subgraph(process_order)
     
     for node in inactive_nodes:
         # add attributes to the node to reflect it's inactivity
         gr_all.node[node]['color'] = '#c0c0c0'  # silver
         gr_all.node[node]['active'] = False
-        inactive_edges = gr_all.in_edges(node)
-        gr_all.add_edges_from(inactive_edges, color='#c0c0c0')  # silver
+        if isinstance(gr_all, nx.DiGraph):
+            # GraphOverlay does not hold edge attributes
+            inactive_edges = gr_all.in_edges(node)
+            gr_all.add_edges_from(inactive_edges, color='#c0c0c0')  # silver
         
     inoperable_requested = list(set(node_mgr.requested) - set(process_order))
     if inoperable_requested:
@@ -435,7 +709,8 @@ def dependency_order(node_mgr, draw=not_windows,
     :returns: List of Nodes determining the order for processing and the spanning tree graph.
     :rtype: (list of strings, dict)
     """
-    _graph = graph_nodes(node_mgr)
+    # the complete graph is only created to draw it
+    _graph = graph_nodes(node_mgr) if draw else GraphOverlay(node_mgr)
     gr_all, gr_st, order = process_order(_graph, node_mgr,
                                          raise_inoperable_requested)
     
@@ -452,3 +727,316 @@ def dependency_order(node_mgr, draw=not_windows,
     return order, gr_st
 
 
+
+
+def _processing_dependencies(gr_st, order=None):
+    '''
+    :returns: Processing order and the dependencies of each node processed before it.
+    :rtype: ([str], dict)
+    '''
+    if order is None:
+        # edges point from nodes to their dependencies
+        order = nx.topological_sort(gr_st)[::-1]
+    order = [node for node in order if node != 'root']
+    position = dict((node, n) for n, node in enumerate(order))
+    dependencies = {}
+    for node in order:
+        dependencies[node] = [
+            d for d in gr_st.successors(node)
+            if position.get(d, len(order)) < position[node]]
+    return order, dependencies
+
+
+def _longest_paths(order, dependencies, costs):
+    '''
+    Finish time of each node if processed as soon as its dependencies have
+    finished, with unlimited workers.
+    
+    :returns: Finish time of each node and the dependency finishing last.
+    :rtype: (dict, dict)
+    '''
+    finish = {}
+    latest = {}
+    for node in order:
+        start = 0
+        latest[node] = None
+        for dependency in dependencies[node]:
+            if finish[dependency] > start:
+                start = finish[dependency]
+                latest[node] = dependency
+        finish[node] = start + costs.get(node, 0)
+    return finish, latest
+
+
+def critical_path(gr_st, costs, order=None):
+    '''
+    The critical path is the chain of dependent nodes with the greatest total
+    cost, which bounds the time taken to process all nodes however many
+    nodes are processed in parallel.
+    
+    Only dependencies processed before each node are followed, so that the
+    spanning tree may contain circular dependencies when given the process
+    order.
+    
+    :param gr_st: Spanning tree of active nodes.
+    :type gr_st: nx.DiGraph
+    :param costs: Measured cost (e.g. seconds) of processing each node. Nodes without a cost are assumed to cost nothing.
+    :type costs: dict
+    :param order: Order the nodes are processed in, dependencies first. Defaults to a topological sort of gr_st.
+    :type order: [str]
+    :returns: Length of the critical path and its nodes in processing order.
+    :rtype: (float, [str])
+    :raises nx.NetworkXUnfeasible: If order is not provided and gr_st contains circular dependencies.
+    '''
+    order, dependencies = _processing_dependencies(gr_st, order)
+    finish, latest = _longest_paths(order, dependencies, costs)
+    if not finish:
+        return 0, []
+    node = max(order, key=finish.get)
+    length = finish[node]
+    path = []
+    while node is not None:
+        path.append(node)
+        node = latest[node]
+    return length, path[::-1]
+
+
+def parallelism_analysis(gr_st, costs, order=None, workers=(1, 2, 4, 8, 16),
+                         top=10):
+    '''
+    Analyses how much processing the nodes of the spanning tree could
+    benefit from parallel scheduling and which nodes to optimise first.
+    
+    The theoretical speed-up with N workers is the total cost divided by the
+    greater of the total cost shared between N workers and the critical path
+    length. Levels group nodes by the longest chain of dependencies beneath
+    them; nodes within a level are independent of each other. Each node on
+    the critical path is scored by how much the critical path would shorten
+    if its cost were removed entirely.
+    
+    :param gr_st: Spanning tree of active nodes.
+    :type gr_st: nx.DiGraph
+    :param costs: Measured cost (e.g. seconds) of processing each node. Nodes without a cost are assumed to cost nothing.
+    :type costs: dict
+    :param order: Order the nodes are processed in, dependencies first. Defaults to a topological sort of gr_st.
+    :type order: [str]
+    :param workers: Numbers of workers to calculate the speed-up for.
+    :type workers: [int]
+    :param top: Number of widest levels and critical nodes to report.
+    :type top: int
+    :returns: Analysis which can be serialised as JSON.
+    :rtype: dict
+    :raises nx.NetworkXUnfeasible: If order is not provided and gr_st contains circular dependencies.
+    '''
+    length, path = critical_path(gr_st, costs, order)
+    order, dependencies = _processing_dependencies(gr_st, order)
+    total = sum(costs.get(node, 0) for node in order)
+    
+    levels = {}
+    level = {}
+    for node in order:
+        level[node] = max([level[d] + 1 for d in dependencies[node]] or [0])
+        levels.setdefault(level[node], []).append(node)
+    widest = sorted(levels.iteritems(), key=lambda l: (-len(l[1]), l[0]))
+    
+    savings = []
+    for node in path:
+        cost = costs.get(node, 0)
+        if not cost:
+            continue
+        reduced = dict(costs)
+        reduced[node] = 0
+        reduced_finish = _longest_paths(order, dependencies, reduced)[0]
+        savings.append((length - max(reduced_finish.values()), cost, node))
+    savings.sort(key=lambda s: (-s[0], -s[1], s[2]))
+    
+    def speedup(n):
+        span = max(float(total) / n, length)
+        return float(total) / span if span else 1.0
+    
+    return {
+        'nodes': len(order),
+        'total_cost': total,
+        'critical_path_length': length,
+        'critical_path': path,
+        'speedup': [{'workers': n, 'speedup': speedup(n)} for n in workers],
+        'max_speedup': total / float(length) if length else 1.0,
+        'widest_levels': [
+            {'level': l, 'width': len(nodes),
+             'cost': sum(costs.get(node, 0) for node in nodes),
+             'nodes': sorted(nodes)} for l, nodes in widest[:top]],
+        'critical_nodes': [
+            {'node': node, 'cost': cost, 'saving': saving}
+            for saving, cost, node in savings[:top]],
+    }
+
+
+def parallelism_report(analysis, fmt='text'):
+    '''
+    Formats the output of parallelism_analysis for export.
+    
+    :param analysis: Output of parallelism_analysis.
+    :type analysis: dict
+    :param fmt: Either 'text' or 'json'.
+    :type fmt: str
+    :rtype: str
+    '''
+    if fmt == 'json':
+        from json import dumps
+        return dumps(analysis, indent=2, sort_keys=True)
+    elif fmt != 'text':
+        raise ValueError("Unknown report format '%s'" % fmt)
+    lines = [
+        'Nodes: %d' % analysis['nodes'],
+        'Total cost: %.3f' % analysis['total_cost'],
+        'Critical path length: %.3f' % analysis['critical_path_length'],
+        'Maximum speed-up: %.2fx' % analysis['max_speedup'],
+        '',
+        'Speed-up by workers:',
+    ]
+    for speedup in analysis['speedup']:
+        lines.append('  %4d: %.2fx' % (speedup['workers'], speedup['speedup']))
+    lines.extend(['', 'Critical path:'])
+    lines.extend('  - %s' % node for node in analysis['critical_path'])
+    lines.extend(['', 'Widest levels:'])
+    for level in analysis['widest_levels']:
+        lines.append('  Level %d: %d nodes, cost %.3f' % (
+            level['level'], level['width'], level['cost']))
+    lines.extend(['', 'Nodes shortening the critical path most:'])
+    for node in analysis['critical_nodes']:
+        lines.append('  %s: saving %.3f of cost %.3f' % (
+            node['node'], node['saving'], node['cost']))
+    return '\n'.join(lines)
+
+
+def _pack_strings(strings):
+    packed = '\n'.join(strings).encode('utf-8')
+    return struct.pack('<I', len(packed)) + packed
+
+
+def _unpack_strings(data, offset):
+    length, = struct.unpack_from('<I', data, offset)
+    offset += 4
+    packed = data[offset:offset + length]
+    return (packed.split('\n') if packed else []), offset + length
+
+
+def _unpack_ids(data, offset, dtype, count):
+    ids = np.frombuffer(data, dtype=dtype, count=count, offset=offset)
+    return ids, offset + ids.nbytes
+
+
+def dumps_dependency_tree(gr_st):
+    '''
+    Encodes the spanning tree of active nodes compactly for storing within
+    processed HDF files.
+    
+    Nodes are replaced by integer ids into a table of node names, with edges
+    and the processing order (taken from node labels) packed into arrays of
+    ids. Node colours and types are stored as indices into tables of their
+    distinct values. The encoding is compressed and base64 encoded so that
+    it can be stored as a string attribute.
+    
+    :param gr_st: Spanning tree of active nodes.
+    :type gr_st: nx.DiGraph
+    :returns: Encoded dependency tree prefixed by DEPENDENCY_TREE_PREFIX.
+    :rtype: str
+    '''
+    names = sorted(gr_st.nodes())
+    ids = dict((name, n) for n, name in enumerate(names))
+    dtype = '<u2' if len(names) <= 0xffff else '<u4'
+    labelled = [(int(attrs['label'].split(':', 1)[0]), name)
+                for name, attrs in gr_st.nodes_iter(data=True)
+                if 'label' in attrs]
+    order = np.array([ids[name] for _, name in sorted(labelled)], dtype=dtype)
+    edges = np.array([(ids[u], ids[v]) for u, v in gr_st.edges_iter()],
+                     dtype=dtype).reshape(-1, 2)
+    
+    chunks = [struct.pack('<IIIB', len(names), len(edges), len(order),
+                          np.dtype(dtype).itemsize),
+              _pack_strings(names)]
+    for attribute in DEPENDENCY_TREE_ATTRIBUTES:
+        # index 0 is reserved for nodes without the attribute.
+        values = sorted(set(gr_st.node[name][attribute] for name in names
+                            if attribute in gr_st.node[name]))
+        indices = dict((value, n) for n, value in enumerate(values, start=1))
+        chunks.append(_pack_strings(values))
+        chunks.append(np.array(
+            [indices.get(gr_st.node[name].get(attribute), 0) for name in names],
+            dtype=dtype).tostring())
+    chunks.append(order.tostring())
+    chunks.append(edges.tostring())
+    return DEPENDENCY_TREE_PREFIX + \
+        base64.b64encode(zlib.compress(''.join(chunks), 9))
+
+
+def store_dependency_tree(dependency_tree, store_path):
+    '''
+    Stores an encoded dependency tree within a directory shared between
+    processed HDF files, e.g. per data frame, as the trees of flights with
+    the same LFL and aircraft are usually identical.
+    
+    :param dependency_tree: Output of dumps_dependency_tree.
+    :type dependency_tree: str
+    :param store_path: Directory to store dependency trees within.
+    :type store_path: str
+    :returns: Reference to the stored tree prefixed by DEPENDENCY_TREE_HASH_PREFIX.
+    :rtype: str
+    '''
+    if not dependency_tree.startswith(DEPENDENCY_TREE_PREFIX):
+        raise ValueError('Dependency tree is not compactly encoded.')
+    digest = hashlib.sha1(dependency_tree).hexdigest()
+    path = os.path.join(store_path, digest + DEPENDENCY_TREE_EXTENSION)
+    if not os.path.exists(path):
+        # Write to a temporary file first so that other processes sharing
+        # the store never read a partially written tree.
+        temp_path = '%s.%d.tmp' % (path, os.getpid())
+        with open(temp_path, 'wb') as fh:
+            fh.write(dependency_tree)
+        os.rename(temp_path, path)
+    return DEPENDENCY_TREE_HASH_PREFIX + digest
+
+
+def loads_dependency_tree(dependency_tree, store_path=None):
+    '''
+    Reconstructs the spanning tree of active nodes stored within a processed
+    HDF file, including node colours, types and processing order labels.
+    
+    :param dependency_tree: Output of dumps_dependency_tree, a reference returned by store_dependency_tree or node-link JSON as stored by previous versions.
+    :type dependency_tree: str
+    :param store_path: Directory of stored dependency trees, required for references.
+    :type store_path: str
+    :rtype: nx.DiGraph
+    '''
+    if dependency_tree.startswith(DEPENDENCY_TREE_HASH_PREFIX):
+        if not store_path:
+            raise ValueError('Dependency tree store is required to load '
+                             "reference '%s'." % dependency_tree)
+        digest = dependency_tree[len(DEPENDENCY_TREE_HASH_PREFIX):]
+        path = os.path.join(store_path, digest + DEPENDENCY_TREE_EXTENSION)
+        with open(path, 'rb') as fh:
+            dependency_tree = fh.read()
+    if not dependency_tree.startswith(DEPENDENCY_TREE_PREFIX):
+        return json_graph.node_link_graph(json.loads(dependency_tree))
+    
+    data = zlib.decompress(
+        base64.b64decode(dependency_tree[len(DEPENDENCY_TREE_PREFIX):]))
+    node_count, edge_count, order_count, itemsize = \
+        struct.unpack_from('<IIIB', data)
+    dtype = '<u%d' % itemsize
+    names, offset = _unpack_strings(data, struct.calcsize('<IIIB'))
+    gr_st = nx.DiGraph()
+    gr_st.add_nodes_from(names)
+    for attribute in DEPENDENCY_TREE_ATTRIBUTES:
+        values, offset = _unpack_strings(data, offset)
+        indices, offset = _unpack_ids(data, offset, dtype, node_count)
+        for name, index in zip(names, indices):
+            if index:
+                gr_st.node[name][attribute] = values[index - 1]
+    order, offset = _unpack_ids(data, offset, dtype, order_count)
+    for n, index in enumerate(order):
+        gr_st.node[names[index]]['label'] = '%d: %s' % (n, names[index])
+        gr_st.node[names[index]]['active'] = True
+    edges, offset = _unpack_ids(data, offset, dtype, edge_count * 2)
+    gr_st.add_edges_from((names[u], names[v]) for u, v in edges.reshape(-1, 2))
+    return gr_st
@@ -47,6 +47,7 @@ from analysis_engine.library import (ambiguous_runway,
                                      find_edges_on_state_change,
                                      hysteresis,
                                      index_at_value,
+                                     index_at_values,
                                      index_of_first_start,
                                      index_of_last_stop,
                                      integrate,
@@ -5933,12 +5934,9 @@ class EngGasTempDuringMaximumContinuousPowerForXMinMax(KeyPointValueNode):
             end_at=max(air.slice.stop for air in airborne),
         )
         for minutes in self.NAME_VALUES['minutes']:
-            seconds = minutes * 60
-            if seconds % 2 and eng_egt_max.hz % 2:
-                seconds += 1
             self.create_kpvs_within_slices(
                 ##clip(eng_egt_max.array, minutes * 60, eng_egt_max.hz),
-                second_window(eng_egt_max.array.astype(int), eng_egt_max.hz, seconds),
+                second_window(eng_egt_max.array.astype(int), eng_egt_max.hz, minutes * 60),
                 max_cont_rating,
                 max_value,
                 minutes=minutes,
@@ -6018,12 +6016,7 @@ class EngGasTempDuringEngStartForXSecMax(KeyPointValueNode):
             if not slices:
                 continue
             # second_window is more accurate than clip and much faster
-            if seconds % 2:
-                # shh... we'll add one so that second_window will work!
-                dur = seconds + 1
-            else:
-                dur = seconds
-            array = second_window(eng_egt_max.array.astype(int), eng_egt_max.hz, dur)
+            array = second_window(eng_egt_max.array.astype(int), eng_egt_max.hz, seconds)
             self.create_kpvs_within_slices(array, slices, max_value, seconds=seconds)
 
 
@@ -6862,9 +6855,6 @@ class EngOilTempForXMinMax(KeyPointValueNode):
         for minutes in self.NAME_VALUES['minutes']:
             seconds = minutes * 60 * self.frequency
             # second_window is more accurate than clip and much faster
-            if seconds % 2 and oil_temp.hz % 2:
-                # shh... we'll add one so that second_window will work!
-                seconds += 1
             oil_sustained = second_window(oil_temp.array.astype(int), oil_temp.hz, seconds)
             
             ####oil_sustained = clip(oil_temp.array, minutes * 60, oil_temp.hz)
@@ -10621,9 +10611,10 @@ class WindSpeedAtAltitudeDuringDescent(KeyPointValueNode):
                alt_aal=P('Altitude AAL For Flight Phases'),
                wind_spd=P('Wind Speed')):
 
+        altitudes = self.NAME_VALUES['altitude']
         for descent in alt_aal.slices_from_to(2100, 0):
-            for altitude in self.NAME_VALUES['altitude']:
-                index = index_at_value(alt_aal.array, altitude, descent)
+            indexes = index_at_values(alt_aal.array, altitudes, descent)
+            for altitude, index in zip(altitudes, indexes):
                 if not index:
                     continue
                 value = value_at_index(wind_spd.array, index)
@@ -10646,9 +10637,10 @@ class WindDirectionAtAltitudeDuringDescent(KeyPointValueNode):
                alt_aal=P('Altitude AAL For Flight Phases'),
                wind_dir=P('Wind Direction Continuous')):
 
+        altitudes = self.NAME_VALUES['altitude']
         for descent in alt_aal.slices_from_to(2100, 0):
-            for altitude in self.NAME_VALUES['altitude']:
-                index = index_at_value(alt_aal.array, altitude, descent)
+            indexes = index_at_values(alt_aal.array, altitudes, descent)
+            for altitude, index in zip(altitudes, indexes):
                 if not index:
                     continue
                 # Check direction not masked before using % 360:
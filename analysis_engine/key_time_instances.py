@@ -8,6 +8,7 @@ from analysis_engine.library import (all_of,
                                      find_toc_tod,
                                      first_valid_sample,
                                      index_at_value,
+                                     index_at_values,
                                      is_index_within_slice,
                                      max_value,
                                      minimum_unmasked,
@@ -1297,6 +1298,23 @@ class LandingTurnOffRunway(KeyTimeInstanceNode):
 ################################################################################        
 
 
+def _altitude_indexes(altitudes, alt_aal, alt_std, _slice):
+    '''
+    Indexes where each altitude is first crossed within the slice. Altitudes
+    up to the transition altitude use height above airfield and those above
+    it use standard altitudes.
+
+    :returns: Index of each altitude, or None if it is not crossed.
+    :rtype: [float or None]
+    '''
+    low = [a for a in altitudes if a <= TRANSITION_ALTITUDE]
+    high = [a for a in altitudes if a > TRANSITION_ALTITUDE]
+    indexes = dict(zip(low, index_at_values(alt_aal.array, low, _slice)))
+    if high:
+        indexes.update(zip(high, index_at_values(alt_std.array, high, _slice)))
+    return [indexes[a] for a in altitudes]
+
+
 class AltitudeWhenClimbing(KeyTimeInstanceNode):
     '''
     Creates KTIs at certain altitudes when the aircraft is climbing.
@@ -1307,18 +1325,13 @@ class AltitudeWhenClimbing(KeyTimeInstanceNode):
     def derive(self, climbing=S('Climbing'), 
                alt_aal=P('Altitude AAL'),
                alt_std=P('Altitude STD Smoothed')):
+        altitudes = self.NAME_VALUES['altitude']
         for climb in climbing:
-            for alt_threshold in self.NAME_VALUES['altitude']:
-                # Will trigger a single KTI per height (if threshold is crossed)
-                # per climbing phase.
-                if alt_threshold <= TRANSITION_ALTITUDE:
-                    # Use height above airfield.
-                    alt = alt_aal.array
-                else:
-                    # Use standard altitudes.
-                    alt = alt_std.array
-
-                index = index_at_value(alt, alt_threshold, climb.slice)
+            # Will trigger a single KTI per height (if threshold is crossed)
+            # per climbing phase.
+            indexes = _altitude_indexes(altitudes, alt_aal, alt_std,
+                                        climb.slice)
+            for alt_threshold, index in zip(altitudes, indexes):
                 if index:
                     self.create_kti(index, altitude=alt_threshold)
 
@@ -1333,22 +1346,15 @@ class AltitudeWhenDescending(KeyTimeInstanceNode):
     def derive(self, descending=S('Descending'), 
                alt_aal=P('Altitude AAL'),
                alt_std=P('Altitude STD Smoothed')):
+        altitudes = self.NAME_VALUES['altitude']
         for descend in descending:
-            for alt_threshold in self.NAME_VALUES['altitude']:
-                # Will trigger a single KTI per height (if threshold is
-                # crossed) per descending phase. The altitude array is
-                # scanned backwards to make sure we trap the last instance at
-                # each height.
-                if alt_threshold <= TRANSITION_ALTITUDE:
-                    # Use height above airfield.
-                    alt = alt_aal.array
-                else:
-                    # Use standard altitudes.
-                    alt = alt_std.array
-                    
-                index = index_at_value(alt, alt_threshold,
-                                       slice(descend.slice.stop,
-                                             descend.slice.start, -1))
+            # Will trigger a single KTI per height (if threshold is crossed)
+            # per descending phase. The altitude array is scanned backwards
+            # to make sure we trap the last instance at each height.
+            indexes = _altitude_indexes(
+                altitudes, alt_aal, alt_std,
+                slice(descend.slice.stop, descend.slice.start, -1))
+            for alt_threshold, index in zip(altitudes, indexes):
                 if index:
                     self.create_kti(index, altitude=alt_threshold)
 
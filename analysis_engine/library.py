@@ -4,9 +4,11 @@ import numpy as np
 from collections import OrderedDict, namedtuple
 from datetime import datetime, timedelta
 from hashlib import sha256
-from itertools import izip, izip_longest
-from math import asin, atan2, ceil, cos, degrees, floor, radians, sin, sqrt
+from itertools import izip
+from math import atan2, ceil, cos, floor, radians, sin, sqrt
 from scipy import interpolate as scipy_interpolate, optimize
+from scipy.ndimage import maximum_filter1d, minimum_filter1d
+from scipy.signal import lfilter, lfilter_zi
 
 from hdfaccess.parameter import MappedArray
 
@@ -292,67 +294,69 @@ def is_5_10_20(number):
     """
     return number in [5, 10, 20]
 
-def align(slave, master, interpolate=True):
-    """
-    This function takes two parameters which will have been sampled at
-    different rates and with different measurement offsets in time, and
-    aligns the slave parameter's samples to match the master parameter. In
-    this way the master and aligned slave data may be processed without
-    timing errors.
-
-    The values of the returned array will be those of the slave parameter,
-    aligned to the master and adjusted by linear interpolation. The initial
-    or final values will be masked zeros if they lie outside the timebase of
-    the slave parameter (i.e. we do not extrapolate). The offset and hz for
-    the returned masked array will be those of the master parameter.
-
-    MappedArray slave parameters (discrete/multi-state) will not be
-    interpolated, even if interpolate=True.
-
-    Anything other than discrete or multi-state will result in interpolation
-    of the data across each sample period.
-
-    WARNING! Not tested with ASCII arrays.
-
-    :param slave: The parameter to be aligned to the master
-    :type slave: Parameter objects
-    :param master: The master parameter
-    :type master: Parameter objects
-    :param interpolate: Whether to interpolate parameters (multistates exempt)
-    :type interpolate: Bool
+AlignmentPlan = namedtuple(
+    'AlignmentPlan', 'method ratio master_samples slave_samples lower '
+    'lower_weight upper_weight repair_duration frequency')
+_ALIGNMENT_PLANS = {}
 
-    :raises AssertionError: If the arrays and sample rates do not equate to the same overall data duration.
 
-    :returns: Slave array aligned to master.
-    :rtype: np.ma.array
+def alignment_plan(slave_frequency, slave_offset, master_frequency,
+                   master_offset, interpolate=True):
     """
-    slave_array = slave.array # Optimised access to attribute.
-    if isinstance(slave_array, MappedArray):  # Multi-state array.
-        # force disable interpolate!
-        slave_array = slave_array.raw
-        interpolate = False
-        _dtype = int
-    elif isinstance(slave_array, np.ma.MaskedArray):
-        _dtype = float
-    else:
-        raise ValueError('Cannot align slave array of unknown type: '
-            'Slave: %s, Master: %s.', slave.name, master.name)
+    The interpolation coefficients for aligning a slave parameter to a
+    master parameter only depend upon their frequencies and offsets, so
+    plans are cached and shared by every alignment between the same
+    timebases.
+
+    Within each period of master_samples aligned samples (and slave_samples
+    slave samples), the aligned sample at phase i is
+
+        lower_weight[i] * slave[lower[i]] + upper_weight[i] * slave[lower[i] + 1]
+
+    with slave indices relative to the start of the period.
+
+    The method is one of:
+
+     * 'same': No alignment is required.
+     * 'upsample': Slave samples are spread out and the gaps repaired.
+     * 'downsample': Every slave_samples'th slave sample is taken.
+     * 'interpolate': Slave samples are interpolated for each phase.
+
+    :param slave_frequency: Frequency of the slave parameter.
+    :type slave_frequency: float
+    :param slave_offset: Offset of the slave parameter.
+    :type slave_offset: float
+    :param master_frequency: Frequency of the master parameter.
+    :type master_frequency: float
+    :param master_offset: Offset of the master parameter.
+    :type master_offset: float
+    :param interpolate: Whether to interpolate, otherwise the closest slave sample is taken.
+    :type interpolate: bool
+    :raises AssertionError: If either sample rate has not been tested.
+    :raises ValueError: If the offsets cannot be aligned.
+    :returns: Plan for aligning slave arrays to the master.
+    :rtype: AlignmentPlan
+    """
+    key = (slave_frequency, slave_offset, master_frequency, master_offset,
+           bool(interpolate))
+    try:
+        return _ALIGNMENT_PLANS[key]
+    except KeyError:
+        pass
 
-    if len(slave_array) == 0:
-        # No elements to align, avoids exception being raised in the loop below.
-        return slave_array
-    if slave.frequency == master.frequency and slave.offset == master.offset:
-        # No alignment is required, return the slave's array unchanged.
-        return slave_array
+    if slave_frequency == master_frequency and slave_offset == master_offset:
+        plan = AlignmentPlan('same', 1.0, 1, 1, None, None, None, None, None)
+        _ALIGNMENT_PLANS[key] = plan
+        return plan
 
     # Get the sample rates for the two parameters
-    wm = master.frequency
-    ws = slave.frequency
+    wm = master_frequency
+    ws = slave_frequency
     slowest = min(wm, ws)
 
     # The timing offsets comprise of word location and possible latency.
     # Express the timing disparity in terms of the slave parameter sample interval
-    delta = (master.offset - slave.offset) * slave.frequency
+    delta = (master_offset - slave_offset) * slave_frequency
 
     # If the slowest sample rate is less than 1 Hz, we extend the period and
     # so achieve a lowest rate of one per period.
@@ -362,55 +366,47 @@ def align(slave, master, interpolate=True):
 
     # Check the values are in ranges we have tested
     assert is_power2(wm) or is_5_10_20(wm), \
-           "master = '%s' @ %sHz; wm=%s" % (master.name, master.hz, wm)
+           "master @ %sHz; wm=%s" % (master_frequency, wm)
     assert is_power2(ws) or is_5_10_20(ws), \
-           "slave = '%s' @ %sHz; ws=%s" % (slave.name, slave.hz, ws)
+           "slave @ %sHz; ws=%s" % (slave_frequency, ws)
 
     # Trap 5, 10 or 20Hz parameters that have non-zero offsets (this case is not currently covered)
-    if is_5_10_20(wm) and master.offset:
-        raise ValueError('Align: Master offset non-zero at sample rate %sHz' %master.frequency)
-    if is_5_10_20(ws) and slave.offset:
-        raise ValueError('Align: Slave offset non-zero at sample rate %sHz' %slave.frequency)
-    
+    if is_5_10_20(wm) and master_offset:
+        raise ValueError('Align: Master offset non-zero at sample rate %sHz' %master_frequency)
+    if is_5_10_20(ws) and slave_offset:
+        raise ValueError('Align: Slave offset non-zero at sample rate %sHz' %slave_frequency)
+
     # Compute the sample rate ratio:
     r = wm / float(ws)
 
-    # Here we create a masked array to hold the returned values that will have
-    # the same sample rate and timing offset as the master
-    len_aligned = int(len(slave_array) * r)
-    if len_aligned != (len(slave_array) * r):
-        raise ValueError("Array length problem in align. Probable cause is flight cutting not at superframe boundary")
-
-    slave_aligned = np.ma.zeros(len(slave_array) * r, dtype=_dtype)
-
     # Where offsets are equal, the slave_array recorded values remain
     # unchanged and interpolation is performed between these values.
     # - and we do not interpolate mapped arrays!
-    if not delta and interpolate and (is_power2(slave.frequency) and
-                                      is_power2(master.frequency)):
-        slave_aligned.mask = True
-        if master.frequency > slave.frequency:
-            # populate values and interpolate
-            slave_aligned[0::r] = slave_array[0::1]
+    if not delta and interpolate and (is_power2(slave_frequency) and
+                                      is_power2(master_frequency)):
+        if master_frequency > slave_frequency:
             # Interpolate and do not extrapolate masked ends or gaps
             # bigger than the duration between slave samples (i.e. where
             # original slave data is masked).
-            # If array is fully masked, return array of masked zeros
-            dur_between_slave_samples = 1.0 / slave.frequency
-            return repair_mask(slave_aligned, frequency=master.frequency,
-                               repair_duration=dur_between_slave_samples,
-                               zero_if_masked=True)
-
+            plan = AlignmentPlan('upsample', r, int(r), 1, None, None, None,
+                                 1.0 / slave_frequency, master_frequency)
         else:
             # step through slave taking the required samples
-            return slave_array[0::1/r]
+            plan = AlignmentPlan('downsample', r, 1, int(round(1 / r)), None,
+                                 None, None, None, None)
+        _ALIGNMENT_PLANS[key] = plan
+        return plan
 
     # Each sample in the master parameter may need different combination parameters
+    lower = np.empty(int(wm), dtype=int)
+    lower_weight = np.empty(int(wm))
+    upper_weight = np.empty(int(wm))
     for i in range(int(wm)):
         bracket = (i / r) + delta
         # Interpolate between the hth and (h+1)th samples of the slave array
         h = int(floor(bracket))
-        h1 = h + 1
+        if h < -ws:
+            raise ValueError('Align called with excessive timing mismatch')
 
         # Compute the linear interpolation coefficients, b & a
         b = bracket - h
@@ -423,35 +419,206 @@ def align(slave, master, interpolate=True):
             b = round(b)
 
         # Either way, a is the residual part.
-        a = 1 - b
-
-        if h < 0:
-            if h<-ws:
-                raise ValueError('Align called with excessive timing mismatch')
-            # slave_array values do not exist in aligned array
-            if ws==1:
-                slave_aligned[i+wm::wm] = a*slave_array[h+ws:-ws:ws] + b*slave_array[h1+ws::ws]
-            else:
-                slave_aligned[i+wm::wm] = a*slave_array[h+ws:-ws:ws] + b*slave_array[h1+ws:1-ws:ws]
-            # We can't interpolate the inital values as we are outside the
-            # range of the slave parameters.
-            # Treat ends as "padding"; Value of 0 and Masked.
-            slave_aligned[i] = 0
-            slave_aligned[i] = np.ma.masked
-        elif h1 >= ws:
-            slave_aligned[i:-wm:wm] = a*slave_array[h:-ws:ws] + b*slave_array[h1::ws]
-            # At the other end, we run out of slave parameter values so need to
-            # pad to the end of the array.
-            # Treat ends as "padding"; Value of 0 and Masked.
-            slave_aligned[i-wm] = 0
-            slave_aligned[i-wm] = np.ma.masked
-        else:
-            # Sheer bliss. We can compute slave_aligned across the whole
-            # range of the data without having to take special care at the
-            # ends of the array.
-            slave_aligned[i::wm] = a*slave_array[h::ws] + b*slave_array[h1::ws]
+        lower[i] = h
+        lower_weight[i] = 1 - b
+        upper_weight[i] = b
+
+    plan = AlignmentPlan('interpolate', r, int(wm), int(ws), lower,
+                         lower_weight, upper_weight, None, None)
+    _ALIGNMENT_PLANS[key] = plan
+    return plan
+
+
+def _alignment_indices(plan, slave_length, aligned_length):
+    '''
+    :returns: Lower slave index and weights of the lower and upper slave samples for each aligned sample, and whether it lies outside of the slave array.
+    :rtype: (np.array, np.array, np.array, np.array)
+    '''
+    periods = -(-aligned_length // plan.master_samples)
+    lower = (np.arange(periods)[:, np.newaxis] * plan.slave_samples +
+             plan.lower).ravel()[:aligned_length]
+    lower_weight = np.tile(plan.lower_weight, periods)[:aligned_length]
+    upper_weight = np.tile(plan.upper_weight, periods)[:aligned_length]
+    # We can't interpolate values outside the range of the slave parameter.
+    # Treat ends as "padding"; Value of 0 and Masked.
+    padding = (lower < 0) | (lower >= slave_length - 1)
+    np.clip(lower, 0, max(slave_length - 2, 0), out=lower)
+    return lower, lower_weight, upper_weight, padding
+
+
+def _apply_alignment_plan(slave_array, indices, dtype, out=None,
+                          out_mask=None):
+    '''
+    Interpolate the slave array at the aligned samples, writing into out and
+    out_mask if provided.
+
+    :returns: Aligned data and mask.
+    :rtype: (np.array, np.array or np.ma.nomask)
+    '''
+    lower, lower_weight, upper_weight, padding = indices
+    upper = np.minimum(lower + 1, len(slave_array) - 1)
+    values = np.ma.getdata(slave_array)
+    aligned = lower_weight * values[lower] + upper_weight * values[upper]
+    if out is None:
+        out = aligned.astype(dtype)
+    else:
+        out[:] = aligned
+    mask = np.ma.getmask(slave_array)
+    padded = padding.any()
+    if mask is not np.ma.nomask and mask.any():
+        mask = mask[lower] | mask[upper] | padding
+    elif padded:
+        mask = padding.copy()
+    else:
+        mask = np.ma.nomask
+    if mask is not np.ma.nomask:
+        # Masked and padded samples are masked zeros.
+        out[mask] = 0
+    if out_mask is not None:
+        out_mask[:] = mask
+    return out, mask
+
+
+def _prepare_alignment(slave, master, interpolate=True):
+    '''
+    :returns: Slave array to align, its dtype once aligned, the alignment plan (None if the array is empty) and the length of the aligned array.
+    :rtype: (np.ma.array, type, AlignmentPlan or None, int)
+    '''
+    slave_array = slave.array # Optimised access to attribute.
+    if isinstance(slave_array, MappedArray):  # Multi-state array.
+        # force disable interpolate!
+        slave_array = slave_array.raw
+        interpolate = False
+        _dtype = int
+    elif isinstance(slave_array, np.ma.MaskedArray):
+        _dtype = float
+    else:
+        raise ValueError('Cannot align slave array of unknown type: '
+            'Slave: %s, Master: %s.', slave.name, master.name)
+
+    if len(slave_array) == 0:
+        # No elements to align.
+        return slave_array, _dtype, None, 0
+
+    plan = alignment_plan(slave.frequency, slave.offset, master.frequency,
+                          master.offset, interpolate=interpolate)
+
+    # The aligned array will have the same sample rate and timing offset as
+    # the master
+    len_aligned = int(len(slave_array) * plan.ratio)
+    if len_aligned != (len(slave_array) * plan.ratio):
+        raise ValueError("Array length problem in align. Probable cause is flight cutting not at superframe boundary")
+    return slave_array, _dtype, plan, len_aligned
+
+
+def _align_with_plan(slave_array, _dtype, plan, len_aligned):
+    '''
+    :returns: Slave array aligned with the plan.
+    :rtype: np.ma.array
+    '''
+    if plan is None or plan.method == 'same':
+        # No alignment is required, return the slave's array unchanged.
+        return slave_array
+    elif plan.method == 'upsample':
+        slave_aligned = np.ma.zeros(len_aligned, dtype=_dtype)
+        slave_aligned.mask = True
+        # populate values and interpolate
+        slave_aligned[0::plan.master_samples] = slave_array
+        # If array is fully masked, return array of masked zeros
+        return repair_mask(slave_aligned, frequency=plan.frequency,
+                           repair_duration=plan.repair_duration,
+                           zero_if_masked=True)
+    elif plan.method == 'downsample':
+        return slave_array[0::plan.slave_samples]
+
+    indices = _alignment_indices(plan, len(slave_array), len_aligned)
+    data, mask = _apply_alignment_plan(slave_array, indices, _dtype)
+    return np.ma.array(data, mask=mask, copy=False)
+
+
+def align(slave, master, interpolate=True):
+    """
+    This function takes two parameters which will have been sampled at
+    different rates and with different measurement offsets in time, and
+    aligns the slave parameter's samples to match the master parameter. In
+    this way the master and aligned slave data may be processed without
+    timing errors.
+
+    The values of the returned array will be those of the slave parameter,
+    aligned to the master and adjusted by linear interpolation. The initial
+    or final values will be masked zeros if they lie outside the timebase of
+    the slave parameter (i.e. we do not extrapolate). The offset and hz for
+    the returned masked array will be those of the master parameter.
+
+    MappedArray slave parameters (discrete/multi-state) will not be
+    interpolated, even if interpolate=True.
+
+    Anything other than discrete or multi-state will result in interpolation
+    of the data across each sample period, using the coefficients of a cached
+    alignment_plan. Use align_many to align several slaves to one master.
+
+    WARNING! Not tested with ASCII arrays.
+
+    :param slave: The parameter to be aligned to the master
+    :type slave: Parameter objects
+    :param master: The master parameter
+    :type master: Parameter objects
+    :param interpolate: Whether to interpolate parameters (multistates exempt)
+    :type interpolate: Bool
+
+    :raises AssertionError: If the arrays and sample rates do not equate to the same overall data duration.
 
-    return slave_aligned
+    :returns: Slave array aligned to master.
+    :rtype: np.ma.array
+    """
+    return _align_with_plan(*_prepare_alignment(slave, master,
+                                                interpolate=interpolate))
+
+
+def align_many(slaves, master, interpolate=True):
+    """
+    Align several slave parameters to the same master parameter, e.g. an
+    engine parameter for each engine, into one preallocated array with a
+    row per slave. Slaves with the same timebase and length share the
+    interpolation indices as well as the alignment plan.
+
+    The result may be passed directly to vstack_params.
+
+    :param slaves: The parameters to be aligned to the master. None values are skipped.
+    :type slaves: [Parameter or None]
+    :param master: The master parameter
+    :type master: Parameter
+    :param interpolate: Whether to interpolate parameters (multistates exempt)
+    :type interpolate: bool
+    :raises ValueError: If there are no slaves or the aligned arrays differ in length.
+    :returns: Slave arrays aligned to master, one row for each slave which is not None.
+    :rtype: np.ma.array
+    """
+    prepared = [_prepare_alignment(s, master, interpolate=interpolate)
+                for s in slaves if s is not None]
+    if not prepared:
+        raise ValueError('No slaves to align.')
+    lengths = set(p[3] if p[2] else len(p[0]) for p in prepared)
+    if len(lengths) > 1:
+        raise ValueError('Aligned slave arrays differ in length: %s' %
+                         sorted(lengths))
+    _dtype = float if any(p[1] is float for p in prepared) else int
+    result = np.ma.zeros((len(prepared), lengths.pop()), dtype=_dtype)
+    result.mask = np.zeros(result.shape, dtype=bool)
+    indices = {}
+    for row, (slave_array, dtype, plan, len_aligned) in enumerate(prepared):
+        if plan is None or plan.method != 'interpolate':
+            array = _align_with_plan(slave_array, dtype, plan, len_aligned)
+            result.data[row] = np.ma.getdata(array)
+            result.mask[row] = np.ma.getmaskarray(array)
+            continue
+        key = (id(plan), len(slave_array))
+        if key not in indices:
+            indices[key] = _alignment_indices(plan, len(slave_array),
+                                              len_aligned)
+        _apply_alignment_plan(slave_array, indices[key], _dtype,
+                              out=result.data[row], out_mask=result.mask[row])
+    return result
 
 
 def align_slices(slave, master, slices):
@@ -886,24 +1053,32 @@ def cycle_counter(array, min_step, max_time, hz, offset=0):
     if idxs is None:
         return Value(None, None)
 
-    index, half_cycles = None, 0
-    max_index, max_half_cycles = None, 0
-
-    # Determine the half cycle times and look for the most cycling:
+    # Determine the half cycle times and look for the most cycling. Runs of
+    # half cycles within the max time are counted until a longer half cycle
+    # ends a run with at least as many half cycles as the most cycling so
+    # far, when the count is recorded and reset.
     half_cycle_times = np.ediff1d(idxs) / hz
-    for n, half_cycle_time in enumerate(half_cycle_times):
-        # If we are within the max time, keep track of the half cycle:
-        if half_cycle_time < max_time:
-            half_cycles += 1
-            index = idxs[n + 1]
-        # Otherwise check if this is the most cycling and reset:
-        elif 0 < half_cycles >= max_half_cycles:
-            max_index, max_half_cycles = index, half_cycles
-            half_cycles = 0
-    else:
-        # Finally check whether the last loop had most cycling:
-        if 0 < half_cycles >= max_half_cycles:
-            max_index, max_half_cycles = index, half_cycles
+    within = half_cycle_times < max_time
+    # Number of half cycles within the max time up to each half cycle and
+    # the positions of the longer half cycles which end a run.
+    counts = np.cumsum(within)
+    ends = np.flatnonzero(within[:-1] & ~within[1:]) + 1
+    run_counts = counts[ends]
+
+    max_index, max_half_cycles, reset = None, 0, 0
+    while True:
+        n = run_counts.searchsorted(reset + max(max_half_cycles, 1))
+        if n == len(run_counts):
+            break
+        max_index = idxs[ends[n]]
+        max_half_cycles = int(run_counts[n] - reset)
+        reset = run_counts[n]
+
+    # Finally check whether the last run had most cycling:
+    half_cycles = int(counts[-1] - reset) if len(counts) else 0
+    if 0 < half_cycles >= max_half_cycles:
+        max_index = idxs[np.flatnonzero(within)[-1] + 1]
+        max_half_cycles = half_cycles
 
     # Ignore single direction movements (we only want full cycles):
     if max_half_cycles < 2:
@@ -940,25 +1115,21 @@ def cycle_select(array, min_step, max_time, hz, offset=0):
     if idxs is None:
         return Value(None, None)
 
-    max_index, max_value = None, 0
-
     # Determine the half cycle times and ptp values for the half cycles:
     half_cycle_times = np.ediff1d(idxs) / hz
     half_cycle_diffs = abs(np.ediff1d(vals))
     if len(half_cycle_diffs)<2:
         return Value(None, None)
-    full_cycle_pairs = zip(half_cycle_times[1:]+half_cycle_times[:-1],
-                           [min(half_cycle_diffs[n],half_cycle_diffs[n+1]) \
-                            for n in range(len(half_cycle_diffs)-1)])
-    for n, (cycle_time, value) in enumerate(full_cycle_pairs):
-        # If we are within the max time and have max difference, keep it:
-        if cycle_time < max_time and value >= max_value:
-            max_index, max_value = idxs[n + 1], value
-
-    if max_index is None:
+    cycle_times = half_cycle_times[1:] + half_cycle_times[:-1]
+    values = np.minimum(half_cycle_diffs[1:], half_cycle_diffs[:-1])
+    # Select the cycle within the max time with the greatest difference,
+    # taking the latest of equal differences.
+    cycles = np.flatnonzero((cycle_times < max_time) & (values >= 0))
+    if not len(cycles):
         return Value(None, None)
+    n = cycles[len(cycles) - 1 - np.argmax(values[cycles][::-1])]
 
-    return Value(offset + max_index, max_value)
+    return Value(offset + idxs[n + 1], values[n])
 
 
 def cycle_finder(array, min_step=0.0, include_ends=True):
@@ -1017,29 +1188,59 @@ def cycle_finder(array, min_step=0.0, include_ends=True):
 
     # This section progressively removes reversals smaller than the step size of
     # interest, hence the arrays shrink until just the desired answer is left.
+    return _remove_small_cycles(idxs, vals, min_step)
+
+
+def _remove_small_cycles(idxs, vals, min_step):
+    '''
+    Repeatedly removes the smallest reversal (the first if several are equal)
+    until no reversal is smaller than min_step. A reversal at either end is
+    removed with its end point, while a reversal within the data is merged
+    with the reversals either side.
+
+    Rather than removing one reversal at a time, each pass removes every
+    reversal which comes before the two reversals either side of it in that
+    order, as nothing within its reach changes before it is removed.
+
+    :param idxs: Indices of the peaks and troughs.
+    :type idxs: np.array
+    :param vals: Values of the peaks and troughs.
+    :type vals: np.array
+    :param min_step: Minimum step, below which fluctuations will be removed.
+    :type min_step: float
+    :returns: Indices and values of the peaks and troughs which remain.
+    :rtype: (np.array, np.array)
+    '''
     dvals = np.ediff1d(vals)
-    while len(dvals) > 0 and np.min(abs(dvals)) < min_step:
-        sort_idx = np.argmin(abs(dvals))
-        last = len(dvals)
-        if sort_idx == 0:
-            idxs = np.delete(idxs, 0)
-            vals = np.delete(vals, 0)
-            dvals = np.delete(dvals, 0)
-        elif sort_idx == last-1:
-            idxs = np.delete(idxs, last)
-            vals = np.delete(vals, last)
-            dvals = np.delete(dvals, last-1) # One fewer dval than val.
-        else:
-            idxs = np.delete(idxs, slice(sort_idx, sort_idx + 2))
-            vals = np.delete(vals, slice(sort_idx, sort_idx + 2))
-            dvals[sort_idx - 1] += dvals[sort_idx] + dvals[sort_idx + 1]
-            dvals = np.delete(dvals, slice(sort_idx, sort_idx + 2))
-    if len(dvals) == 0:
-        # All the changes have disappeared, so return the
-        # single array peak index and value.
-        return idxs, vals
-    else:
-        return idxs, vals
+    while len(dvals) > 0:
+        steps = abs(dvals)
+        remove = steps < min_step
+        if not remove.any():
+            break
+        # Reversals are ordered by size and then position.
+        remove[1:] &= steps[1:] < steps[:-1]
+        remove[:-1] &= steps[:-1] <= steps[1:]
+        remove[2:] &= steps[2:] < steps[:-2]
+        remove[:-2] &= steps[:-2] <= steps[2:]
+        remove = np.flatnonzero(remove)
+
+        last = len(dvals) - 1
+        inner = remove[(remove > 0) & (remove < last)]
+        dvals[inner - 1] += dvals[inner] + dvals[inner + 1]
+        keep_dvals = np.ones(len(dvals), dtype=bool)
+        keep_dvals[remove] = False
+        keep_dvals[inner + 1] = False
+        keep_vals = np.ones(len(vals), dtype=bool)
+        keep_vals[inner] = False
+        keep_vals[inner + 1] = False
+        if remove[0] == 0:
+            keep_vals[0] = False
+        if remove[-1] == last and last > 0:
+            keep_vals[-1] = False
+        idxs = idxs[keep_vals]
+        vals = vals[keep_vals]
+        dvals = dvals[keep_dvals]
+    return idxs, vals
 
 
 def cycle_match(idx, cycle_idxs, dist=None):
@@ -1171,11 +1372,21 @@ def clip(array, period, hz=1.0, remove='peaks_and_troughs'):
     local_max = np_ma_zeros_like(source)
     local_min = np_ma_zeros_like(source)
     end = len(source)-half_width
-    
-    #...and work out these graphs.
-    for point in range(half_width,end):  # SLOW!
-        local_max[point]=np.ma.max(source[point-half_width:point+half_width+1])
-        local_min[point]=np.ma.min(source[point-half_width:point+half_width+1])
+    width = 2*half_width+1
+    
+    #...and work out these graphs with sliding window extrema. Masked
+    # samples are ignored and windows without valid samples are masked.
+    if end > half_width:
+        mask = np.ma.getmaskarray(source)
+        data = np.ma.getdata(source).astype(float)
+        local_max[half_width:end] = maximum_filter1d(
+            np.where(mask, -np.inf, data), width)[half_width:end]
+        local_min[half_width:end] = minimum_filter1d(
+            np.where(mask, np.inf, data), width)[half_width:end]
+        valid_count = np.concatenate(([0], np.cumsum(~mask)))
+        empty = np.flatnonzero(valid_count[width:] == valid_count[:-width])
+        local_max[empty+half_width] = np.ma.masked
+        local_min[empty+half_width] = np.ma.masked
     
     # For the maxima, find them using the cycle finder and remove the higher
     # maxima (we are interested in using the lower cycle peaks to replace
@@ -1212,35 +1423,51 @@ def clip(array, period, hz=1.0, remove='peaks_and_troughs'):
     
     # Now build the final result.
     result = source
-    # There is a fairly crude technique to find where maxima and minima overlap...
-    overlap_finder = np_ma_zeros_like(source)
+    # There is a fairly crude technique to find where maxima and minima
+    # overlap; count how many times each index is overwritten.
+    overlap_finder = np.zeros(len(source), dtype=int)
+    offsets = np.arange(-half_width, half_width+1)
+    
+    def overwrite(indexes, values):
+        if not len(indexes):
+            return
+        # Later windows overwrite earlier ones where they meet.
+        points = (np.asarray(indexes)[:, np.newaxis] + offsets).ravel()
+        result[points] = np.repeat(values, width)
+        overlap_finder[:] += np.bincount(points % len(source),
+                                         minlength=len(source))
     
     if remove in ['peaks_and_troughs', 'troughs']:
-        for i, index in enumerate(max_indexes):
-            for j in range(index-half_width, index+half_width+1):
-                # Overwrite the local values with the clipped maximum value
-                result[j]=max_values[i]
-                # Record which indexes were overwritten.
-                overlap_finder[j]+=1
+        # Overwrite the local values with the clipped maximum value
+        overwrite(max_indexes, max_values)
 
     if remove in ['peaks_and_troughs', 'peaks']:
-        for i, index in enumerate(min_indexes):
-            for j in range(index-half_width, index+half_width+1):
-                # Overwrite the local values with the clipped minimum value
-                result[j]=min_values[i]
-                # Record which indexes were overwritten.
-                overlap_finder[j]+=1
+        # Overwrite the local values with the clipped minimum value
+        overwrite(min_indexes, min_values)
 
     # This is not an ideal solution of how to deal with minima and maxima
     # that sit close to each other. This may need improving at a later date.
+    # Each average includes the averages already computed before it, so they
+    # are computed in turn. Each window is summed as np.ma.average would,
+    # with masked samples as zero, so that the averages are exact.
     overlaps = np.ma.clump_masked(np.ma.masked_greater(overlap_finder,1))
+    if overlaps:
+        valid = ~np.ma.getmaskarray(result)
+        values = np.where(valid, np.ma.getdata(result), 0)
     for overlap in overlaps:
-        for p in range(max(overlap.start, half_width), 
+        for p in range(max(overlap.start, half_width),
                        min(overlap.stop, len(source)-half_width)):
-            to_average = source[p-half_width:p+half_width+1]
-            if len(to_average)==0:
-                raise ValueError('Trying to average no data in clip')
-            result[p]=np.ma.average(to_average )
+            window = slice(p-half_width, p+half_width+1)
+            count = np.count_nonzero(valid[window])
+            if count:
+                result[p] = values[window].sum() * 1. / count
+                # Read back the stored value as integer arrays truncate.
+                values[p] = np.ma.getdata(result)[p]
+                valid[p] = True
+            else:
+                result[p] = np.ma.masked
+                values[p] = 0
+                valid[p] = False
 
     # Mask the ends as we cannot have long periods at the end of the data.
     result[:half_width+1] = np.ma.masked
@@ -1312,6 +1539,43 @@ def closest_unmasked_value(array, index, _slice=None):
     return Value(index=pos, value=array[pos])
 
 
+def multistate_match(array, states, condition=True, state_lookup=None):
+    '''
+    Equivalent of `array == state` or `array.any_of(*states)` for a multistate
+    array, comparing the raw integer values directly rather than converting
+    through the values mapping for each comparison.
+
+    The state to raw value lookup is precomputed when the values mapping is
+    set on the MappedArray (or MultistateDerivedParameterNode), so only the
+    requested states are looked up here.
+
+    :param array: multistate array to compare.
+    :type array: MappedArray
+    :param states: state or list of states to match.
+    :type states: str or [str]
+    :param condition: selection of true or false (i.e. inverse) test to apply.
+    :type condition: boolean
+    :param state_lookup: mapping of state to raw value, defaults to array.state
+    :type state_lookup: dict
+    :returns: Boolean array masked where the multistate array is masked.
+    :rtype: np.ma.array(dtype=bool)
+    :raises KeyError: if a state is not within the values mapping.
+    '''
+    if state_lookup is None:
+        state_lookup = array.state
+    if isinstance(states, basestring):
+        states = (states,)
+    raw_values = [state_lookup[state] for state in states]
+    data = np.ma.getdata(array)
+    if len(raw_values) == 1:
+        matches = data == raw_values[0]
+    else:
+        matches = np.in1d(data, raw_values).reshape(data.shape)
+    if not condition:
+        matches = ~matches
+    return np.ma.array(matches, mask=np.ma.getmaskarray(array).copy())
+
+
 def clump_multistate(array, state, _slices=[slice(None)], condition=True):
     '''
     This tests a multistate array and returns a classic POLARIS list of slices.
@@ -1341,10 +1605,8 @@ def clump_multistate(array, state, _slices=[slice(None)], condition=True):
         else:  # None provided
             return []
 
-    if condition == True:
-        state_match = runs_of_ones(array == state)
-    else:
-        state_match = runs_of_ones(array != state)
+    state_match = runs_of_ones(
+        multistate_match(array, state, condition=condition == True))
 
     return slices_and(_slices, state_match)
 
@@ -1699,15 +1961,14 @@ def find_edges_on_state_change(state, array, change='entering', phase=None):
     :raises: ValueError if change not recognised
     :raises: KeyError if state not recognised
     '''
-    def state_changes(state, array, change, _slice=slice(0, -1)):
+    def state_changes(state_match, change, _slice=slice(0, -1)):
 
-        length = len(array[_slice])
+        length = len(state_match[_slice])
         # The offset allows for phase slices and puts the transition midway
         # between the two conditions as this is the most probable time that
         # the change took place.
         offset = _slice.start - 0.5
-        state_periods = np.ma.clump_unmasked(
-            np.ma.masked_not_equal(array[_slice], array.state[state]))
+        state_periods = runs_of_ones(state_match[_slice])
         edge_list = []
         for period in state_periods:
             if change == 'entering':
@@ -1728,8 +1989,11 @@ def find_edges_on_state_change(state, array, change='entering', phase=None):
 
         return edge_list
 
+    # Compare the raw values once for all phases.
+    state_match = multistate_match(array, state)
+
     if phase is None:
-        return state_changes(state, array, change)
+        return state_changes(state_match, change)
 
     edge_list = []
     for period in phase:
@@ -1737,7 +2001,7 @@ def find_edges_on_state_change(state, array, change='entering', phase=None):
             _slice = period.slice
         else:
             _slice = period
-        edges = state_changes(state, array, change, _slice)
+        edges = state_changes(state_match, change, _slice)
         edge_list.extend(edges)
     return edge_list
 
@@ -1847,6 +2111,22 @@ def first_order_lag(param, time_constant, hz, gain=1.0, initial_value=None):
     return masked_first_order_filter(y_term, x_term, param, initial_value)
 
 
+_LFILTER_ZI = {}
+
+
+def _lfilter_zi(x_term, y_term):
+    '''
+    :returns: Initial state of the filter for a unit step, cached per set of filter terms.
+    :rtype: np.array
+    '''
+    key = (tuple(x_term), tuple(y_term))
+    try:
+        return _LFILTER_ZI[key]
+    except KeyError:
+        z_initial = _LFILTER_ZI[key] = lfilter_zi(x_term, y_term)
+        return z_initial
+
+
 def masked_first_order_filter(y_term, x_term, param, initial_value):
     """
     This provides access to the scipy filter function processed across the
@@ -1854,6 +2134,9 @@ def masked_first_order_filter(y_term, x_term, param, initial_value):
     This is a better option than masking all subsequent values which would be
     the mathematically correct thing to do with infinite response filters.
 
+    Two dimensional data is filtered along each row, so that several
+    parameters may be filtered together.
+
     :param y_term: Filter denominator terms.
     :type param: list
     :param x_term: Filter numerator terms.
@@ -1863,33 +2146,33 @@ def masked_first_order_filter(y_term, x_term, param, initial_value):
     :param initial_value: Value to be used at the start of the data
     :type initial_value: float (or may be None)
     """
-    # import locally to speed up imports of library.py
-    from scipy.signal import lfilter, lfilter_zi
-    z_initial = lfilter_zi(x_term, y_term) # Prepare for non-zero initial state
-    # The initial value may be set as a command line argument, mainly for testing
-    # otherwise we set it to the first data value.
-
-    result = np.ma.zeros(len(param))  # There is no zeros_like method.
-    good_parts = np.ma.clump_unmasked(param)
-    for good_part in good_parts:
-
-        if initial_value is None:
-            initial_value = param[good_part.start]
-        # Tested version here...
-        answer, z_final = lfilter(x_term, y_term, param[good_part], zi=z_initial*initial_value)
-        result[good_part] = np.ma.array(answer)
+    # Prepare for non-zero initial state
+    z_initial = _lfilter_zi(x_term, y_term)
+    data = np.ma.getdata(param)
+    mask = np.ma.getmaskarray(param)
+    result = np.zeros(data.shape)
+    if data.ndim == 1:
+        rows = [(data, mask, result)]
+    else:
+        rows = izip(data, mask, result)
+
+    for row_data, row_mask, row_result in rows:
+        # Edges of the unmasked blocks of data.
+        edges = np.flatnonzero(np.diff(np.concatenate(
+            ([True], row_mask, [True])).view(np.int8)))
+        # The initial value may be set as a command line argument, mainly for
+        # testing otherwise we set it to the first data value.
+        row_initial = row_data[edges[0]] if initial_value is None and \
+            len(edges) else initial_value
+        for start, stop in izip(edges[::2], edges[1::2]):
+            row_result[start:stop] = lfilter(
+                x_term, y_term, row_data[start:stop],
+                zi=z_initial * row_initial)[0]
 
     # The mask should last indefinitely following any single corrupt data point
     # but this is impractical for our use, so we just copy forward the original
     # mask.
-    bad_parts = np.ma.clump_masked(param)
-    for bad_part in bad_parts:
-        # The mask should last indefinitely following any single corrupt data point
-        # but this is impractical for our use, so we just copy forward the original
-        # mask.
-        result[bad_part] = np.ma.masked
-
-    return result
+    return np.ma.array(result, mask=mask.copy())
 
 
 def first_order_washout(param, time_constant, hz, gain=1.0, initial_value=None):
@@ -2578,40 +2861,64 @@ def hysteresis(array, hysteresis):
         return array
 
     quarter_range = hysteresis / 4.0
-    # Length is going to be used often, so prepare here:
-    length = len(array)
-    half_done = np.zeros(length)
-    result = np.zeros(length)
-    length = length-1 #  To be used for array indexing next
-
-    # get a list of the unmasked data - allow for array.mask = False (not an array)
-    if array.mask is np.False_:
-        notmasked = np.arange(length+1)
-    else:
-        notmasked = np.ma.where(array.mask == False)[0]
-    # The starting point for the computation is the first notmasked sample.
-    old = array[notmasked[0]]
-    for index in notmasked:
-        new = array[index]
-
-        if new - old > quarter_range:
-            old = new  - quarter_range
-        elif new - old < -quarter_range:
-            old = new + quarter_range
-        half_done[index] = old
-
+    mask = np.ma.getmaskarray(array)
+    values = np.ma.getdata(array)[~mask].astype(float)
+
+    # Each sample moves the output by the least amount needed to bring it
+    # within quarter_range of the sample, i.e. clips it between the
+    # sample -/+ quarter_range. The starting point for the computation is the
+    # first notmasked sample.
+    half_done = _clip_scan(values[0], values - quarter_range,
+                           values + quarter_range)
     # Repeat the process in the "backwards" sense to remove phase effects.
-    for index in notmasked[::-1]:
-        new = half_done[index]
-        if new - old > quarter_range:
-            old = new  - quarter_range
-        elif new - old < -quarter_range:
-            old = new + quarter_range
-        result[index] = old
+    reverse = half_done[::-1]
+    done = _clip_scan(half_done[-1], reverse - quarter_range,
+                      reverse + quarter_range)[::-1]
 
     # At the end of the process we reinstate the mask, although the data
     # values may have affected the result.
-    return np.ma.array(result, mask=array.mask)
+    result = np.zeros(len(array))
+    result[~mask] = done
+    return np.ma.array(result, mask=np.ma.getmask(array))
+
+
+def _clip_scan(start, lower, upper):
+    """
+    Repeatedly clips a value between successive lower and upper limits,
+    returning the value after each step. Equivalent to:
+
+        for index in range(len(lower)):
+            start = min(max(start, lower[index]), upper[index])
+            result[index] = start
+
+    Clipping between two limits and then another two is the same as
+    clipping once between the first limits clipped by the second, so the
+    limits of each step combined with all those before it are found in
+    log2(n) vectorized passes.
+
+    :param start: Initial value.
+    :type start: float
+    :param lower: Lower limits, each no greater than the upper limit.
+    :type lower: np.array
+    :param upper: Upper limits.
+    :type upper: np.array
+    :returns: Value after each step.
+    :rtype: np.array
+    """
+    lower = lower.copy()
+    upper = upper.copy()
+    combined_lower = np.empty_like(lower)
+    combined_upper = np.empty_like(upper)
+    shift = 1
+    while shift < len(lower):
+        # Combine each step's limits with those 'shift' steps earlier.
+        count = len(lower) - shift
+        np.maximum(lower[:-shift], lower[shift:], out=combined_lower[:count])
+        np.maximum(upper[:-shift], lower[shift:], out=combined_upper[:count])
+        np.minimum(combined_lower[:count], upper[shift:], out=lower[shift:])
+        np.minimum(combined_upper[:count], upper[shift:], out=upper[shift:])
+        shift *= 2
+    return np.minimum(np.maximum(start, lower), upper)
 
 
 def ils_glideslope_align(runway):
@@ -2744,6 +3051,19 @@ def integrate(array, frequency, initial_value=0.0, scale=1.0,
         raise ValueError("Invalid direction '%s'" % direction)
 
     k = (scale * 0.5)/frequency
+    if not np.ma.is_masked(integrand):
+        # Nothing is masked, so integrate the raw data.
+        data = np.ma.getdata(integrand)
+        to_int = k * (data + np.roll(data, d))
+        if direction == 'forwards':
+            to_int[0] = initial_value
+        else:
+            to_int[-1] = initial_value * s
+        result = np.ma.array(np.cumsum(to_int[::d] * s)[::d])
+        if extend:
+            result += integrand[0]*2.0*s*k
+        return result
+
     to_int = k * (integrand + np.roll(integrand, d))
     edges = np.ma.flatnotmasked_edges(to_int)
     if direction == 'forwards':
@@ -3551,7 +3871,7 @@ def max_value(array, _slice=slice(None), start_edge=None, stop_edge=None):
 
     :returns: Value named tuple of index and value.
     """
-    index, value = _value(array, _slice, np.ma.argmax)
+    index, value = _value(array, _slice, 'argmax')
     # If start or stop edges are given, check these extreme (interpolated) values.
     if start_edge:
         edge_value = value_at_index(array, start_edge)
@@ -3595,7 +3915,7 @@ def min_value(array, _slice=slice(None), start_edge=None, stop_edge=None):
 
     :returns: Value named tuple of index and value.
     """
-    index, value = _value(array, _slice, np.ma.argmin)
+    index, value = _value(array, _slice, 'argmin')
     # If start or stop edges are given, check these extreme (interpolated) values.
     if start_edge:
         edge_value = value_at_index(array, start_edge)
@@ -3912,32 +4232,82 @@ def blend_parameters_weighting(array, wt):
     '''
     mask = np.ma.getmaskarray(array)
     param_weight = (1.0-mask)
-    result_weight = np_ma_masked_zeros_like(np.ma.arange(floor(len(param_weight)*wt)))
-    final_weight = np_ma_masked_zeros_like(np.ma.arange(floor(len(param_weight)*wt)))
+    result_weight = np.zeros(int(floor(len(param_weight)*wt)))
+    # Samples of the result which are not weighted remain masked.
+    weighted = np.zeros(len(result_weight), dtype=np.bool_)
     result_weight[0]=param_weight[0]/wt
     result_weight[-1]=param_weight[-1]/wt
-
-    for i in range(1, len(param_weight)-1):
-        if param_weight[i]==0.0:
-            result_weight[i*wt]=0.0
-            continue
-        if param_weight[i-1]==0.0 or param_weight[i+1]==0.0:
-            result_weight[i*wt]=0.1 # Low weight to tail of valid data. Non-zero to avoid problems of overlapping invalid sections.
-            continue
-        result_weight[i*wt]=1.0/wt
-
-    for i in range(1, len(result_weight)-1):
-        if result_weight[i-1]==0.0 or result_weight[i+1]==0.0:
-            final_weight[i]=result_weight[i]/2.0
-        else:
-            final_weight[i]=result_weight[i]
-    final_weight[0]=result_weight[0]
-    final_weight[-1]=result_weight[-1]
-
-    return repair_mask(final_weight, repair_duration=None)
-
-
-def blend_parameters(params, offset=0.0, frequency=1.0, debug=False):
+    weighted[0] = weighted[-1] = True
+
+    inner = np.arange(1, len(param_weight)-1)
+    # Low weight to tail of valid data. Non-zero to avoid problems of
+    # overlapping invalid sections.
+    inner_weight = np.where((param_weight[inner-1]==0.0) |
+                            (param_weight[inner+1]==0.0), 0.1, 1.0/wt)
+    inner_weight[param_weight[inner]==0.0] = 0.0
+    # Where samples are reduced in frequency the last sample at each index
+    # takes precedence.
+    indexes = (inner*wt).astype(int)
+    last = np.ones(len(indexes), dtype=np.bool_)
+    last[:-1] = indexes[1:] != indexes[:-1]
+    result_weight[indexes[last]] = inner_weight[last]
+    weighted[indexes[last]] = True
+
+    # Halve the weights next to samples with zero weight.
+    zero_weight = weighted & (result_weight==0.0)
+    final_weight = result_weight.copy()
+    final_weight[1:-1][zero_weight[:-2] | zero_weight[2:]] /= 2.0
+
+    return repair_mask(np.ma.array(final_weight, mask=~weighted),
+                       repair_duration=None)
+
+
+def _pchip_interpolate(x, y, new_x):
+    '''
+    Piecewise cubic Hermite interpolation with the shape preserving slopes
+    of scipy.interpolate.PchipInterpolator, evaluated for all points at
+    once. Points beyond the data are extrapolated from the end cubics.
+
+    :param x: independent variable, increasing with at least three points
+    :type x: np.array
+    :param y: dependent variable
+    :type y: np.array
+    :param new_x: points to interpolate at
+    :type new_x: np.array
+    :returns: interpolated values
+    :rtype: np.array
+    '''
+    h = np.diff(x)
+    m = np.diff(y) / h
+    # The slopes are weighted harmonic means of the secants either side,
+    # or zero where the data turns or is flat.
+    slopes = np.empty(len(x))
+    w1 = 2 * h[1:] + h[:-1]
+    w2 = h[1:] + 2 * h[:-1]
+    flat = (np.sign(m[1:]) != np.sign(m[:-1])) | (m[1:] == 0) | (m[:-1] == 0)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        slopes[1:-1] = (w1 + w2) / (w1 / m[:-1] + w2 / m[1:])
+    slopes[1:-1][flat] = 0.0
+    # The end slopes are three point estimates which preserve the shape.
+    for end, h0, h1, m0, m1 in ((0, h[0], h[1], m[0], m[1]),
+                                (-1, h[-1], h[-2], m[-1], m[-2])):
+        slope = ((2 * h0 + h1) * m0 - h0 * m1) / (h0 + h1)
+        if np.sign(slope) != np.sign(m0):
+            slope = 0.0
+        elif np.sign(m0) != np.sign(m1) and abs(slope) > 3 * abs(m0):
+            slope = 3 * m0
+        slopes[end] = slope
+
+    i = np.clip(x.searchsorted(new_x, side='right') - 1, 0, len(x) - 2)
+    s = (new_x - x[i]) / h[i]
+    return (y[i] * (1 + 2 * s) * (1 - s) ** 2 +
+            h[i] * slopes[i] * s * (1 - s) ** 2 +
+            y[i + 1] * s ** 2 * (3 - 2 * s) +
+            h[i] * slopes[i + 1] * s ** 2 * (s - 1))
+
+
+def blend_parameters(params, offset=0.0, frequency=1.0, debug=False,
+                     method='spline'):
     '''
     This most general form of the blend options allows for multiple sources
     to be blended together even though the spacing, validity and even sample
@@ -3949,9 +4319,9 @@ def blend_parameters(params, offset=0.0, frequency=1.0, debug=False):
     samples of the parameter and it's mask. The multiple cubic splines are
     then summed at the points where new samples are required.
     
-    We may change to use a different form of interpolation in the
-    future, allowing for control of the first derivative at the ends of
-    the data, but that's in the future...
+    Where speed matters more than smoothness, linear interpolation or
+    piecewise cubic Hermite interpolation (which does not overshoot the
+    data) may be used in place of the cubic splines.
 
     :param params: list of parameters to be merged, can be None if not available
     :type params: List of parameters 
@@ -3962,7 +4332,12 @@ def blend_parameters(params, offset=0.0, frequency=1.0, debug=False):
     
     :param debug: flag to plot graphs for ease of testing
     :type debug: boolean, default to False
+    :param method: interpolation of the component parameters, one of 'spline', 'linear' or 'hermite'.
+    :type method: String, default='spline'
+    :raises ValueError: If the interpolation method is not recognised.
     '''
+    if method not in ('spline', 'linear', 'hermite'):
+        raise ValueError("Incorrect method choice argument '%s'" % method)
     if debug:
         import matplotlib.pyplot as plt
         plt.figure()
@@ -3978,14 +4353,16 @@ def blend_parameters(params, offset=0.0, frequency=1.0, debug=False):
     
     # Prepare a place for the output signal
     length = len(params[0].array) * frequency / params[0].frequency
-    result = np_ma_masked_zeros(length)
+    result = np_ma_masked_zeros(int(length))
     # Ensure mask is expanded for slicing.
     result.mask = np.ma.getmaskarray(result)
     
     # Find out about the parameters we have to deal with...
+    p_masks = []
     for seq, param in enumerate(params):
         p_freq.append(param.frequency)
         p_offset.append(param.offset)
+        p_masks.append(np.ma.getmaskarray(param.array))
     min_ip_freq = min(p_freq)
     
     # Slices of valid data are scaled to the lowest timebase and then or'd
@@ -4020,46 +4397,53 @@ def blend_parameters(params, offset=0.0, frequency=1.0, debug=False):
                             num=(result_slice.stop - result_slice.start),
                             endpoint=False) + offset
         
-        # Make space for the computed curves
-        curves=[]
-        weights=[]
+        # Make space for the computed curves and their weights
+        curves = np.empty((len(params), len(new_t)))
+        weights = np.empty((len(params), len(new_t)))
+        count = 0
         resampled_masks = []
 
-        # Compute the individual splines
+        # Compute the individual curves
         for seq, param in enumerate(params):
             # The slice and timebase for this parameter...
             my_slice = slice_multiply(this_valid, p_freq[seq] / min_ip_freq)
+            my_mask = p_masks[seq][my_slice]
             resampled_masks.append(
-                resample(np.ma.getmaskarray(param.array)[my_slice],
-                         param.frequency, frequency))
+                resample(my_mask, param.frequency, frequency))
+            if len(my_mask) - np.count_nonzero(my_mask) < 4:
+                continue
             timebase = np.linspace(my_slice.start/p_freq[seq],
                                    my_slice.stop/p_freq[seq],
                                    num=my_slice.stop-my_slice.start,
                                    endpoint=False) + p_offset[seq]
-            my_time = np.ma.array(
-                data=timebase, mask=np.ma.getmaskarray(param.array[my_slice]))
-            if len(my_time.compressed()) < 4:
-                continue
-            my_curve = scipy_interpolate.splrep(
-                my_time.compressed(), param.array[my_slice].compressed(), s=0)
-            # my_curve is the spline knot array, now compute the values for
-            # the output timebase.
-            curves.append(
-                scipy_interpolate.splev(new_t, my_curve, der=0, ext=0))
+            my_time = timebase[~my_mask]
+            my_values = np.ma.getdata(param.array)[my_slice][~my_mask]
+            if method == 'spline':
+                my_curve = scipy_interpolate.splrep(my_time, my_values, s=0)
+                # my_curve is the spline knot array, now compute the values
+                # for the output timebase.
+                curves[count] = scipy_interpolate.splev(new_t, my_curve,
+                                                        der=0, ext=0)
+            elif method == 'hermite':
+                curves[count] = _pchip_interpolate(my_time, my_values,
+                                                   new_t)
+            else:
+                curves[count] = np.interp(new_t, my_time, my_values)
 
             # Compute the weights 
-            weights.append(blend_parameters_weighting(
-                param.array[my_slice], frequency/param.frequency))
+            weights[count] = blend_parameters_weighting(
+                param.array[my_slice], frequency/param.frequency)
             
             if debug:
-                plt.plot(my_time,param.array[my_slice], 'o')
-                plt.plot(new_t,curves[seq], '-.')
-                plt.plot(new_t,weights[seq])
+                plt.plot(my_time, my_values, 'o')
+                plt.plot(new_t,curves[count], '-.')
+                plt.plot(new_t,weights[count])
+            count += 1
                 
-        if curves==[]:
+        if not count:
             continue
-        a = np.vstack(tuple(curves))
-        result[result_slice] = np.average(a, axis=0, weights=weights)
+        result[result_slice] = np.average(curves[:count], axis=0,
+                                          weights=weights[:count])
         # Q: Is this the right place? Should it be applied to this_valid slice?
         result.mask[result_slice] = merge_masks(resampled_masks,
                                                 min_unmasked=2)
@@ -4727,6 +5111,15 @@ def rate_of_change_array(to_diff, hz, width=None, method='two_points'):
         return np_ma_zeros_like(to_diff)
     
     if method == 'two_points':
+        if not np.ma.is_masked(to_diff):
+            # Nothing is masked, so differentiate the raw data.
+            data = np.ma.getdata(to_diff)
+            slope = data.copy()
+            slope[hw:-hw] = (data[2*hw:] - data[:-2*hw])/width
+            slope[:hw] = (data[1:hw+1] - data[0:hw]) * hz
+            slope[-hw:] = (data[-hw:] - data[-hw-1:-1])* hz
+            return np.ma.array(slope, mask=np.zeros(len(slope), dtype=bool))
+
         input_mask = np.ma.getmaskarray(to_diff)
         # Set up an array of masked zeros for extending arrays.
         slope = np.ma.copy(to_diff)
@@ -4751,7 +5144,11 @@ def rate_of_change_array(to_diff, hz, width=None, method='two_points'):
         # Scaling is given by:
         sx2_hz = np.sum(x*x)/hz 
         # We extended data array to allow for convolution overruns.
-        z = np.array([to_diff[0]]*hw+list(to_diff)+[to_diff[-1]]*hw) 
+        if not np.ma.is_masked(to_diff):
+            data = np.ma.getdata(to_diff)
+            z = np.concatenate(([data[0]]*hw, data, [data[-1]]*hw))
+        else:
+            z = np.array([to_diff[0]]*hw+list(to_diff)+[to_diff[-1]]*hw) 
         # The compute the least squares fit for each point over the required
         # range and re-scale to allow for width and sample rate.
         return np.convolve(z,-x,'same')[hw:-hw]/sx2_hz 
@@ -4813,51 +5210,72 @@ def repair_mask(array, frequency=1, repair_duration=REPAIR_DURATION,
             raise ValueError("Array cannot be repaired as it is entirely masked")
     if copy:
         array = array.copy()
+    if not np.ma.is_masked(array):
+        # Nothing to repair.
+        return array
     if repair_duration:
         repair_samples = repair_duration * frequency
     else:
         repair_samples = None
 
-    masked_sections = np.ma.clump_masked(array)
-    for section in masked_sections:
-        length = section.stop - section.start
-        if repair_samples and length > repair_samples:
-            if raise_duration_exceedance:
-                raise ValueError("Length of masked section '%s' exceeds "
-                                 "repair duration '%s'." % (length * frequency,
-                                                            repair_duration))
-            else:
-                continue # Too long to repair
-        elif section.start == 0:
-            if extrapolate:
-                # TODO: Does it make sense to subtract 1 from the section stop??
-                #array.data[section] = array.data[section.stop - 1]
-                if zero_if_masked:
-                    array.data[section]=0.0
-                else:
-                    array.data[section] = array.data[section.stop]
-                array.mask[section] = False
-            else:
-                continue # Can't interpolate if we don't know the first sample
-
-        elif section.stop == len(array):
-            if extrapolate:
-                if zero_if_masked:
-                    array.data[section]=0.0
-                else:
-                    array.data[section] = array.data[section.start - 1]
-                array.mask[section] = False
-            else:
-                continue # Can't interpolate if we don't know the last sample
-        else:
-            start_value = array.data[section.start - 1]
-            end_value = array.data[section.stop]
-            if repair_above is None or (start_value > repair_above and end_value > repair_above):
-                array.data[section] = np.interp(np.arange(length) + 1,
-                                                [0, length + 1],
-                                                [start_value, end_value])
-                array.mask[section] = False
-
+    # Find all masked sections at once.
+    length = len(array)
+    mask = np.ma.getmaskarray(array)
+    valid = ~mask
+    edges = np.diff(np.concatenate(([0], mask.view(np.int8), [0])))
+    starts = np.flatnonzero(edges == 1)
+    stops = np.flatnonzero(edges == -1)
+
+    exceedance = None
+    if repair_samples:
+        too_long = (stops - starts) > repair_samples
+        if raise_duration_exceedance and too_long.any():
+            # Sections before the first exceedance are repaired, as when
+            # working through the sections in order.
+            first = np.argmax(too_long)
+            exceedance = stops[first] - starts[first]
+            too_long[first:] = True
+        starts = starts[~too_long]  # Too long to repair
+        stops = stops[~too_long]
+
+    data = array.data
+    if len(starts) and starts[0] == 0:
+        if extrapolate:
+            # TODO: Does it make sense to subtract 1 from the section stop??
+            #data[:stops[0]] = data[stops[0] - 1]
+            data[:stops[0]] = 0.0 if zero_if_masked else data[stops[0]]
+            array.mask[:stops[0]] = False
+        # Can't interpolate if we don't know the first sample
+        starts = starts[1:]
+        stops = stops[1:]
+    if len(stops) and stops[-1] == length:
+        if extrapolate:
+            data[starts[-1]:] = 0.0 if zero_if_masked else data[starts[-1] - 1]
+            array.mask[starts[-1]:] = False
+        # Can't interpolate if we don't know the last sample
+        starts = starts[:-1]
+        stops = stops[:-1]
+    if repair_above is not None:
+        above = (data[starts - 1] > repair_above) & \
+            (data[stops] > repair_above)
+        starts = starts[above]
+        stops = stops[above]
+
+    if len(starts):
+        # Interpolate across all sections against the valid samples either
+        # side of them.
+        repair = np.zeros(length + 1, dtype=np.int8)
+        repair[starts] = 1
+        repair[stops] = -1
+        repair = np.cumsum(repair[:-1]).astype(bool)
+        data[repair] = np.interp(np.flatnonzero(repair),
+                                 np.flatnonzero(valid), data[valid])
+        array.mask[repair] = False
+
+    if exceedance is not None:
+        raise ValueError("Length of masked section '%s' exceeds "
+                         "repair duration '%s'." % (exceedance * frequency,
+                                                    repair_duration))
     return array
 
 
@@ -4870,11 +5288,11 @@ def resample(array, orig_hz, resample_hz):
         return array
     modifier = resample_hz / float(orig_hz)
     if modifier > 1:
-        return np.ma.repeat(array, modifier)
+        return np.ma.repeat(array, int(modifier))
     else:
         # Only convert complete blocks of data.
         endpoint = floor(len(array)*modifier)/modifier
-        return array[:endpoint:1 / modifier]
+        return array[:int(endpoint):int(1 / modifier)]
 
 
 def round_to_nearest(array, step):
@@ -5116,7 +5534,7 @@ def slice_multiply(_slice, f):
     if _slice.start is None:
         _start = None
     else:
-        _start = ceil(_slice.start*f)
+        _start = int(ceil(_slice.start*f))
 
     return slice(_start,
                  int(_slice.stop*f) if _slice.stop else None,
@@ -5500,76 +5918,85 @@ def step_values(array, steps, hz=1, step_at='midpoint', rate_threshold=0.5):
     The opposite happens for 'excluding_transition' so that the transitions
     are ignored until the next step is fully established.
     '''
-    # create new array, initialised with first flap setting
-    new_array = np_ma_ones_like(array) * first_valid_sample(stepped_array).value
-    
-    # create a list of tuples with index of midpoint change and direction of travel
-    flap_increase = find_edges(stepped_array, direction='rising_edges')
-    flap_decrease = find_edges(stepped_array, direction='falling_edges')
-    transitions = [(idx, 'increase') for idx in flap_increase] + \
-                  [(idx, 'decrease') for idx in flap_decrease]
-    
-    if not transitions:
+    # find the midpoints of changes between steps and the direction of travel
+    stepped_data = np.ma.getdata(stepped_array)
+    changes = np.ma.ediff1d(stepped_array).filled(0)
+    flap_changes = np.flatnonzero(changes)
+
+    if not len(flap_changes):
         logger.warning("No changes between steps could be found in step_values.")
-        return new_array
-    
-    # sort based on index
-    sorted_transitions = sorted(transitions, key=lambda v: v[0])
-    flap_changes = [idx for idx, direction in sorted_transitions]
+        # create new array, initialised with first flap setting
+        return np_ma_ones_like(array) * first_valid_sample(stepped_array).value
+
+    flap_midpoints = flap_changes + 0.5
+    increase = changes[flap_changes] > 0
+    prev_flaps = stepped_data[flap_changes]
+    next_flaps = stepped_data[flap_changes + 1]
+    # the scans for each change stop at the midpoints either side
+    prev_midpoints = np.concatenate(([0], flap_midpoints[:-1]))
+    next_midpoints = np.concatenate((flap_midpoints[1:], [len(array)]))
 
     roc = rate_of_change_array(array, hz)
+    # looking for where positive (or negative) change reduces to this value
+    roc_to_seek_for = np.where(increase, 0.1, -0.1)
+    # allow a change to be 5% before the flap is reached
+    flap_tolerance = abs(prev_flaps - next_flaps) * 0.05
+
+    if step_at == 'move_start':
+        scan_back = np.ones(len(flap_changes), dtype=bool)
+    elif step_at == 'move_stop':
+        scan_back = np.zeros(len(flap_changes), dtype=bool)
+    elif step_at == 'including_transition':
+        scan_back = increase
+    else:
+        scan_back = ~increase
+    idxs = np.empty(len(flap_changes))
+
+    rev = np.flatnonzero(scan_back)
+    if len(rev):
+        #TODO: support within 0.1 rather than 90%
+        # prev_midpoint (scan stop) should be after the other scan transition...
+        tolerance = np.where(increase[rev], 1, -1) * flap_tolerance[rev]
+        roc_idx = _index_at_value_scans(
+            roc, roc_to_seek_for[rev], flap_midpoints[rev],
+            prev_midpoints[rev], step=-1)
+        val_idx = _index_at_value_scans(
+            array, prev_flaps[rev] + tolerance, flap_midpoints[rev],
+            prev_midpoints[rev], step=-1)
+        idxs[rev] = np.fmax(val_idx, roc_idx)
+
+    fwd = np.flatnonzero(~scan_back)
+    if len(fwd):
+        tolerance = np.where(increase[fwd], -1, 1) * flap_tolerance[fwd]
+        roc_idx = _index_at_value_scans(
+            roc, roc_to_seek_for[fwd], flap_midpoints[fwd],
+            next_midpoints[fwd], step=1)
+        val_idx = _index_at_value_scans(
+            array, next_flaps[fwd] + tolerance, flap_midpoints[fwd],
+            next_midpoints[fwd], step=1)
+        # Rate of change is preferred when the parameter flattens out,
+        # value is used when transitioning between two states and the
+        # parameter does not level.
+        idxs[fwd] = np.fmin(val_idx, roc_idx)
+
+    # fall back to the midpoint where neither was found
+    unfound = np.isnan(idxs) | (idxs == 0)
+    idxs[unfound] = flap_midpoints[unfound]
+
+    # floor +1 to ensure transitions start at the next sample. Each step
+    # lasts until a later change starts, even if the later change starts
+    # earlier than this one.
+    starts = np.minimum(np.floor(idxs).astype(int) + 1, len(array))
+    latest_change = np.empty(len(array) + 1, dtype=int)
+    latest_change.fill(-1)
+    np.maximum.at(latest_change, starts, np.arange(len(starts)))
+    latest_change = np.maximum.accumulate(latest_change)[:-1]
+
+    # create new array, initialised with first flap setting
+    new_array = np_ma_ones_like(array) * first_valid_sample(stepped_array).value
+    changed = latest_change >= 0
+    new_array[changed] = next_flaps[latest_change[changed]]
 
-    for prev_midpoint, (flap_midpoint, direction), next_midpoint in izip_longest(
-        [0] + flap_changes[0:-1], sorted_transitions, flap_changes[1:]):
-        prev_flap = stepped_array[floor(flap_midpoint)]
-        next_flap = stepped_array[ceil(flap_midpoint)]
-        if direction == 'increase':
-            # looking for where positive change reduces to this value
-            roc_to_seek_for = 0.1
-        else:
-            # looking for negative roc reduces to this value
-            roc_to_seek_for = -0.1
-            
-        # allow a change to be 5% before the flap is reached
-        flap_tolerance = (abs(prev_flap - next_flap) * 0.05)
-
-        if step_at == 'move_start' \
-           or direction == 'increase' and step_at == 'including_transition'\
-           or direction == 'decrease' and step_at == 'excluding_transition':
-            #TODO: support within 0.1 rather than 90%
-            # prev_midpoint (scan stop) should be after the other scan transition...
-            scan_rev = slice(flap_midpoint, prev_midpoint, -1)
-            ### 0.975 is within 0.1 of flap 40 and 0.
-            ##idx = index_at_value_or_level_off(array, prev_flap, scan_rev,
-                                              ##abs_threshold=0.2)
-            if direction == 'decrease':
-                flap_tolerance *= -1
-                
-            roc_idx = index_at_value(roc, roc_to_seek_for, scan_rev, endpoint='closest')
-            val_idx = index_at_value(array, prev_flap + flap_tolerance, scan_rev, endpoint='closest') #???
-            idx = max(val_idx, roc_idx) or flap_midpoint
-            
-        elif step_at == 'move_stop' \
-             or direction == 'increase' and step_at == 'excluding_transition'\
-             or direction == 'decrease' and step_at == 'including_transition':
-            scan_fwd = slice(flap_midpoint, next_midpoint, +1)
-            ##idx = index_at_value_or_level_off(array, next_flap, scan_fwd,
-                                              ##abs_threshold=0.2)
-            
-            if direction == 'increase':
-                flap_tolerance *= -1
-            
-            roc_idx = index_at_value(roc, roc_to_seek_for, scan_fwd, endpoint='closest')
-            val_idx = index_at_value(array, next_flap + flap_tolerance, scan_fwd, endpoint='closest') #???
-            # Rate of change is preferred when the parameter flattens out,
-            # value is used when transitioning between two states and the
-            # parameter does not level.
-            idxs = [x for x in (val_idx, roc_idx) if x is not None]
-            idx = (idxs and min(idxs)) or flap_midpoint
-            
-        # floor +1 to ensure transitions start at the next sample
-        new_array[floor(idx)+1:] = next_flap
-    
     # Reapply mask
     #Q: must we maintain the mask?
     new_array.mask = np.ma.getmaskarray(array)
@@ -5993,6 +6420,38 @@ def index_closest_value(array, threshold, _slice=slice(None)):
     return index_at_value(array, threshold, _slice, endpoint='closing')
 
 
+def _index_at_value_limits(array, _slice):
+    '''
+    Arrange the limits of a scan for index_at_value, ensuring that we stay
+    inside the array.
+
+    :returns: First and last indices of the scan and slices of the left and right samples of each pair of samples within it.
+    :rtype: (int, int, slice, slice)
+    :raises ValueError: If the slice step is not 1 or -1.
+    '''
+    step = _slice.step or 1
+    max_index = len(array)
+
+    if step == 1:
+        begin = max(int(round(_slice.start or 0)), 0)
+        end = min(int(round(_slice.stop or max_index)), max_index)
+        left, right = slice(begin, end - 1, step), slice(begin + 1, end,step)
+
+    elif step == -1:
+        begin = min(int(round(_slice.start or max_index)), max_index-1)
+        # Indexing from the end of the array results in an array length
+        # mismatch. There is a failing test to cover this case which may work
+        # with array[:end:-1] construct, but using slices appears insoluble.
+        end = max(int(_slice.stop or 0),0)
+        left = slice(begin, end, step)
+        right = slice(begin - 1, end - 1 if end > 0 else None, step)
+
+    else:
+        raise ValueError('Step length not 1 in index_at_value')
+
+    return begin, end, left, right
+
+
 def index_at_value(array, threshold, _slice=slice(None), endpoint='exact'):
     '''
     This function seeks the moment when the parameter in question first crosses
@@ -6018,25 +6477,7 @@ def index_at_value(array, threshold, _slice=slice(None), endpoint='exact'):
     :returns type: Float or None
     '''
     step = _slice.step or 1
-    max_index = len(array)
-
-    # Arrange the limits of our scan, ensuring that we stay inside the array.
-    if step == 1:
-        begin = max(int(round(_slice.start or 0)), 0)
-        end = min(int(round(_slice.stop or max_index)), max_index)
-        left, right = slice(begin, end - 1, step), slice(begin + 1, end,step)
-
-    elif step == -1:
-        begin = min(int(round(_slice.start or max_index)), max_index-1)
-        # Indexing from the end of the array results in an array length
-        # mismatch. There is a failing test to cover this case which may work
-        # with array[:end:-1] construct, but using slices appears insoluble.
-        end = max(int(_slice.stop or 0),0)
-        left = slice(begin, end, step)
-        right = slice(begin - 1, end - 1 if end > 0 else None, step)
-
-    else:
-        raise ValueError('Step length not 1 in index_at_value')
+    begin, end, left, right = _index_at_value_limits(array, _slice)
 
     if begin == end:
         logger.warning('No range for seek function to scan across')
@@ -6049,10 +6490,20 @@ def index_at_value(array, threshold, _slice=slice(None), endpoint='exact'):
     # When the data being tested passes the value we are seeking, the
     # difference between the data and the value will change sign.
     # Therefore a negative value indicates where value has been passed.
-    value_passing_array = (array[left] - threshold) * (array[right] - threshold)
-    test_array = np.ma.masked_greater(value_passing_array, 0.0)
+    mask = np.ma.getmask(array)
+    if mask is np.ma.nomask or not (mask[left].any() or mask[right].any()):
+        # Nothing is masked within the scan, so search the raw data.
+        data = np.ma.getdata(array)
+        value_passing_array = (data[left] - threshold) * (data[right] - threshold)
+        passing = ~(value_passing_array > 0.0)
+        n = passing.argmax() if len(passing) and passing.any() else None
+    else:
+        value_passing_array = (array[left] - threshold) * (array[right] - threshold)
+        test_array = np.ma.masked_greater(value_passing_array, 0.0)
+        n = np.ma.flatnotmasked_edges(test_array)[0] \
+            if np.ma.count(test_array) else None
 
-    if len(test_array) == 0:
+    if len(value_passing_array) == 0:
         # Q: Does this mean that value_passing_array is also empty?
         return None
 
@@ -6061,7 +6512,7 @@ def index_at_value(array, threshold, _slice=slice(None), endpoint='exact'):
         # covers the whole array so is allowed.
         return None
 
-    elif not np.ma.count(test_array):
+    elif n is None:
         # The parameter does not pass through threshold in the period in
         # question, so return empty-handed.
         if endpoint == 'closing':
@@ -6087,7 +6538,6 @@ def index_at_value(array, threshold, _slice=slice(None), endpoint='exact'):
         else:
             return None  #TODO: raise exception when not found?
     else:
-        n, dummy = np.ma.flatnotmasked_edges(test_array)
         a = array[begin + (step * n)]
         b = array[begin + (step * (n + 1))]
         # Force threshold to float as often passed as an integer.
@@ -6100,6 +6550,183 @@ def index_at_value(array, threshold, _slice=slice(None), endpoint='exact'):
     return (begin + step * (n + r))
 
 
+def index_at_values(array, thresholds, _slice=slice(None), endpoint='exact'):
+    '''
+    Seeks the moments when the parameter first crosses each of many
+    thresholds. The result for each threshold is the same as index_at_value,
+    but the array is scanned once rather than once per threshold.
+
+    Within a run of unmasked samples the range of values covered so far only
+    grows, so the first crossing of a threshold is where the running minimum
+    or maximum first reaches it. Each threshold is found with a binary
+    search of the running extrema of the first run which covers it.
+
+    For example, to find the altitudes when climbing:
+       indexes = index_at_values(alt_aal, [100, 500, 1000], climb.slice)
+
+    :param array: input data
+    :type array: masked array
+    :param thresholds: the values that we expect the array to cross in this slice.
+    :type thresholds: iterable of float
+    :param _slice: slice where we want to seek the threshold transits.
+    :type _slice: slice
+    :param endpoint: type of end condition being sought, see index_at_value.
+    :type endpoint: string
+
+    :returns: interpolated time when the array values crossed each threshold, in the same order as thresholds.
+    :returns type: list of Float or None
+    '''
+    thresholds = list(thresholds)
+    step = _slice.step or 1
+    begin, end, left, right = _index_at_value_limits(array, _slice)
+    data = np.ma.getdata(array)
+    pairs = len(data[left])
+    if abs(begin - end) < 2 or not pairs or begin < 0 or \
+       (_slice.stop == _slice.start and _slice.start is not None) or \
+       (data.dtype.kind == 'f' and np.isnan(data[left]).any()):
+        # Nothing to scan across, a scan which starts before the array, e.g.
+        # backwards from a negative index, or values which cannot be
+        # ordered.
+        return [index_at_value(array, threshold, _slice, endpoint)
+                for threshold in thresholds]
+
+    # Samples within the scan in the order they are scanned.
+    if step == 1:
+        scan = slice(begin, begin + pairs + 1)
+    else:
+        scan = slice(begin, begin - pairs - 1 if begin - pairs > 0 else None,
+                     -1)
+    values = data[scan]
+    mask = np.ma.getmaskarray(array)[scan]
+
+    # Runs of unmasked samples which contain at least one pair.
+    edges = np.diff(np.concatenate(([0], (~mask).view(np.int8), [0])))
+    run_starts = np.flatnonzero(edges == 1)
+    run_stops = np.flatnonzero(edges == -1)
+    long_runs = (run_stops - run_starts) > 1
+    run_starts = run_starts[long_runs]
+    run_stops = run_stops[long_runs]
+
+    indexes = [None] * len(thresholds)
+    if len(run_starts):
+        # Reduce over each run and the masked samples which follow it, then
+        # discard the latter.
+        edges = np.column_stack((run_starts, run_stops)).ravel()
+        if edges[-1] == len(values):
+            edges = edges[:-1]
+        run_min = np.minimum.reduceat(values, edges)[::2]
+        run_max = np.maximum.reduceat(values, edges)[::2]
+        threshold_array = np.array(thresholds, dtype=float)[:, np.newaxis]
+        covered = (run_min <= threshold_array) & (run_max >= threshold_array)
+        running = {}
+        for position, threshold in enumerate(thresholds):
+            if not covered[position].any():
+                continue
+            run = covered[position].argmax()
+            if run not in running:
+                run_values = values[run_starts[run]:run_stops[run]]
+                running[run] = (np.maximum.accumulate(run_values),
+                                -np.minimum.accumulate(run_values))
+            running_max, negative_running_min = running[run]
+            # The first sample which extends the range to the threshold
+            # completes the first pair to cross it.
+            reached = max(running_max.searchsorted(threshold),
+                          negative_running_min.searchsorted(-threshold))
+            n = run_starts[run] + max(reached - 1, 0)
+            a = values[n]
+            b = values[n + 1]
+            # Force threshold to float as often passed as an integer.
+            # Also check for b=a as otherwise we get a divide by zero
+            # condition.
+            if a == b:
+                r = 0.5
+            else:
+                r = (float(threshold) - a) / (b - a)
+            indexes[position] = begin + step * (n + r)
+
+    if endpoint != 'exact':
+        # Thresholds which are not crossed are handled by index_at_value.
+        indexes = [index_at_value(array, threshold, _slice, endpoint)
+                   if index is None else index
+                   for threshold, index in zip(thresholds, indexes)]
+    return indexes
+
+
+def _index_at_value_scans(array, thresholds, starts, stops, step=1):
+    '''
+    Seeks a threshold within each of many scans of an array in the same
+    direction. The result for each scan is the same as index_at_value with
+    the 'exact' endpoint, but the scans are searched together so that
+    adjoining scans cost no more than scanning the array once.
+
+    :param array: input data
+    :type array: masked array
+    :param thresholds: the value we expect the array to cross in each scan.
+    :type thresholds: np.array of float
+    :param starts: start of each scan.
+    :type starts: np.array of float
+    :param stops: stop of each scan, which must be given.
+    :type stops: np.array of float
+    :param step: direction of the scans, 1 or -1.
+    :type step: int
+
+    :returns: interpolated time when the array values crossed the threshold of each scan, NaN where not crossed.
+    :rtype: np.array of float
+    :raises ValueError: If the step is not 1 or -1.
+    '''
+    data = np.ma.getdata(array)
+    mask = np.ma.getmaskarray(array)
+    thresholds = np.asarray(thresholds, dtype=np.float64)
+    starts = np.asarray(starts, dtype=np.float64)
+    stops = np.asarray(stops, dtype=np.float64)
+
+    # Arrange the limits of each scan as _index_at_value_limits does, where
+    # round takes halves away from zero.
+    rounded_starts = np.sign(starts) * np.floor(abs(starts) + 0.5)
+    if step == 1:
+        begins = np.maximum(rounded_starts, 0).astype(int)
+        ends = np.minimum(np.sign(stops) * np.floor(abs(stops) + 0.5),
+                          len(data)).astype(int)
+        pairs = ends - begins - 1
+    elif step == -1:
+        begins = np.minimum(rounded_starts, len(data) - 1).astype(int)
+        ends = np.maximum(np.trunc(stops), 0).astype(int)
+        pairs = begins - ends
+    else:
+        raise ValueError('Step length not 1 in index_at_value')
+    # Requires at least two values to find if the array crosses a threshold.
+    pairs = np.where(abs(begins - ends) < 2, 0, np.maximum(pairs, 0))
+
+    # Every pair of samples within the scans, in the order they are scanned.
+    scans = np.repeat(np.arange(len(pairs)), pairs)
+    positions = np.arange(len(scans)) - np.repeat(np.cumsum(pairs) - pairs,
+                                                  pairs)
+    left = begins[scans] + step * positions
+    right = left + step
+
+    # The threshold is subtracted in the precision of the array as it would
+    # be for a single threshold.
+    scan_thresholds = thresholds[scans].astype(np.result_type(data, 1.0))
+    passing = ~((data[left] - scan_thresholds) *
+                (data[right] - scan_thresholds) > 0.0)
+    passing &= ~(mask[left] | mask[right])
+
+    indexes = np.empty(len(pairs))
+    indexes.fill(np.nan)
+    hits = np.flatnonzero(passing)
+    found, first = np.unique(scans[hits], return_index=True)
+    hits = hits[first]
+    a = data[left[hits]]
+    b = data[right[hits]]
+    # Check for b=a as otherwise we get a divide by zero condition.
+    with np.errstate(divide='ignore', invalid='ignore'):
+        r = np.where(a == b, 0.5,
+                     (thresholds[found] - a.astype(np.float64)) /
+                     (b - a).astype(np.float64))
+    indexes[found] = begins[found] + step * (positions[hits] + r)
+    return indexes
+
+
 def index_at_value_or_level_off(array, value, _slice, abs_threshold=None):
     '''
     Find the index closest to the value unless it doesn't get within 10% of
@@ -6144,12 +6771,23 @@ def index_at_value_or_level_off(array, value, _slice, abs_threshold=None):
 def _value(array, _slice, operator):
     """
     Applies logic of min_value and max_value across the array slice.
+
+    :param operator: Name of the array method to apply, 'argmax' or 'argmin'.
+    :type operator: str
     """
     if _slice.step and _slice.step < 0:
         raise ValueError("Negative step not supported")
-    if np.ma.count(array[_slice]):
+    sliced = array[_slice]
+    if not np.ma.is_masked(sliced):
+        # Nothing is masked, so search the raw data.
+        sliced = np.ma.getdata(sliced)
+        count = len(sliced)
+    else:
+        count = np.ma.count(sliced)
+    if count:
         # floor the start position as it will have been floored during the slice
-        index = operator(array[_slice]) + floor(_slice.start or 0) * (_slice.step or 1)
+        index = int(getattr(sliced, operator)() +
+                    floor(_slice.start or 0) * (_slice.step or 1))
         value = array[index]
         return Value(index, value)
     else:
@@ -6185,6 +6823,28 @@ def value_at_time(array, hz, offset, time_index):
     return value_at_index(array, location_in_array)
 
 
+def values_at_times(array, hz, offset, time_indices):
+    '''
+    Finds the values of the data in array at many times at once, following
+    the same rules as value_at_time.
+
+    :param array: input data
+    :type array: masked array
+    :param hz: sample rate for the input data (sec-1)
+    :type hz: float
+    :param offset: fdr offset for the array (sec)
+    :type offset: float
+    :param time_indices: times into the array where we want to find the array values. None values are masked.
+    :type time_indices: iterable of float or None
+    :returns: interpolated values from the array, one per time.
+    :rtype: np.ma.masked_array
+    '''
+    # Timedelta truncates to 6 digits, therefore round offset down.
+    time_into_array = np.array(time_indices, dtype=float) - \
+        round(offset-0.0000005, 6)
+    return values_at_indices(array, time_into_array * hz)
+
+
 def value_at_datetime(start_datetime, array, hz, offset, value_datetime):
     '''
     Finds the value of the data in array at the time given by value_datetime.
@@ -6249,11 +6909,61 @@ def value_at_index(array, index, interpolate=True):
                     return low_value
         # If not interpolating and no mask or masked samples:
         if not interpolate:
-            return array[index + 0.5]
+            return array[int(index + 0.5)]
         # In the cases of no mask, or neither sample masked, interpolate.
         return r*high_value + (1-r) * low_value
 
 
+def values_at_indices(array, indices, interpolate=True):
+    '''
+    Finds the values of the data in array at many indices at once, following
+    the same rules as value_at_index:
+
+     * Indices outside the array boundaries take the first or last sample.
+     * Where one of the samples either side of an index is masked, the other
+       sample is taken.
+     * Where both samples are masked, or an index falls exactly on a masked
+       sample, the value is masked.
+
+    :param array: input data
+    :type array: masked array
+    :param indices: indices into the array where we want to find the array values. None values are masked.
+    :type indices: iterable of float or None
+    :param interpolate: whether to interpolate the values of float indices, otherwise the nearest sample is taken.
+    :type interpolate: boolean
+    :returns: interpolated values from the array, one per index.
+    :rtype: np.ma.masked_array
+    '''
+    indices = np.array(indices, dtype=float)
+    invalid = np.isnan(indices)
+    data = np.ma.getdata(array)
+    if not len(data) or not len(indices):
+        return np.ma.array(np.zeros(len(indices)), mask=True)
+
+    indices = np.clip(np.where(invalid, 0, indices), 0, len(data) - 1)
+    low = indices.astype(int)
+    high = np.minimum(low + 1, len(data) - 1)
+    r = indices - low
+    exact = r == 0
+    if interpolate:
+        values = r * data[high] + (1 - r) * data[low]
+        # Samples exactly at the index are taken without interpolation.
+        values[exact] = data[low[exact]]
+    else:
+        values = data[(indices + 0.5).astype(int)]
+
+    mask = np.ma.getmask(array)
+    if mask is np.ma.nomask or not mask.any():
+        return np.ma.array(values, mask=invalid)
+    low_masked = mask[low]
+    high_masked = mask[high] & ~exact
+    # Take the unmasked sample where only one is masked.
+    values = np.where(low_masked, data[high], values)
+    values = np.where(high_masked, data[low], values)
+    return np.ma.array(
+        values, mask=invalid | (low_masked & (exact | high_masked)))
+
+
 def vspeed_lookup(vspeed, aircraft, engine, flap, gw):
     '''
     Single point lookup for the vspeed tables.
@@ -6282,6 +6992,8 @@ def vspeed_lookup(vspeed, aircraft, engine, flap, gw):
 def vstack_params(*params):
     '''
     Create a multi-dimensional masked array with a dimension per param.
+    Multi-dimensional arrays, such as those returned by align_many,
+    contribute each of their rows.
 
     :param params: Parameter arguments as required. Allows some None values.
     :type params: np.ma.array or Parameter object or None
@@ -6318,7 +7030,7 @@ def vstack_params_where_state(*param_states):
             continue
         if state in param.array.state:
             array = getattr(param, 'array', param)
-            param_arrays.append(array == state)
+            param_arrays.append(multistate_match(array, state))
         else:
             logger.warning("State '%s' not found in param '%s'", state, param.name)
     return np.ma.vstack(param_arrays)
@@ -6329,81 +7041,49 @@ def second_window(array, frequency, seconds):
     Only include values which are maintained for a number of seconds, shorter
     exceedances are excluded.
     
-    Only supports odd numbers of seconds and frequencies of whole numbers.
+    Each value is held unless every value within the following window of
+    seconds * frequency + 1 samples is above or below it, in which case it
+    moves to the nearest of them. The last half window of samples of each
+    unmasked section is masked.
     
     e.g. [0, 1, 2, 3, 2, 1, 2, 3] -> [0, 1, 2, 2, 2, 2, 2, 2]
     
+    :param array: Array to process.
     :type array: np.ma.masked_array
+    :param frequency: Frequency of the array.
+    :type frequency: float
+    :param seconds: Duration of the window, rounded to whole samples.
+    :type seconds: float
+    :returns: Array of values maintained for the duration.
+    :rtype: np.ma.masked_array
     '''
-    if int(seconds) != seconds:
-        raise ValueError('Only whole seconds are currently supported.')
-    if ((seconds % 2 == 0 and not frequency % 2 == 1) or
-        (seconds % 2 == 1 and not frequency % 2 == 0)):
+    if seconds < 0 or frequency <= 0:
         raise ValueError('Invalid seconds for frequency')
     
-    frequency = int(frequency)  # only integer frequencies supported
-    samples = (seconds * frequency) + 1
-    # TODO: Fix for frequency..
-    arrays = [array]
-    for roll_value in range(int((samples / 2) + 1)):  # 0 roll?
-        positive_roll = np.roll(array, roll_value)
-        positive_roll[:roll_value] = np.ma.masked
-        negative_roll = np.roll(array, -roll_value)
-        negative_roll[-roll_value:] = np.ma.masked  # [-0:] will mask everything!
-        arrays.append(positive_roll)
-        arrays.append(negative_roll)
-    combined_array = np.ma.array(arrays)
-    min_array = np.ma.min(combined_array, axis=0)
-    max_array = np.ma.max(combined_array, axis=0)
+    samples = int(round(seconds * frequency)) + 1
+    half_window = (samples - 1) / 2
+    # Minimum and maximum of the window of samples starting at each index,
+    # ignoring masked values.
+    mask = np.ma.getmaskarray(array)
+    data = np.ma.getdata(array).astype(float)
+    min_array = minimum_filter1d(np.where(mask, np.inf, data), samples,
+                                 origin=-(samples / 2), mode='constant',
+                                 cval=np.inf)
+    max_array = maximum_filter1d(np.where(mask, -np.inf, data), samples,
+                                 origin=-(samples / 2), mode='constant',
+                                 cval=-np.inf)
     window_array = np_ma_masked_zeros_like(array)
-    unmasked_slices = np.ma.clump_unmasked(array)
-    for unmasked_slice in unmasked_slices:
-        last_value = array[unmasked_slice.start]
-        algo_slice = slice(unmasked_slice.start + (samples / 2),
-                           unmasked_slice.stop)
-        zipped_arrays = zip(array[algo_slice],
-                            min_array[algo_slice],
-                            max_array[algo_slice])
-        for index, (array_value,
-                    min_window,
-                    max_window) in enumerate(zipped_arrays,
-                                             start=unmasked_slice.start):
-            if array_value is np.ma.masked:
-                continue
-            if min_window < last_value < max_window:
-                # Mixed
-                window_array[index] = last_value
-            elif max_window > last_value:
-                # All greater than.
-                window_array[index] = last_value = min_window
-            elif min_window < last_value:
-                # All less than
-                window_array[index] = last_value = max_window
-            else:
-                window_array[index] = last_value
-        #try:
-            #first_index = np.ma.clump_unmasked(array)[0].start
-        #except IndexError:
-            ## array is entirely masked?
-            #return window_array
-        ##np.ma.array([array, max_array, min_array])
-        
-        #window_array[first_index] = last_value = array[first_index]
-        
-        #for index, (array_value,
-                    #min_window,
-                    #max_window) in enumerate(zip(array[first_index + 1:],
-                                                 #min_array[first_index + 1:],
-                                                 #max_array[first_index + 1:]),
-                                             #start=first_index):
-        ##stacked_array = np.ma.array([array, max_array, min_array])
-        ###for index, values in enumerate(tacked_array[], start=first_index):
-        ##for index in xrange(first_index, stacked_array.shape[1]):
-        ##values = stacked_array[...,index]
-        ##array_value, max_window, min_window = values.tolist()
-    ##from analysis_engine.plot_flight import plot_parameter
-    ##plot_parameter(window_array)
-    ##plot_parameter(array)
+    for unmasked_slice in np.ma.clump_unmasked(array):
+        algo_slice = slice(unmasked_slice.start,
+                           unmasked_slice.stop - half_window)
+        if algo_slice.start >= algo_slice.stop:
+            continue
+        # Values are held unless all of the window is greater or less than
+        # them, i.e. they are clipped between the window's minimum and
+        # maximum.
+        window_array[algo_slice] = _clip_scan(data[unmasked_slice.start],
+                                              min_array[algo_slice],
+                                              max_array[algo_slice])
     return np.ma.array(window_array)
 
 
@@ -6591,9 +7271,85 @@ def is_day(when, latitude, longitude, twilight='civil'):
     """
     if latitude is np.ma.masked or longitude is np.ma.masked:
         return np.ma.masked
+    limit = _twilight_limit(twilight)
     day = when.toordinal() - (734124-40529)
     t = when.time()
     time = (t.hour + t.minute/60.0 + t.second/3600.0)/24.0
+    elevation = _solar_elevation(day, time, latitude, longitude)
+
+    if elevation > limit:
+        return True # It is Day
+    else:
+        return False # It is Night
+
+
+def is_day_array(when, latitude, longitude, twilight='civil'):
+    """
+    Array version of is_day, for the day/night decision at every sample of
+    a flight track without a call per sample.
+
+    :param when: Dates and times, microseconds are ignored as by is_day.
+    :type when: np.array of datetime64
+    :param latitude: Latitude in decimal degrees, north is positive
+    :type latitude: np.ma.array
+    :param longitude: Longitude in decimal degrees, east is positive
+    :type longitude: np.ma.array
+    :param twilight: optional twilight setting. Default='civil', None, 'nautical' or 'astronomical'.
+
+    :raises ValueError if twilight not recognised.
+
+    :returns: True = daytime (including twilight), False = nighttime, masked where the latitude or longitude is masked.
+    :rtype: np.ma.array of bool
+    """
+    limit = _twilight_limit(twilight)
+    seconds = np.asarray(when).astype('datetime64[s]').astype(np.int64)
+    day = seconds // 86400 + (datetime(1970, 1, 1).toordinal() - (734124-40529))
+    seconds = seconds % 86400
+    time = (seconds // 3600 + seconds % 3600 // 60 / 60.0 +
+            seconds % 60 / 3600.0) / 24.0
+    elevation = _solar_elevation(day, time, np.ma.getdata(latitude),
+                                 np.ma.getdata(longitude))
+    return np.ma.array(elevation > limit,
+                       mask=np.ma.getmaskarray(latitude) |
+                       np.ma.getmaskarray(longitude))
+
+
+def _twilight_limit(twilight):
+    '''
+    :param twilight: twilight setting, see is_day.
+    :returns: Solar elevation (deg) above which it is day.
+    :rtype: float
+    :raises ValueError: If twilight is not recognised.
+    '''
+    # Solar diamteter gives an adjustment of 0.833 deg, as the rim of the sun
+    # appears before the centre of the disk.
+    if twilight == None:
+        limit = -0.8333 # Allows for diameter of sun's disk
+    # For civil twilight, allow 6 deg
+    elif twilight == 'civil':
+        limit = -6.0
+    # For nautical twilight, allow 12 deg
+    elif twilight == 'nautical':
+            limit = -12.0
+    # For astronomical twilight, allow 18 deg
+    elif twilight == 'astronomical':
+            limit = -18.0
+    else:
+        raise ValueError('is_day called with unrecognised twilight zone')
+    return limit
+
+
+def _solar_elevation(day, time, latitude, longitude):
+    '''
+    Solar elevation from Jean Meeus' Astronomial Algorithms, see is_day. The
+    arguments may be scalars or arrays.
+
+    :param day: Days since 31 December 1899.
+    :param time: Time as a fraction of the day.
+    :param latitude: Latitude in decimal degrees, north is positive
+    :param longitude: Longitude in decimal degrees, east is positive
+    :returns: Elevation of the centre of the sun (deg).
+    '''
     # Julian Day
     Jday     = day+2415019.5 + time
     # Julian Century
@@ -6608,40 +7364,20 @@ def is_day(when, latitude, longitude, twilight='civil'):
     ##### XXX: The following line is unused. Remove?
     ####Eccent   = 0.016708617-Jcent*(0.000042037+0.0000001236*Jcent) # 24.4 (significantly changed from web version)
     # Sun Eq of Ctr
-    Seqcent  = sin(radians(Manom))*(1.914600-Jcent*(0.004817+0.000014*Jcent))+sin(radians(2*Manom))*(0.019993-0.000101*Jcent)+sin(radians(3*Manom))*0.000290 # p152
+    Seqcent  = np.sin(np.radians(Manom))*(1.914600-Jcent*(0.004817+0.000014*Jcent))+np.sin(np.radians(2*Manom))*(0.019993-0.000101*Jcent)+np.sin(np.radians(3*Manom))*0.000290 # p152
     # Sun True Long (deg)
     Struelong= Mlong+Seqcent # Theta on p152
     # Mean Obliq Ecliptic (deg)
     Mobliq   = 23+(26+((21.448-Jcent*(46.815+Jcent*(0.00059-Jcent*0.001813))))/60)/60  # 21.2
     # Obliq Corr (deg)
-    obliq    = Mobliq + 0.00256*cos(radians(125.04-1934.136*Jcent))  # 24.8
+    obliq    = Mobliq + 0.00256*np.cos(np.radians(125.04-1934.136*Jcent))  # 24.8
     # Sun App Long (deg)
-    Sapplong = Struelong-0.00569-0.00478*sin(radians(125.04-1934.136*Jcent)) # Omega, Lambda p 152.
+    Sapplong = Struelong-0.00569-0.00478*np.sin(np.radians(125.04-1934.136*Jcent)) # Omega, Lambda p 152.
     # Sun Declin (deg)
-    declination = degrees(asin(sin(radians(obliq))*sin(radians(Sapplong)))) # 24.7
+    declination = np.degrees(np.arcsin(np.sin(np.radians(obliq))*np.sin(np.radians(Sapplong)))) # 24.7
     # Sun Rt Ascen (deg)
-    rightasc = degrees(atan2(cos(radians(Mobliq))*sin(radians(Sapplong)),cos(radians(Sapplong))))
-
-    elevation = degrees(asin(sin(radians(latitude))*sin(radians(declination)) +
-                    cos(radians(latitude))*cos(radians(declination))*cos(radians(Gstime+longitude-rightasc))))
-
-    # Solar diamteter gives an adjustment of 0.833 deg, as the rim of the sun
-    # appears before the centre of the disk.
-    if twilight == None:
-        limit = -0.8333 # Allows for diameter of sun's disk
-    # For civil twilight, allow 6 deg
-    elif twilight == 'civil':
-        limit = -6.0
-    # For nautical twilight, allow 12 deg
-    elif twilight == 'nautical':
-            limit = -12.0
-    # For astronomical twilight, allow 18 deg
-    elif twilight == 'astronomical':
-            limit = -18.0
-    else:
-        raise ValueError('is_day called with unrecognised twilight zone')
+    rightasc = np.degrees(np.arctan2(np.cos(np.radians(Mobliq))*np.sin(np.radians(Sapplong)),np.cos(np.radians(Sapplong))))
 
-    if elevation > limit:
-        return True # It is Day
-    else:
-        return False # It is Night
+    elevation = np.degrees(np.arcsin(np.sin(np.radians(latitude))*np.sin(np.radians(declination)) +
+                    np.cos(np.radians(latitude))*np.cos(np.radians(declination))*np.cos(np.radians(Gstime+longitude-rightasc))))
+    return elevation
@@ -31,7 +31,7 @@ from analysis_engine.library import (#actuator_mismatch,
                                      #cas2dp,
                                      #coreg,
                                      #cycle_finder,
-                                     datetime_of_index,
+                                     #datetime_of_index,
                                      #dp2tas,
                                      #dp_over_p2mach,
                                      #filter_vor_ils_frequencies,
@@ -47,7 +47,7 @@ from analysis_engine.library import (#actuator_mismatch,
                                      #ils_localizer_align,
                                      index_closest_value,
                                      #interpolate,
-                                     is_day,
+                                     is_day_array,
                                      #is_index_within_slice,
                                      #last_valid_sample,
                                      #latitudes_and_longitudes,
@@ -303,22 +303,16 @@ class Daylight(MultistateDerivedParameterNode):
                longitude=P('Longitude Smoothed'),
                start_datetime=A('Start Datetime'),
                duration=A('HDF Duration')):
-        # Set default to 'Day'
-        array_len = duration.value * self.frequency
-        self.array = np.ma.ones(array_len)
-        for step in xrange(int(array_len)):
-            curr_dt = datetime_of_index(start_datetime.value, step, 1)
-            lat = latitude.array[step]
-            lon = longitude.array[step]
-            if lat and lon:
-                if not is_day(curr_dt, lat, lon):
-                    # Replace values with Night
-                    self.array[step] = 0
-                else:
-                    continue  # leave array as 1
-            else:
-                # either is masked or recording 0.0 which is invalid too
-                self.array[step] = np.ma.masked
+        array_len = int(duration.value * self.frequency)
+        times = np.datetime64(start_datetime.value) + \
+            (np.arange(array_len) / self.frequency).astype('timedelta64[s]')
+        lat = latitude.array[:array_len]
+        lon = longitude.array[:array_len]
+        day = is_day_array(times, lat, lon)
+        # either is masked or recording 0.0 which is invalid too
+        day[(np.ma.getdata(lat) == 0) | (np.ma.getdata(lon) == 0)] = \
+            np.ma.masked
+        self.array = day.astype(float)
 
 
 class DualInputWarning(MultistateDerivedParameterNode):
@@ -5,12 +5,16 @@ import logging
 import math
 import numpy as np
 import cPickle
+import os
 import re
 import pprint
+import simplejson as json
+import struct
 
 from abc import ABCMeta
 from collections import namedtuple, Iterable
 from functools import total_ordering
+from cStringIO import StringIO
 from itertools import product
 from operator import attrgetter
 
@@ -21,6 +25,7 @@ from analysis_engine.library import (
     is_index_within_slice,
     is_index_within_slices,
     is_slice_within_slice,
+    multistate_match,
     repair_mask,
     runs_of_ones,
     slice_duration,
@@ -30,8 +35,8 @@ from analysis_engine.library import (
     slices_between,
     slices_from_ktis,
     slices_from_to,
-    value_at_index,
     value_at_time,
+    values_at_indices,
 )
 from analysis_engine.recordtype import recordtype
 
@@ -70,15 +75,26 @@ def get_verbose_name(class_name):
                   class_name).lower().strip()
 
 
+# Memory-mapped node file format, see dump_mmap().
+NODE_MMAP_MAGIC = '\x93NODMMAP'
+NODE_MMAP_VERSION = 1
+NODE_MMAP_ALIGNMENT = 64
+NODE_MMAP_EXTENSION = '.nodm'
+
+
 def load(path):
     '''
     Load a Node module from a file path.
 
-    Convention is to use the .nod file extension.
+    Convention is to use the .nod file extension. Memory-mapped node files
+    written by dump_mmap are detected and loaded with load_mmap.
     
     :param path: Path to pickled Node object file
     :type path: String
     '''
+    with open(path, 'rb') as fh:
+        if fh.read(len(NODE_MMAP_MAGIC)) == NODE_MMAP_MAGIC:
+            return load_mmap(path)
     with gzip.open(path) as file_obj:
         try:
             return cPickle.load(file_obj)
@@ -97,6 +113,194 @@ def dump(node, dest):
 save = dump
 
 
+def _npy_header(array):
+    '''
+    :returns: The .npy format header for the array.
+    :rtype: str
+    '''
+    header = StringIO()
+    np.lib.format.write_array_header_1_0(
+        header, np.lib.format.header_data_from_array_1_0(array))
+    return header.getvalue()
+
+
+def dump_mmap(node, dest):
+    '''
+    Save a node to a destination path in a format which can be loaded without
+    decompressing or unpickling its array.
+
+    The file contains NODE_MMAP_MAGIC, the length of a JSON header as a
+    4-byte little-endian integer and the JSON header itself, followed by
+    blocks aligned to NODE_MMAP_ALIGNMENT bytes. The header describes the
+    node and the offset and length of each block relative to the end of the
+    header:
+
+     * 'node': the pickled node without its array.
+     * 'data': the array's data in .npy format.
+     * 'mask': the array's mask in .npy format, if anything is masked.
+
+    Nodes without a masked array (e.g. KPVs or Sections) are stored
+    entirely within the 'node' block.
+
+    Convention is to use the .nodm file extension.
+
+    :param node: Node to save.
+    :type node: Node or hdfaccess.parameter.Parameter
+    :param dest: Destination file path.
+    :type dest: str
+    '''
+    array = getattr(node, 'array', None)
+    blocks = []
+    if isinstance(array, np.ma.MaskedArray) and not isinstance(node, list):
+        state = node.__dict__.copy()
+        del state['array']
+        values_mapping = getattr(array, 'values_mapping', None) \
+            if isinstance(array, MappedArray) else None
+        pickled = cPickle.dumps((node.__class__, state, values_mapping),
+                                cPickle.HIGHEST_PROTOCOL)
+        blocks.append(('node', pickled))
+        data = np.ascontiguousarray(np.ma.getdata(array))
+        if data.dtype.hasobject:
+            raise TypeError("Cannot store arrays of dtype '%s' in a "
+                            "memory-mapped node file." % data.dtype)
+        blocks.append(('data', data))
+        if np.ma.getmask(array) is not np.ma.nomask and np.any(array.mask):
+            blocks.append(('mask', np.ascontiguousarray(array.mask)))
+    else:
+        blocks.append(('node', cPickle.dumps(node, cPickle.HIGHEST_PROTOCOL)))
+
+    block_positions = {}
+    position = 0
+    for block_name, block in blocks:
+        if isinstance(block, np.ndarray):
+            length = len(_npy_header(block)) + block.nbytes
+        else:
+            length = len(block)
+        block_positions[block_name] = [position, length]
+        position += length + (-length % NODE_MMAP_ALIGNMENT)
+
+    header = {
+        'version': NODE_MMAP_VERSION,
+        'class': '%s.%s' % (node.__class__.__module__,
+                            node.__class__.__name__),
+        'name': getattr(node, 'name', None),
+        'blocks': block_positions,
+    }
+    for attr in ('frequency', 'offset'):
+        value = getattr(node, attr, None)
+        header[attr] = None if value is None else float(value)
+    header = json.dumps(header)
+    header_length = len(NODE_MMAP_MAGIC) + 4 + len(header)
+
+    with open(dest, 'wb') as fh:
+        fh.write(NODE_MMAP_MAGIC)
+        fh.write(struct.pack('<I', len(header)))
+        fh.write(header)
+        fh.write(' ' * (-header_length % NODE_MMAP_ALIGNMENT))
+        start = fh.tell()
+        for block_name, block in blocks:
+            fh.seek(start + block_positions[block_name][0])
+            if isinstance(block, np.ndarray):
+                fh.write(_npy_header(block))
+                block.tofile(fh)
+            else:
+                fh.write(block)
+
+
+def _load_mmap_array(path, fh, offset):
+    '''
+    Memory-map a .npy format block from an open memory-mapped node file.
+
+    The array is mapped copy-on-write so that it can be modified in memory
+    without changing the file.
+
+    :rtype: np.ndarray
+    '''
+    fh.seek(offset)
+    np.lib.format.read_magic(fh)
+    shape, fortran_order, dtype = np.lib.format.read_array_header_1_0(fh)
+    if not np.prod(shape):
+        return np.empty(shape, dtype=dtype)
+    return np.memmap(path, dtype=dtype, mode='c', offset=fh.tell(),
+                     shape=shape, order='F' if fortran_order else 'C')\
+        .view(np.ndarray)
+
+
+def load_mmap_header(path):
+    '''
+    Read the JSON header of a memory-mapped node file without loading the
+    node.
+
+    :param path: Path to memory-mapped node file.
+    :type path: str
+    :returns: Node header and the file offset of the first block.
+    :rtype: (dict, int)
+    :raises ValueError: If the file is not a memory-mapped node file.
+    '''
+    with open(path, 'rb') as fh:
+        if fh.read(len(NODE_MMAP_MAGIC)) != NODE_MMAP_MAGIC:
+            raise ValueError(
+                "'%s' is not a memory-mapped node file." % path)
+        header_length, = struct.unpack('<I', fh.read(4))
+        header = json.loads(fh.read(header_length))
+    if header['version'] > NODE_MMAP_VERSION:
+        raise ValueError(
+            "Memory-mapped node file version %s of '%s' is not supported." %
+            (header['version'], path))
+    start = len(NODE_MMAP_MAGIC) + 4 + header_length
+    return header, start + (-start % NODE_MMAP_ALIGNMENT)
+
+
+def load_mmap(path):
+    '''
+    Load a node saved with dump_mmap. The array data and mask are
+    memory-mapped rather than read into memory.
+
+    :param path: Path to memory-mapped node file.
+    :type path: str
+    :raises ValueError: If the file is not a memory-mapped node file.
+    '''
+    header, start = load_mmap_header(path)
+    blocks = header['blocks']
+    with open(path, 'rb') as fh:
+        offset, length = blocks['node']
+        fh.seek(start + offset)
+        pickled = cPickle.loads(fh.read(length))
+        if 'data' not in blocks:
+            return pickled
+        node_class, state, values_mapping = pickled
+        data = _load_mmap_array(path, fh, start + blocks['data'][0])
+        if 'mask' in blocks:
+            mask = _load_mmap_array(path, fh, start + blocks['mask'][0])
+        else:
+            mask = np.ma.nomask
+    array = np.ma.array(data, mask=mask, copy=False)
+    if values_mapping is not None:
+        array = MappedArray(array, values_mapping=values_mapping)
+    node = node_class.__new__(node_class)
+    node.__dict__.update(state)
+    node.__dict__['array'] = array
+    return node
+
+
+def convert_to_mmap(path, dest=None):
+    '''
+    Convert a pickled node file (.nod) into a memory-mapped node file.
+
+    :param path: Path to pickled Node object file.
+    :type path: str
+    :param dest: Destination file path, defaults to path with the .nodm
+        extension.
+    :type dest: str
+    :returns: Destination file path.
+    :rtype: str
+    '''
+    if dest is None:
+        dest = os.path.splitext(path)[0] + NODE_MMAP_EXTENSION
+    dump_mmap(load(path), dest)
+    return dest
+
+
 def powerset(iterable):
     """
     Ref: http://docs.python.org/library/itertools.html#recipes
@@ -676,18 +880,32 @@ def multistate_string_to_integer(string_array, mapping):
     if not len(string_array):
         return string_array
 
-    output_array = string_array.copy()
-    # values need converting using mapping
-    for int_value, str_value in mapping.iteritems():
-        output_array.data[string_array.data == str_value] = int_value
-    output_array.fill_value = 999999  #NB: only 999 will be stored by dtype
+    data = np.ma.getdata(string_array)
+    mask = np.ma.getmaskarray(string_array)
+    # Convert each distinct value once and index the lookup table with the
+    # inverse of the unique values rather than comparing the whole array
+    # against every state in the mapping.
+    unique_values, inverse = np.unique(data, return_inverse=True)
+    unmasked_values = np.bincount(inverse[~mask.ravel()],
+                                  minlength=len(unique_values)).astype(bool)
+    state = {v: k for k, v in mapping.iteritems()}
+    lookup = np.empty(len(unique_values), dtype=int)
+    for index, value in enumerate(unique_values):
+        if value in state:
+            lookup[index] = state[value]
+        elif not unmasked_values[index]:
+            # only found at masked indices, which are filled below
+            lookup[index] = 999999
+        else:
+            try:
+                lookup[index] = int(value)
+            except (TypeError, ValueError):
+                raise ValueError(
+                    "No value in values_mapping found for %s" % value)
+    int_array = np.ma.array(lookup[inverse].reshape(data.shape),
+                            mask=string_array.mask, fill_value=999999)
     # apply fill_value to all masked values
-    output_array.data[np.ma.where(output_array.mask)] = output_array.fill_value
-    try:
-        int_array = output_array.astype(int)
-    except ValueError as err:
-        msg = "No value in values_mapping found for %s" % str(err).split("'")[-2]
-        raise ValueError(msg)
+    int_array.data[mask] = int_array.fill_value
     return int_array
 
 
@@ -764,6 +982,9 @@ class MultistateDerivedParameterNode(DerivedParameterNode):
         if name == 'values_mapping':
             if hasattr(self, 'array'):
                 self.array.values_mapping = value
+            # Precompute the state to raw value lookup once per mapping.
+            object.__setattr__(self, 'state',
+                               {v: k for k, v in (value or {}).iteritems()})
             return object.__setattr__(self, name, value)
         # setting 'self.array'
         if isinstance(value, MappedArray):
@@ -801,15 +1022,38 @@ class MultistateDerivedParameterNode(DerivedParameterNode):
         elif isinstance(value, Iterable):
             # assume a list of mapped values
             reversed_mapping = {v: k for k, v in self.values_mapping.items()}
+            # Look up each distinct state once rather than every element.
+            unique_values, inverse = np.unique(np.asarray(list(value)),
+                                               return_inverse=True)
             #Q: change "int" to "float"
-            data = [int(reversed_mapping[v]) for v in value]
-            value = MappedArray(data, values_mapping=self.values_mapping)
+            lookup = np.array([int(reversed_mapping[v])
+                               for v in unique_values], dtype=int)
+            value = MappedArray(lookup[inverse],
+                                values_mapping=self.values_mapping)
         else:
             raise ValueError('Invalid argument type assigned to array: %s'
                              % type(value))
 
         return object.__setattr__(self, name, value)
     
+    def match(self, states, condition=True):
+        '''
+        Compare the raw integer array against the raw values of one or more
+        states using the precomputed state lookup.
+
+        `node.match('Engaged')` is equivalent to `node.array == 'Engaged'` and
+        `node.match(['Up', 'Down'])` to `node.array.any_of('Up', 'Down')`.
+
+        :param states: state or list of states to match.
+        :type states: str or [str]
+        :param condition: selection of true or false (i.e. inverse) test to apply.
+        :type condition: bool
+        :rtype: np.ma.array(dtype=bool)
+        :raises KeyError: if a state is not within the values mapping.
+        '''
+        return multistate_match(self.array, states, condition=condition,
+                                state_lookup=self.state)
+
     def __getstate__(self):
         '''
         Get the state of the object for pickling.
@@ -1517,34 +1761,27 @@ class KeyTimeInstanceNode(FormattedNameNode):
         Create KTIs from multistate parameters where data reaches and leaves
         given state.
 
-        Its logic operates on string representation of the multistate
-        parameter, not on the raw data value.
-
-        ..todo: instead of working on the strings in numpy, we need to find the
-            numeric value by reversing the mapping.
+        The state is compared against the raw integer values of the
+        multistate parameter rather than its string representation.
         '''
         # Low level function that finds start and stop indices of given state
         # and creates KTIs
-        def state_changes(state, array, change, _slice=None):
+        def state_changes(state, state_match, change, _slice=None):
             # Prepare kwargs to pass through to self.create_kti():
             kwargs = dict(replace_values=replace_values)
             if name:
                 # Annotate the transition with the post-change state.
                 kwargs.update(**{name: state})
-            # TODO: to improve performance reverse the state into numeric value
-            # and look it up in array.raw instead
             if _slice is None:
-                _slice = slice(0, len(array))
-            if len(array[_slice]) == 0:
+                _slice = slice(0, len(state_match))
+            if len(state_match[_slice]) == 0:
                 return
-            valid_periods = np.ma.clump_unmasked(array[_slice])
+            valid_periods = np.ma.clump_unmasked(state_match[_slice])
             for valid_period in valid_periods:
                 valid_slice = slice(valid_period.start + _slice.start,
                                     valid_period.stop + _slice.start)
-                state_periods = np.ma.clump_unmasked(
-                    np.ma.masked_not_equal(array[valid_slice].raw,
-                                           array.get_state_value(state)))
-                slice_len = len(array[valid_slice])
+                state_periods = runs_of_ones(state_match[valid_slice])
+                slice_len = len(state_match[valid_slice])
                 for period in state_periods:
                     # Calculate the location in the array
                     if change in ('entering', 'entering_and_leaving') \
@@ -1560,14 +1797,15 @@ class KeyTimeInstanceNode(FormattedNameNode):
             return
 
         repaired_array = repair_mask(array, frequency=self.frequency, repair_duration=64)
+        state_match = multistate_match(repaired_array, state)
         # High level function scans phase blocks or complete array and
         # presents appropriate arguments for analysis. We test for phase.name
         # as phase returns False.
         if phase is None:
-            state_changes(state, repaired_array, change)
+            state_changes(state, state_match, change)
         else:
             for each_period in phase:
-                state_changes(state, repaired_array, change, each_period.slice)
+                state_changes(state, state_match, change, each_period.slice)
         return
 
     def get_aligned(self, param):
@@ -1748,8 +1986,9 @@ class KeyPointValueNode(FormattedNameNode):
         :returns None:
         :rtype: None
         '''
-        for kti in ktis:
-            value = value_at_index(array, kti.index, interpolate=interpolate)
+        values = values_at_indices(array, [kti.index for kti in ktis],
+                                   interpolate=interpolate)
+        for kti, value in zip(ktis, values.tolist()):
             if not suppress_zeros or value:
                 self.create_kpv(kti.index, value)
 
@@ -2190,6 +2429,35 @@ class ApproachNode(ListNode):
 App = ApproachNode
 
 
+# Names of the Attributes accepted by each derived node's can_operate method.
+_can_operate_attributes = {}
+# Results of each derived node's can_operate method keyed by the available
+# dependencies and Attribute values, shared between flights.
+_can_operate_results = {}
+
+
+def _can_operate_attribute_names(derived_node):
+    """
+    :param derived_node: Derived node class.
+    :type derived_node: class
+    :returns: Names of the Attributes accepted as keyword arguments by the node's can_operate method.
+    :rtype: [str]
+    :raises TypeError: If can_operate has keyword arguments which are not Attributes.
+    """
+    if derived_node in _can_operate_attributes:
+        return _can_operate_attributes[derived_node]
+    names = []
+    argspec = inspect.getargspec(derived_node.can_operate)
+    if argspec.defaults:
+        for default in argspec.defaults:
+            if not isinstance(default, Attribute):
+                raise TypeError('Only Attributes may be keyword '
+                                'arguments in can_operate methods.')
+            names.append(default.name)
+    _can_operate_attributes[derived_node] = names
+    return names
+
+
 class NodeManager(object):
     def __repr__(self):
         return 'NodeManager: x%d nodes in total' % (
@@ -2282,18 +2550,24 @@ class NodeManager(object):
             return True
         elif name in self.derived_nodes:
             derived_node = self.derived_nodes[name]
-            # NOTE: Raises "Unbound method" here due to can_operate being
-            # overridden without wrapping with @classmethod decorator
-            attributes = []
-            argspec = inspect.getargspec(derived_node.can_operate)
-            if argspec.defaults:
-                for default in argspec.defaults:
-                    if not isinstance(default, Attribute):
-                        raise TypeError('Only Attributes may be keyword '
-                                        'arguments in can_operate methods.')
-                    attributes.append(self.get_attribute(default.name))
-            # can_operate expects attributes.
-            res = derived_node.can_operate(available, *attributes)
+            attributes = [self.get_attribute(attribute_name) for attribute_name
+                          in _can_operate_attribute_names(derived_node)]
+            # The result only depends upon the available dependencies and
+            # attribute values which are shared by flights with the same LFL.
+            key = (frozenset(available),
+                   tuple(None if a is None else (a.value,) for a in attributes))
+            results = _can_operate_results.setdefault(derived_node, {})
+            try:
+                res = results[key]
+            except KeyError:
+                # NOTE: Raises "Unbound method" here due to can_operate being
+                # overridden without wrapping with @classmethod decorator
+                # can_operate expects attributes.
+                res = results[key] = derived_node.can_operate(available,
+                                                              *attributes)
+            except TypeError:
+                # Attribute values which cannot be hashed are not cached.
+                res = derived_node.can_operate(available, *attributes)
             if not res:
                 logger.debug("Derived Node %s cannot operate with available nodes: %s",
                               name, available)
@@ -15,7 +15,8 @@ from analysis_engine.library import (
     bearing_and_distance, 
     latitudes_and_longitudes, 
     repair_mask, 
-    value_at_index,
+    values_at_indices,
+    values_at_times,
 )
 from analysis_engine.node import derived_param_from_hdf, Parameter
 from analysis_engine.settings import METRES_TO_FEET
@@ -90,23 +91,22 @@ def add_track(kml, track_name, lat, lon, colour, alt_param=None, alt_mode=None,
         track_config['altitudemode'] = alt_mode
         track_config['extrude'] = 1
         
-    track_coords = []
     ##scope_lon = np.ma.flatnotmasked_edges(lon.array)
     ##scope_lat = np.ma.flatnotmasked_edges(lat.array)
     ##begin = max(scope_lon[0], scope_lat[0])+1
     ##end = min(scope_lon[1], scope_lat[1])-1
-    for i in xrange(0, len(lon.array)):
-        _lon = value_at_index(lon.array, i)
-        _lat = value_at_index(lat.array, i)
-        if alt_param:
-            _alt = value_at_index(alt_param.array, i)
-            coords = (_lon, _lat, _alt)
-        else:
-            coords = (_lon, _lat)
-            
-        if not all(coords) or any(np.isnan(coords)):
-            continue
-        track_coords.append(coords)
+    indices = np.arange(len(lon.array))
+    columns = [values_at_indices(lon.array, indices),
+               values_at_indices(lat.array, indices)]
+    if alt_param:
+        columns.append(values_at_indices(alt_param.array, indices))
+    # Skip coordinates which are masked, zero or NaN.
+    valid = np.ones(len(indices), dtype=bool)
+    for column in columns:
+        valid &= ~np.ma.getmaskarray(column)
+        valid &= np.ma.getdata(column) != 0
+        valid &= ~np.isnan(np.ma.getdata(column))
+    track_coords = zip(*[np.ma.getdata(c)[valid] for c in columns])
                 
     track_config['coords'] = track_coords
     line = kml.newlinestring(**track_config)
@@ -451,14 +451,13 @@ def csv_flight_details(hdf_path, kti_list, kpv_list, phase_list,
     # Append values of useful parameters at this time
     with hdf_file(hdf_path) as hdf:
         for param in params:
-            # Create DerivedParameterNode to utilise the .at() method
             if param not in hdf:
                 continue
             p = hdf[param]
-            dp = Parameter(name=p.name, array=p.array, 
-                           frequency=p.frequency, offset=p.offset)
-            for row in rows:
-                row[param] = dp.at(row['index'])
+            values = values_at_times(p.array, p.frequency, p.offset,
+                                     [row['index'] for row in rows])
+            for row, value in zip(rows, values):
+                row[param] = None if value is np.ma.masked else value
 
     # sort rows
     rows = sorted(rows, key=lambda x: x['index'])
@@ -5,15 +5,26 @@ import os
 import sys
 
 from datetime import datetime, timedelta
-from networkx.readwrite import json_graph
 
 from flightdatautilities.filesystem_tools import copy_file
 
 from hdfaccess.file import hdf_file
 
 from analysis_engine import hooks, settings, __version__
-from analysis_engine.dependency_graph import dependency_order
-from analysis_engine.library import np_ma_masked_zeros_like, repair_mask
+from analysis_engine.analysis_plan import (
+    create_analysis_plan,
+    load_analysis_plan,
+)
+from analysis_engine.dependency_graph import (
+    dependency_order,
+    dumps_dependency_tree,
+    store_dependency_tree,
+)
+from analysis_engine.library import (
+    np_ma_masked_zeros_like,
+    repair_mask,
+    values_at_times,
+)
 from analysis_engine.node import (ApproachNode, Attribute,
                                   derived_param_from_hdf,
                                   DerivedParameterNode,
@@ -39,11 +50,18 @@ def geo_locate(hdf, items):
 
     lat_pos = derived_param_from_hdf(hdf['Latitude Smoothed'])
     lon_pos = derived_param_from_hdf(hdf['Longitude Smoothed'])
-    lat_rep = repair_mask(lat_pos, extrapolate=True)
-    lon_rep = repair_mask(lon_pos, extrapolate=True)
-    for item in items:
-        item.latitude = lat_rep.at(item.index) or None
-        item.longitude = lon_rep.at(item.index) or None
+    lat_rep = repair_mask(lat_pos.array, extrapolate=True,
+                          zero_if_masked=True)
+    lon_rep = repair_mask(lon_pos.array, extrapolate=True,
+                          zero_if_masked=True)
+    indices = [item.index for item in items]
+    latitudes = values_at_times(lat_rep, lat_pos.frequency, lat_pos.offset,
+                                indices)
+    longitudes = values_at_times(lon_rep, lon_pos.frequency, lon_pos.offset,
+                                 indices)
+    for item, latitude, longitude in zip(items, latitudes, longitudes):
+        item.latitude = latitude or None
+        item.longitude = longitude or None
     return items
 
 
@@ -273,10 +291,61 @@ def parse_analyser_profiles(analyser_profiles):
     return additional_modules, required_nodes
 
 
+def _requested_nodes(derived_nodes, requested, include_flight_attributes):
+    '''
+    :returns: Requested derived node names, all derived nodes if none are requested.
+    :rtype: [str]
+    '''
+    if requested:
+        requested = \
+            list(set(requested).intersection(set(derived_nodes)))
+    else:
+        # if requested isn't set, try using ALL derived_nodes!
+        logger.info("No requested nodes declared, using all derived nodes")
+        requested = derived_nodes.keys()
+
+    # include all flight attributes as requested
+    if include_flight_attributes:
+        requested = list(set(
+            requested + get_derived_nodes(
+                ['analysis_engine.flight_attribute']).keys()))
+    return requested
+
+
+def build_analysis_plan(hdf_path, tail_number, aircraft_info,
+                        achieved_flight_record={}, requested=[], required=[],
+                        include_flight_attributes=True,
+                        additional_modules=[]):
+    '''
+    Creates an analysis plan from a representative HDF file of a data frame.
+    The plan can be passed into process_flight for other flights of the same
+    data frame and aircraft to skip resolving the dependency graph.
+
+    Arguments are the same as process_flight. The HDF file is not modified
+    other than by hooks.PRE_FLIGHT_ANALYSIS.
+
+    :returns: Analysis plan of the HDF file.
+    :rtype: AnalysisPlan
+    '''
+    aircraft_info = dict(aircraft_info, **{'Tail Number': tail_number})
+    node_modules = additional_modules + settings.NODE_MODULES
+    derived_nodes = get_derived_nodes(node_modules)
+    requested = _requested_nodes(derived_nodes, requested,
+                                 include_flight_attributes)
+    with hdf_file(hdf_path) as hdf:
+        if hooks.PRE_FLIGHT_ANALYSIS:
+            hooks.PRE_FLIGHT_ANALYSIS(hdf, aircraft_info)
+        node_mgr = NodeManager(
+            datetime.now(), hdf.duration, hdf.valid_param_names(),
+            requested, required, derived_nodes, aircraft_info,
+            achieved_flight_record)
+        return create_analysis_plan(node_mgr)
+
+
 def process_flight(hdf_path, tail_number, aircraft_info={},
                    start_datetime=datetime.now(), achieved_flight_record={},
                    requested=[], required=[], include_flight_attributes=True,
-                   additional_modules=[]):
+                   additional_modules=[], plan=None):
     '''
     Processes the HDF file (hdf_path) to derive the required_params (Nodes)
     within python modules (settings.NODE_MODULES).
@@ -300,6 +369,8 @@ def process_flight(hdf_path, tail_number, aircraft_info={},
     :type include_flight_attributes: Boolean
     :param additional_modules: List of module paths to import.
     :type additional_modules: List of Strings
+    :param plan: Analysis plan created by build_analysis_plan for the data frame. The dependency graph is only resolved if the plan does not apply to this flight.
+    :type plan: AnalysisPlan or path to a saved plan
 
     :returns: See below:
     :rtype: Dict
@@ -453,20 +524,8 @@ def process_flight(hdf_path, tail_number, aircraft_info={},
     # go through modules to get derived nodes
     node_modules = additional_modules + settings.NODE_MODULES
     derived_nodes = get_derived_nodes(node_modules)
-
-    if requested:
-        requested = \
-            list(set(requested).intersection(set(derived_nodes)))
-    else:
-        # if requested isn't set, try using ALL derived_nodes!
-        logger.info("No requested nodes declared, using all derived nodes")
-        requested = derived_nodes.keys()
-
-    # include all flight attributes as requested
-    if include_flight_attributes:
-        requested = list(set(
-            requested + get_derived_nodes(
-                ['analysis_engine.flight_attribute']).keys()))
+    requested = _requested_nodes(derived_nodes, requested,
+                                 include_flight_attributes)
 
     # open HDF for reading
     with hdf_file(hdf_path) as hdf:
@@ -481,16 +540,26 @@ def process_flight(hdf_path, tail_number, aircraft_info={},
             start_datetime, hdf.duration, hdf.valid_param_names(),
             requested, required, derived_nodes, aircraft_info,
             achieved_flight_record)
-        # calculate dependency tree
-        process_order, gr_st = dependency_order(node_mgr, draw=False)
+        if isinstance(plan, basestring):
+            plan = load_analysis_plan(plan)
+        if plan is not None and plan.is_valid(node_mgr):
+            logger.info("Using analysis plan %r", plan)
+            process_order = plan.process_order
+            usage = plan.usage
+            dependency_tree = plan.dependency_tree
+        else:
+            # calculate dependency tree
+            process_order, gr_st = dependency_order(node_mgr, draw=False)
+            usage = dict((node, len(gr_st.predecessors(node)))
+                         for node in gr_st.nodes()
+                         if node in node_mgr.derived_nodes)
+            dependency_tree = dumps_dependency_tree(gr_st)
         if settings.CACHE_PARAMETER_MIN_USAGE:
             # find params used more than
-            for node in gr_st.nodes():
-                if node in node_mgr.derived_nodes:
-                    # this includes KPV/KTIs but they'll be ignored by HDF
-                    qty = len(gr_st.predecessors(node))
-                    if qty > settings.CACHE_PARAMETER_MIN_USAGE:
-                        hdf.cache_param_list.append(node)
+            for node, qty in usage.iteritems():
+                # this includes KPV/KTIs but they'll be ignored by HDF
+                if qty > settings.CACHE_PARAMETER_MIN_USAGE:
+                    hdf.cache_param_list.append(node)
             logging.info("HDF set to cache parameters: %s",
                          hdf.cache_param_list)
 
@@ -509,7 +578,10 @@ def process_flight(hdf_path, tail_number, aircraft_info={},
         # Store version of FlightDataAnalyser
         hdf.analysis_version = __version__
         # Store dependency tree
-        hdf.dependency_tree = json_graph.dumps(gr_st)
+        if settings.DEPENDENCY_TREE_STORE:
+            dependency_tree = store_dependency_tree(
+                dependency_tree, settings.DEPENDENCY_TREE_STORE)
+        hdf.dependency_tree = dependency_tree
         # Store aircraft info
         hdf.set_attr('aircraft_info', aircraft_info)
         hdf.set_attr('achieved_flight_record', achieved_flight_record)
@@ -550,6 +622,8 @@ def main():
                         help='Aircraft tail number.')
     parser.add_argument('--strip', default=False, action='store_true',
                         help='Strip the HDF5 file to only the LFL parameters')
+    parser.add_argument('--plan', dest='plan', type=str,
+                        help='Analysis plan created by analysis_plan.py.')
 
     # Aircraft info
     parser.add_argument('-aircraft-family', dest='aircraft_family', type=str,
@@ -639,7 +713,7 @@ def main():
             hdf.delete_params(hdf.derived_keys())
     res = process_flight(
         hdf_copy, args.tail_number, aircraft_info=aircraft_info,
-        requested=args.requested, required=args.required)
+        requested=args.requested, required=args.required, plan=args.plan)
     logger.info("Derived parameters stored in hdf: %s", hdf_copy)
     # Write CSV file
     if args.write_csv.lower() == 'true':
@@ -128,6 +128,11 @@ def recordtype(typename, field_names, verbose=False, **default_kwds):
 
             def __setstate__(self, state):
                 %(tupletxt)s = state
+
+            def __reduce__(self):
+                # Pickle as a call to the constructor rather than via
+                # __newobj__ and __setstate__ for smaller, faster pickles.
+                return (self.__class__, %(tupletxt)s)
     ''') % {
         'typename': typename,
         'field_names': field_names,
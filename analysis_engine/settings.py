@@ -60,6 +60,11 @@ CA_CERTIFICATE_FILE = '/etc/ssl/certs/ca-certificates.crt'
 # Cache parameters which are used more than n times in HDF
 CACHE_PARAMETER_MIN_USAGE = 0
 
+# Directory of dependency trees shared between processed HDF files. If set,
+# only a reference to the dependency tree within this directory is stored in
+# each HDF file.
+DEPENDENCY_TREE_STORE = None
+
 
 ##############################################################################
 # Segment Splitting
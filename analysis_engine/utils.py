@@ -9,8 +9,8 @@ from hdfaccess.file import hdf_file
 from hdfaccess.utils import strip_hdf
 
 from analysis_engine.api_handler import APIError, get_api_handler
-from analysis_engine.dependency_graph import dependencies3, graph_nodes
-from analysis_engine.node import Node, NodeManager
+from analysis_engine.dependency_graph import GraphOverlay, dependencies3
+from analysis_engine.node import Node, NodeManager, convert_to_mmap
 from analysis_engine import settings
 
 
@@ -93,6 +93,31 @@ def get_derived_nodes(module_names):
     return nodes
 
 
+def trimmer_parameters(hdf_keys, node_names, derived_nodes, duration=None):
+    '''
+    Finds the parameters which are dependencies of nodes in node_names with
+    a single traversal of the dependency graph.
+    
+    :param hdf_keys: Parameter names within the HDF file.
+    :type hdf_keys: list of str
+    :param node_names: A list of Node names which are required.
+    :type node_names: list of str
+    :param derived_nodes: Derived node classes keyed by name.
+    :type derived_nodes: dict
+    :param duration: Duration of the HDF file in seconds.
+    :type duration: int
+    :return: Parameters in hdf_keys which are dependencies of the nodes.
+    :rtype: [str]
+    '''
+    node_mgr = NodeManager(
+        datetime.now(), duration, hdf_keys, node_names, [],
+        derived_nodes, {}, {})
+    _graph = GraphOverlay(node_mgr)
+    hdf_keys = set(hdf_keys)
+    return [d for d in dependencies3(_graph, 'root', node_mgr)
+            if d in hdf_keys]
+
+
 def derived_trimmer(hdf_path, node_names, dest):
     '''
     Trims an HDF file of parameters which are not dependencies of nodes in
@@ -107,24 +132,56 @@ def derived_trimmer(hdf_path, node_names, dest):
     :return: parameters in stripped hdf file
     :rtype: [str]
     '''
-    params = []
+    derived_nodes = get_derived_nodes(settings.NODE_MODULES)
     with hdf_file(hdf_path) as hdf:
-        derived_nodes = get_derived_nodes(settings.NODE_MODULES)
-        node_mgr = NodeManager(
-            datetime.now(), hdf.duration, hdf.valid_param_names(), [],
-            derived_nodes, {}, {})
-        _graph = graph_nodes(node_mgr)
-        for node_name in node_names:
-            deps = dependencies3(_graph, node_name, node_mgr)
-            params.extend(filter(lambda d: d in node_mgr.hdf_keys, deps))
+        params = trimmer_parameters(hdf.valid_param_names(), node_names,
+                                    derived_nodes, hdf.duration)
     return strip_hdf(hdf_path, params, dest) 
 
 
+def batch_derived_trimmer(hdf_paths, node_names, dest_dir):
+    '''
+    Trims many HDF files of parameters which are not dependencies of nodes
+    in node_names. The dependencies are found once for each distinct set of
+    parameters (LFL) within the HDF files.
+    
+    :param hdf_paths: file paths of hdf files.
+    :type hdf_paths: list of str
+    :param node_names: A list of Node names which are required.
+    :type node_names: list of str
+    :param dest_dir: destination directory for trimmed output files, which are given the same filenames as the input files.
+    :type dest_dir: str
+    :return: parameters in each stripped hdf file keyed by input file path
+    :rtype: {str: [str]}
+    :raises ValueError: If any file would be trimmed in place.
+    '''
+    dests = [(hdf_path, os.path.join(dest_dir, os.path.basename(hdf_path)))
+             for hdf_path in hdf_paths]
+    # Check every destination before stripping so that a bad batch does not
+    # leave some of its output written.
+    for hdf_path, dest in dests:
+        if os.path.abspath(dest) == os.path.abspath(hdf_path):
+            raise ValueError("Cannot trim '%s' in place." % hdf_path)
+    derived_nodes = get_derived_nodes(settings.NODE_MODULES)
+    lfl_params = {}  # params to keep for each set of hdf parameter names
+    trimmed = {}
+    for hdf_path, dest in dests:
+        with hdf_file(hdf_path) as hdf:
+            hdf_keys = hdf.valid_param_names()
+            signature = frozenset(hdf_keys)
+            if signature not in lfl_params:
+                lfl_params[signature] = trimmer_parameters(
+                    hdf_keys, node_names, derived_nodes, hdf.duration)
+        trimmed[hdf_path] = strip_hdf(hdf_path, lfl_params[signature], dest)
+    return trimmed
+
+
 if __name__ == '__main__':
     parser = argparse.ArgumentParser()
     subparser = parser.add_subparsers(dest='command',
-                                      description="Utility command, currently "
-                                      "only 'trimmer' is supported",
+                                      description="Utility command, either "
+                                      "'trimmer', 'batch_trimmer' or "
+                                      "'convert_nodes'",
                                       help='Additional help')
     trimmer_parser = subparser.add_parser('trimmer')
     trimmer_parser.add_argument('input_file_path', help='Input hdf filename.')  
@@ -133,6 +190,21 @@ if __name__ == '__main__':
                                 help='Keep dependencies of the specified nodes '
                                 'within the output hdf file. All other '
                                 'parameters will be stripped.')
+    batch_trimmer_parser = subparser.add_parser('batch_trimmer')
+    batch_trimmer_parser.add_argument('output_dir_path',
+                                      help='Output directory for hdf files.')
+    batch_trimmer_parser.add_argument('input_file_paths', nargs='+',
+                                      help='Input hdf filenames.')
+    batch_trimmer_parser.add_argument('-n', '--nodes', nargs='+',
+                                      required=True,
+                                      help='Keep dependencies of the '
+                                      'specified nodes within the output hdf '
+                                      'files. All other parameters will be '
+                                      'stripped.')
+    convert_parser = subparser.add_parser('convert_nodes')
+    convert_parser.add_argument('node_file_paths', nargs='+',
+                                help='Pickled node files (.nod) to convert '
+                                'into memory-mapped node files (.nodm).')
     
     args = parser.parse_args()
     if args.command == 'trimmer':
@@ -150,6 +222,31 @@ if __name__ == '__main__':
                 print ' * %s' % name
         else:
             print 'No matching parameters were found in the hdf file.'            
+    elif args.command == 'batch_trimmer':
+        if not os.path.isdir(args.output_dir_path):
+            parser.error("Output directory path '%s' does not exist." %
+                         args.output_dir_path)
+        for input_file_path in args.input_file_paths:
+            if not os.path.isfile(input_file_path):
+                parser.error("Input file path '%s' does not exist." %
+                             input_file_path)
+            output_file_path = os.path.join(args.output_dir_path,
+                                            os.path.basename(input_file_path))
+            if os.path.exists(output_file_path):
+                parser.error("Output file path '%s' already exists." %
+                             output_file_path)
+        trimmed = batch_derived_trimmer(args.input_file_paths, args.nodes,
+                                        args.output_dir_path)
+        for input_file_path in args.input_file_paths:
+            print '%s: %d parameters' % (input_file_path,
+                                         len(trimmed[input_file_path]))
+    elif args.command == 'convert_nodes':
+        for node_file_path in args.node_file_paths:
+            if not os.path.isfile(node_file_path):
+                parser.error("Node file path '%s' does not exist." %
+                             node_file_path)
+            print '%s -> %s' % (node_file_path,
+                                convert_to_mmap(node_file_path))
     else:
         parser.error("'%s' is not a known command." % args.command)
 
@@ -0,0 +1,228 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from datetime import datetime
+from mock import MagicMock, patch
+
+from analysis_engine.analysis_plan import (
+    AnalysisPlan,
+    create_analysis_plan,
+    dump_analysis_plan,
+    load_analysis_plan,
+)
+from analysis_engine.dependency_graph import (
+    dependency_order,
+    loads_dependency_tree,
+)
+from analysis_engine.library import any_of
+from analysis_engine.node import (
+    A,
+    DerivedParameterNode,
+    NodeManager,
+    P,
+)
+from analysis_engine.process_flight import build_analysis_plan, process_flight
+
+
+class Speed(DerivedParameterNode):
+    @classmethod
+    def can_operate(cls, available):
+        return any_of(('Airspeed', 'Groundspeed'), available)
+
+    def derive(self, airspeed=P('Airspeed'), gspd=P('Groundspeed')):
+        pass
+
+
+class Climb(DerivedParameterNode):
+    def derive(self, alt=P('Altitude STD'), speed=P('Speed')):
+        pass
+
+
+class FamilyClimb(DerivedParameterNode):
+    align_frequency = 1
+
+    @classmethod
+    def can_operate(cls, available, family=A('Family')):
+        return family and family.value == 'B737 Classic' and \
+            'Climb' in available
+
+    def derive(self, climb=P('Climb'), family=A('Family')):
+        pass
+
+
+class PreciseSpeed(DerivedParameterNode):
+    def derive(self, speed=P('Speed'), precise=A('Precise Positioning')):
+        pass
+
+
+class TestAnalysisPlan(unittest.TestCase):
+    def setUp(self):
+        self.derived_nodes = {
+            'Speed': Speed,
+            'Climb': Climb,
+            'Family Climb': FamilyClimb,
+        }
+        self.hdf_keys = ['Airspeed', 'Altitude STD', 'Unused']
+        self.aircraft_info = {'Family': 'B737 Classic', 'Tail Number': 'G-ABCD'}
+        self.tempdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def _node_mgr(self, hdf_keys=None, aircraft_info=None, requested=None):
+        return NodeManager(
+            datetime.now(), 100,
+            self.hdf_keys if hdf_keys is None else hdf_keys,
+            self.derived_nodes.keys() if requested is None else requested,
+            [], self.derived_nodes,
+            self.aircraft_info if aircraft_info is None else aircraft_info,
+            {})
+
+    def test_create_analysis_plan(self):
+        node_mgr = self._node_mgr()
+        plan = create_analysis_plan(node_mgr)
+        process_order, gr_st = dependency_order(node_mgr, draw=False)
+        self.assertEqual(plan.process_order, process_order)
+        self.assertEqual(plan.lfl_parameters, ['Airspeed', 'Altitude STD'])
+        self.assertEqual(plan.available,
+                         ['Airspeed', 'Altitude STD', 'Family'])
+        self.assertEqual(plan.attribute_values, {'Family': 'B737 Classic'})
+        self.assertEqual(plan.alignment['Climb'], {
+            'target': 'Altitude STD', 'frequency': None, 'offset': None})
+        self.assertEqual(plan.alignment['Family Climb'], {
+            'target': 'Climb', 'frequency': 1, 'offset': None})
+        self.assertEqual(plan.nodes['Speed'], {
+            'node_type': 'DerivedParameterNode', 'module': __name__,
+            'dependencies': ['Airspeed']})
+        self.assertEqual(plan.usage['Climb'], 1)
+        # Only required by the root node.
+        self.assertEqual(plan.usage['Family Climb'], 1)
+        self.assertEqual(
+            sorted(loads_dependency_tree(plan.dependency_tree).edges()),
+            sorted(gr_st.edges()))
+
+    def test_validate(self):
+        plan = create_analysis_plan(self._node_mgr())
+        self.assertEqual(plan.validate(self._node_mgr()), [])
+        self.assertTrue(plan.is_valid(self._node_mgr()))
+        # Parameters outside of the graph are ignored.
+        node_mgr = self._node_mgr(hdf_keys=['Airspeed', 'Altitude STD'])
+        self.assertTrue(plan.is_valid(node_mgr))
+        node_mgr = self._node_mgr(
+            hdf_keys=['Airspeed', 'Altitude STD', 'Groundspeed'])
+        self.assertEqual(plan.validate(node_mgr), [
+            "Available parameters differ: missing [], additional "
+            "['Groundspeed']."])
+        node_mgr = self._node_mgr(hdf_keys=['Airspeed'])
+        self.assertFalse(plan.is_valid(node_mgr))
+        node_mgr = self._node_mgr(aircraft_info={'Family': 'B737 NG'})
+        self.assertEqual(plan.validate(node_mgr),
+                         ["Attribute values differ: ['Family']."])
+        node_mgr = self._node_mgr(requested=['Climb'])
+        self.assertEqual(plan.validate(node_mgr),
+                         ['Requested or required nodes differ.'])
+        self.derived_nodes['Family Climb'] = Climb
+        self.assertEqual(plan.validate(self._node_mgr()),
+                         ['Derived nodes differ.'])
+
+    def test_validate_attribute_availability(self):
+        self.derived_nodes['Precise Speed'] = PreciseSpeed
+        # Attributes with None values are unavailable.
+        node_mgr = self._node_mgr()
+        node_mgr.aircraft_info['Precise Positioning'] = None
+        node_mgr.achieved_flight_record['Precise Positioning'] = None
+        plan = create_analysis_plan(node_mgr)
+        self.assertFalse('Precise Positioning' in plan.available)
+        self.assertFalse('Precise Speed' in plan.process_order)
+        self.assertTrue(plan.is_valid(self._node_mgr()))
+        node_mgr = self._node_mgr(aircraft_info=dict(
+            self.aircraft_info, **{'Precise Positioning': True}))
+        self.assertEqual(plan.validate(node_mgr), [
+            "Available parameters differ: missing [], additional "
+            "['Precise Positioning']."])
+
+    def test_dump_and_load(self):
+        plan = create_analysis_plan(self._node_mgr())
+        path = os.path.join(self.tempdir, 'plan.json')
+        dump_analysis_plan(plan, path)
+        loaded = load_analysis_plan(path)
+        self.assertEqual(loaded.todict(), plan.todict())
+        self.assertTrue(loaded.is_valid(self._node_mgr()))
+        # Tuples are loaded from JSON as lists.
+        aircraft_info = dict(self.aircraft_info,
+                             Family=('B737 Classic', 'B737 NG'))
+        plan = create_analysis_plan(self._node_mgr(aircraft_info=aircraft_info))
+        dump_analysis_plan(plan, path)
+        loaded = load_analysis_plan(path)
+        self.assertTrue(
+            loaded.is_valid(self._node_mgr(aircraft_info=aircraft_info)))
+        plan_dict = plan.todict()
+        plan_dict['version'] = 0
+        self.assertRaises(ValueError, AnalysisPlan.fromdict, plan_dict)
+
+
+@patch('analysis_engine.settings.NODE_MODULES', [__name__])
+@patch('analysis_engine.process_flight.hdf_file')
+class TestProcessFlightWithPlan(unittest.TestCase):
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.hdf_path = os.path.join(self.tempdir, 'flight.hdf5')
+        self.aircraft_info = {'Family': 'B737 Classic'}
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def _mock_hdf_file(self, hdf_file):
+        hdf = MagicMock()
+        hdf.duration = 100
+        hdf.valid_param_names.return_value = [
+            'Airspeed', 'Altitude STD', 'Unused']
+        hdf.cache_param_list = []
+        hdf_file.return_value.__enter__.return_value = hdf
+
+    def _build_plan(self):
+        return build_analysis_plan(self.hdf_path, 'G-ABCD',
+                                   self.aircraft_info,
+                                   include_flight_attributes=False)
+
+    def _process_flight(self, plan):
+        return process_flight(self.hdf_path, 'G-ABCD',
+                              aircraft_info=dict(self.aircraft_info),
+                              include_flight_attributes=False, plan=plan)
+
+    def test_build_analysis_plan(self, hdf_file):
+        self._mock_hdf_file(hdf_file)
+        plan = self._build_plan()
+        self.assertEqual(plan.process_order,
+                         ['Airspeed', 'Speed', 'Altitude STD', 'Climb',
+                          'Family', 'Family Climb'])
+        self.assertEqual(plan.lfl_parameters, ['Airspeed', 'Altitude STD'])
+        self.assertEqual(plan.attribute_values, {'Family': 'B737 Classic'})
+
+    @patch('analysis_engine.process_flight.dependency_order')
+    @patch('analysis_engine.process_flight.derive_parameters')
+    def test_process_flight_plan(self, derive_parameters, dependency_order,
+                                 hdf_file):
+        self._mock_hdf_file(hdf_file)
+        derive_parameters.return_value = ([], [], [], [], {})
+        plan = self._build_plan()
+        self._process_flight(plan)
+        self.assertFalse(dependency_order.called)
+        self.assertEqual(derive_parameters.call_args[0][2],
+                         plan.process_order)
+
+    @patch('analysis_engine.process_flight.dependency_order')
+    @patch('analysis_engine.process_flight.derive_parameters')
+    def test_process_flight_plan_path(self, derive_parameters,
+                                      dependency_order, hdf_file):
+        self._mock_hdf_file(hdf_file)
+        derive_parameters.return_value = ([], [], [], [], {})
+        plan = self._build_plan()
+        path = os.path.join(self.tempdir, 'plan.json')
+        dump_analysis_plan(plan, path)
+        self._process_flight(path)
+        self.assertFalse(dependency_order.called)
+        self.assertEqual(derive_parameters.call_args[0][2],
+                         plan.process_order)
@@ -1,19 +1,40 @@
 import collections
+import json
+import os
+import random
+import shutil
+import tempfile
 import unittest
 import networkx as nx
 
 from datetime import datetime
 
+from analysis_engine import settings
 from analysis_engine.node import (DerivedParameterNode, Node, NodeManager, P)
 from analysis_engine.dependency_graph import (
     any_predecessors_in_requested,
+    critical_path,
+    dumps_dependency_tree,
+    dependencies3,
     dependency_order, 
     graph_nodes, 
     graph_adjacencies,
+    graph_template,
+    GraphOverlay,
     indent_tree,
+    loads_dependency_tree,
+    parallelism_analysis,
+    parallelism_report,
     process_order,
+    requested_roots,
+    store_dependency_tree,
 )
 from analysis_engine.utils import get_derived_nodes
+from networkx.readwrite import json_graph
+
+benchmark = unittest.skipUnless(os.environ.get('BENCHMARK'),
+                                'Set BENCHMARK to run timing tests.')
+
   
 def flatten(l):
     "Flatten an iterable of many levels of depth (generator)"
@@ -166,6 +187,24 @@ class TestDependencyGraph(unittest.TestCase):
         self.assertFalse(any_predecessors_in_requested('x', req, gr))
         self.assertFalse(any_predecessors_in_requested('y', req, gr))
         
+    def test_requested_roots(self):
+        edges = [('a', 'b'), ('b', 'c1'), ('b', 'c2'), ('b', 'c3'), ('c2', 'd'),
+                 ('x', 'y'), ('y', 'z'), ('e', 'd'), ('f', 'e')]
+        gr = nx.DiGraph(edges)
+        self.assertEqual(requested_roots(gr, ['a', 'b', 'c1', 'c2', 'c3']),
+                         ['a'])
+        self.assertEqual(requested_roots(gr, ['c1', 'b', 'y']), ['b', 'y'])
+        # 'd' is a dependency of 'b' through 'c2' but not of 'e'
+        self.assertEqual(requested_roots(gr, ['d', 'e', 'b']), ['e', 'b'])
+        self.assertEqual(requested_roots(gr, ['d', 'f']), ['f'])
+        self.assertEqual(requested_roots(gr, []), [])
+        # circular dependencies link the first requested node to the root
+        gr.add_edges_from([('z', 'x'), ('c3', 'a')])
+        self.assertEqual(requested_roots(gr, ['y', 'x', 'z']), ['y'])
+        self.assertEqual(requested_roots(gr, ['d', 'b', 'a']), ['b'])
+        self.assertEqual(requested_roots(gr, ['d', 'b', 'f']), ['b', 'f'])
+        self.assertRaises(nx.NetworkXError, requested_roots, gr, ['unknown'])
+        
     def test_graph_nodes_using_sample_tree(self): 
         requested = ['P7', 'P8']
         mgr2 = NodeManager(datetime.now(), 10, self.lfl_params, requested, [],
@@ -174,6 +213,75 @@ class TestDependencyGraph(unittest.TestCase):
         self.assertEqual(len(gr), 11)
         self.assertEqual(gr.neighbors('root'), ['P8', 'P7'])
         
+    def test_graph_template(self):
+        template, dependencies = graph_template(self.derived_nodes)
+        self.assertEqual(len(template), 10)
+        self.assertEqual(sorted(template.successors('P7')), ['P4', 'P5', 'P6'])
+        self.assertEqual(dependencies['P7'], ['P4', 'P5', 'P6'])
+        self.assertEqual(template.node['P7']['node_type'],
+                         'DerivedParameterNode')
+        # the template is built once for the derived nodes
+        self.assertTrue(graph_template(dict(self.derived_nodes))[0] is template)
+        # flight graphs overlay the template without modifying it
+        mgr = NodeManager(datetime.now(), 10, self.lfl_params + ['P5'],
+                          ['P7', 'P8'], [], self.derived_nodes, {}, {})
+        gr_all, gr_st, order = process_order(graph_nodes(mgr), mgr)
+        self.assertEqual(gr_all.successors('P5'), [])
+        self.assertEqual(gr_all.node['P5']['node_type'], 'HDFNode')
+        self.assertTrue(gr_all.node['P7']['active'])
+        self.assertEqual(sorted(template.successors('P5')), ['Raw3', 'Raw4'])
+        self.assertEqual(template.node['P7'],
+                         {'color': '#72cdf4',
+                          'node_type': 'DerivedParameterNode'})
+        self.assertFalse('root' in template)
+        self.assertEqual(sorted(gr_st.nodes()), sorted(order + ['root']))
+        # dependencies only required by recorded parameters are not graphed
+        mgr = NodeManager(datetime.now(), 10,
+                          ['Raw1', 'Raw2', 'Raw3', 'Raw5', 'P5'],
+                          ['P7', 'P8'], [], self.derived_nodes, {}, {})
+        self.assertFalse('Raw4' in graph_nodes(mgr))
+        self.assertTrue('Raw4' in template)
+
+    def test_graph_overlay(self):
+        self.derived_nodes['P6'] = MockParam(dependencies=['Raw3'],
+                                             operational=False)
+        template, dependencies = graph_template(self.derived_nodes)
+        mgr = NodeManager(datetime.now(), 10,
+                          ['Raw1', 'Raw2', 'Raw3', 'Raw5', 'P5'],
+                          ['P7', 'P8'], [], self.derived_nodes, {}, {})
+        overlay = GraphOverlay(mgr)
+        self.assertEqual(len(overlay), 10)
+        self.assertEqual(sorted(overlay.successors('P7')), ['P4', 'P5', 'P6'])
+        self.assertEqual(overlay.successors('P5'), [])
+        self.assertEqual(overlay.successors('root'), ['P8', 'P7'])
+        self.assertFalse('Raw4' in overlay)
+        self.assertRaises(nx.NetworkXError, overlay.successors, 'Raw4')
+        self.assertEqual(overlay.node['P5'],
+                         {'color': '#72f4eb', 'node_type': 'HDFNode'})
+        # the overlay has the same nodes and edges as the complete graph
+        gr_all = graph_nodes(mgr)
+        self.assertEqual(sorted(overlay.nodes()), sorted(gr_all.nodes()))
+        for node in gr_all:
+            self.assertEqual(overlay.successors(node), gr_all.successors(node))
+            self.assertEqual(overlay.node[node], gr_all.node[node])
+        # the spanning tree is the same without modifying the template
+        overlay, gr_st, order = process_order(overlay, mgr)
+        gr_all, expected_gr_st, expected_order = process_order(gr_all, mgr)
+        self.assertEqual(order, expected_order)
+        self.assertEqual(sorted(gr_st.nodes(data=True)),
+                         sorted(expected_gr_st.nodes(data=True)))
+        self.assertEqual(sorted(gr_st.edges()), sorted(expected_gr_st.edges()))
+        self.assertFalse(overlay.node['P6']['active'])
+        self.assertFalse('P6' in order)
+        self.assertEqual(sorted(template.successors('P5')), ['Raw3', 'Raw4'])
+        self.assertEqual(template.node['P7'],
+                         {'color': '#72cdf4',
+                          'node_type': 'DerivedParameterNode'})
+        # missing requested nodes are not available
+        mgr = NodeManager(datetime.now(), 10, ['Raw1'], ['Raw2'], [],
+                          self.derived_nodes, {}, {})
+        self.assertRaises(ValueError, GraphOverlay, mgr)
+        
     def test_graph_requesting_all_dependencies_links_root_to_end_leafs(self):
         # build list of all nodes as required
         requested = self.lfl_params + self.derived_nodes.keys()
@@ -365,6 +473,231 @@ Node: Start Datetime 	Pre: [] 	Succ: [] 	Neighbors: [] 	Edges: []
         
 
 
+def recursive_dependencies3(di_graph, root, node_mgr):
+    '''
+    The original recursive implementation of dependencies3 which the
+    iterative implementation must match.
+    '''
+    def traverse_tree(node):
+        if node in path:
+            path.append(node)
+            return False
+        path.append(node)
+        if node in active_nodes:
+            return True
+        layer = []
+        for dependency in di_graph.successors(node):
+            if traverse_tree(dependency):
+                layer.append(dependency)
+            path.pop()
+        if node_mgr.operational(node, layer):
+            active_nodes.add(node)
+            ordering.append(node)
+            return True
+        else:
+            return False
+
+    ordering = []
+    path = collections.deque()
+    active_nodes = set()
+    traverse_tree(root)
+    return ordering
+
+
+class TestDependencies3(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.derived_nodes = get_derived_nodes(settings.NODE_MODULES)
+        dependencies = set()
+        for node in cls.derived_nodes.values():
+            dependencies.update(node.get_dependency_names())
+        # All dependencies which are not derived are recorded parameters.
+        cls.lfl_params = sorted(dependencies - set(cls.derived_nodes))
+        cls.aircraft_info = {
+            'Engine Count': 2,
+            'Engine Series': 'CFM56-3',
+            'Engine Type': 'CFM56-3B1',
+            'Family': 'B737 Classic',
+            'Frame': '737-3C',
+            'Manufacturer': 'Boeing',
+            'Model': 'B737-333',
+            'Precise Positioning': True,
+            'Series': 'B737-300',
+        }
+
+    def _node_mgr(self, seed, available=0.9, requested=300):
+        # Randomly remove recorded parameters and request a subset of the
+        # derived nodes to exercise inoperable and circular dependencies.
+        rand = random.Random(seed)
+        lfl_params = [p for p in self.lfl_params if rand.random() < available]
+        requested = sorted(rand.sample(sorted(self.derived_nodes), requested))
+        return NodeManager(datetime.now(), 1000, lfl_params, requested, [],
+                           self.derived_nodes, self.aircraft_info, {})
+
+    def test_dependencies3_full_node_set(self):
+        mgr = NodeManager(datetime.now(), 1000, self.lfl_params,
+                          sorted(self.derived_nodes), [], self.derived_nodes,
+                          self.aircraft_info, {})
+        gr_all = graph_nodes(mgr)
+        self.assertEqual(dependencies3(gr_all, 'root', mgr),
+                         recursive_dependencies3(gr_all, 'root', mgr))
+
+    def test_dependencies3_partial_node_set(self):
+        for seed in range(11, 16):
+            mgr = self._node_mgr(seed)
+            gr_all = graph_nodes(mgr)
+            self.assertEqual(dependencies3(gr_all, 'root', mgr),
+                             recursive_dependencies3(gr_all, 'root', mgr))
+
+    def test_dependencies3_deep_chain(self):
+        # A chain of dependencies deeper than the recursion limit.
+        derived = {}
+        for n in range(5000):
+            derived['P%d' % n] = MockParam(dependencies=['P%d' % (n + 1)])
+        derived['P5000'] = MockParam(dependencies=['Raw1'])
+        mgr = NodeManager(datetime.now(), 10, ['Raw1'], ['P0'], [],
+                          derived, {}, {})
+        order = dependencies3(graph_nodes(mgr), 'root', mgr)
+        self.assertEqual(order[:2], ['Raw1', 'P5000'])
+        self.assertEqual(order[-2:], ['P0', 'root'])
+        self.assertEqual(len(order), 5003)
+
+    def test_dependencies3_all_requested(self):
+        # Too large to compare with recursive_dependencies3, so check that
+        # each node is processed once and after its dependencies, unless a
+        # circular dependency had to be broken.
+        mgr = self._node_mgr(3, available=0.6, requested=len(self.derived_nodes))
+        gr_all = graph_nodes(mgr)
+        order = dependencies3(gr_all, 'root', mgr)
+        self.assertEqual(order[-1], 'root')
+        self.assertEqual(len(order), len(set(order)))
+        position = dict((name, n) for n, name in enumerate(order))
+        for name in order:
+            for dependency in gr_all.successors(name):
+                if position.get(dependency, -1) > position[name]:
+                    self.assertTrue(nx.has_path(gr_all, dependency, name))
+
+    @benchmark
+    def test_time_taken(self):
+        from timeit import Timer
+        mgr = self._node_mgr(3, available=0.6, requested=len(self.derived_nodes))
+        gr_all = graph_nodes(mgr)
+        timer = Timer(lambda: dependencies3(gr_all, 'root', mgr))
+        time = min(timer.repeat(2, 1))
+        print "Time taken %s secs" % time
+        self.assertLess(time, 1.0, msg="Took too long")
+
+
+class TestParallelismAnalysis(unittest.TestCase):
+    def setUp(self):
+        self.gr_st = nx.DiGraph([('root', 'A'), ('root', 'B'), ('A', 'C'),
+                                 ('B', 'C'), ('B', 'D')])
+        self.costs = {'A': 1, 'B': 3, 'C': 2, 'D': 5}
+
+    def test_critical_path(self):
+        self.assertEqual(critical_path(self.gr_st, self.costs), (8, ['D', 'B']))
+        self.assertEqual(critical_path(self.gr_st, {})[0], 0)
+        self.assertEqual(critical_path(nx.DiGraph(), self.costs), (0, []))
+        # circular dependencies are followed in the order processed
+        self.gr_st.add_edge('C', 'A')
+        self.assertEqual(
+            critical_path(self.gr_st, self.costs, ['C', 'D', 'A', 'B']),
+            (8, ['D', 'B']))
+        self.costs['A'] = 10
+        self.assertEqual(
+            critical_path(self.gr_st, self.costs, ['C', 'D', 'A', 'B']),
+            (12, ['C', 'A']))
+
+    def test_parallelism_analysis(self):
+        analysis = parallelism_analysis(self.gr_st, self.costs,
+                                        workers=(1, 2, 4))
+        self.assertEqual(analysis['nodes'], 4)
+        self.assertEqual(analysis['total_cost'], 11)
+        self.assertEqual(analysis['critical_path_length'], 8)
+        self.assertEqual(analysis['critical_path'], ['D', 'B'])
+        self.assertEqual(analysis['speedup'], [
+            {'workers': 1, 'speedup': 1.0},
+            {'workers': 2, 'speedup': 1.375},
+            {'workers': 4, 'speedup': 1.375}])
+        self.assertEqual(analysis['max_speedup'], 1.375)
+        self.assertEqual(analysis['widest_levels'], [
+            {'level': 0, 'width': 2, 'cost': 7, 'nodes': ['C', 'D']},
+            {'level': 1, 'width': 2, 'cost': 4, 'nodes': ['A', 'B']}])
+        # removing either cost leaves A after C as the longest path
+        self.assertEqual(analysis['critical_nodes'], [
+            {'node': 'D', 'cost': 5, 'saving': 3},
+            {'node': 'B', 'cost': 3, 'saving': 3}])
+
+    def test_parallelism_report(self):
+        analysis = parallelism_analysis(self.gr_st, self.costs)
+        self.assertEqual(json.loads(parallelism_report(analysis, 'json')),
+                         json.loads(json.dumps(analysis)))
+        report = parallelism_report(analysis)
+        self.assertIn('Critical path length: 8.000', report)
+        self.assertIn('     2: 1.38x', report)
+        self.assertIn('  D: saving 3.000 of cost 5.000', report)
+        self.assertRaises(ValueError, parallelism_report, analysis, 'xml')
+
+
+class TestDependencyTreeStorage(unittest.TestCase):
+    def setUp(self):
+        derived_nodes = {
+            'P4' : MockParam(dependencies=['Raw1', 'Raw2']), 
+            'P5' : MockParam(dependencies=['Raw3', 'Raw4']),
+            'P6' : MockParam(dependencies=['Raw3']),
+            'P7' : MockParam(dependencies=['P4', 'P5', 'P6']),
+            'P8' : MockParam(dependencies=['Raw5', 'Raw6']),
+        }
+        mgr = NodeManager(datetime.now(), 10,
+                          ['Raw1', 'Raw2', 'Raw3', 'Raw4', 'Raw5'],
+                          ['P7', 'P8'], [], derived_nodes, {}, {})
+        self.gr_st = process_order(graph_nodes(mgr), mgr)[1]
+        self.store_path = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.store_path)
+
+    def assertGraphEqual(self, graph, expected):
+        self.assertEqual(dict(graph.nodes(data=True)),
+                         dict(expected.nodes(data=True)))
+        self.assertEqual(sorted(graph.edges()), sorted(expected.edges()))
+
+    def test_dumps_dependency_tree(self):
+        dependency_tree = dumps_dependency_tree(self.gr_st)
+        self.assertTrue(dependency_tree.startswith('dtg1:'))
+        self.assertLess(len(dependency_tree),
+                        len(json.dumps(json_graph.node_link_data(self.gr_st))))
+        gr_st = loads_dependency_tree(dependency_tree)
+        self.assertGraphEqual(gr_st, self.gr_st)
+        self.assertEqual(gr_st.node['P7'], {
+            'color': '#72cdf4', 'node_type': 'DerivedParameterNode',
+            'label': self.gr_st.node['P7']['label'], 'active': True})
+        self.assertGraphEqual(loads_dependency_tree(
+            dumps_dependency_tree(nx.DiGraph())), nx.DiGraph())
+
+    def test_loads_dependency_tree_json(self):
+        # node-link JSON stored by previous versions.
+        self.assertGraphEqual(loads_dependency_tree(
+            json.dumps(json_graph.node_link_data(self.gr_st))), self.gr_st)
+
+    def test_store_dependency_tree(self):
+        dependency_tree = dumps_dependency_tree(self.gr_st)
+        reference = store_dependency_tree(dependency_tree, self.store_path)
+        self.assertTrue(reference.startswith('dtg1-sha1:'))
+        self.assertEqual(len(reference), 50)
+        self.assertEqual(os.listdir(self.store_path),
+                         [reference[10:] + '.dtg'])
+        # identical trees are stored once
+        self.assertEqual(store_dependency_tree(dependency_tree,
+                                               self.store_path), reference)
+        self.assertEqual(len(os.listdir(self.store_path)), 1)
+        self.assertGraphEqual(
+            loads_dependency_tree(reference, self.store_path), self.gr_st)
+        self.assertRaises(ValueError, loads_dependency_tree, reference)
+        self.assertRaises(ValueError, store_dependency_tree, '{}',
+                          self.store_path)
+
+
 class TestGraphAdjacencies(unittest.TestCase):
     def test_graph_adjacencies(self):
         g = nx.DiGraph()
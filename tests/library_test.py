@@ -22,6 +22,10 @@ from flight_phase_test import buildsections
 test_data_path = os.path.join(os.path.dirname(os.path.abspath(__file__)),
                               'test_data')
 
+# Timings depend on the machine so are only checked when BENCHMARK is set.
+BENCHMARK = os.environ.get('BENCHMARK')
+benchmark = unittest.skipUnless(BENCHMARK, 'Set BENCHMARK to run timing tests.')
+
 
 class TestAllOf(unittest.TestCase):
     def test_all_of(self):
@@ -713,6 +717,90 @@ class TestAlign(unittest.TestCase):
         np.testing.assert_array_equal(result.mask, [0,0,0,0,0,0,0,0,1,1])
 
 
+class TestAlignmentPlan(unittest.TestCase):
+    def test_alignment_plan_cached(self):
+        plan = alignment_plan(1, 0.5, 4, 0.1)
+        self.assertIs(alignment_plan(1, 0.5, 4, 0.1), plan)
+        self.assertIsNot(alignment_plan(1, 0.5, 4, 0.1, interpolate=False),
+                         plan)
+        self.assertEqual(plan.method, 'interpolate')
+        self.assertEqual(plan.ratio, 4.0)
+        self.assertEqual(plan.master_samples, 4)
+        self.assertEqual(plan.slave_samples, 1)
+        np.testing.assert_array_equal(plan.lower, [-1, -1, 0, 0])
+        np.testing.assert_array_almost_equal(plan.upper_weight,
+                                             [0.6, 0.85, 0.1, 0.35])
+        np.testing.assert_array_almost_equal(plan.lower_weight,
+                                             [0.4, 0.15, 0.9, 0.65])
+
+    def test_alignment_plan_methods(self):
+        self.assertEqual(alignment_plan(2, 0.1, 2, 0.1).method, 'same')
+        self.assertEqual(alignment_plan(1, 0.0, 4, 0.0).method, 'upsample')
+        self.assertEqual(alignment_plan(4, 0.0, 1, 0.0).method, 'downsample')
+        self.assertEqual(alignment_plan(4, 0.0, 1, 0.0).slave_samples, 4)
+        self.assertEqual(alignment_plan(5, 0.0, 10, 0.0).method,
+                         'interpolate')
+
+    def test_alignment_plan_invalid(self):
+        self.assertRaises(ValueError, alignment_plan, 1, 0.0, 10, 0.1)
+        self.assertRaises(AssertionError, alignment_plan, 3, 0.0, 1, 0.0)
+
+
+class TestAlignMany(unittest.TestCase):
+    def test_align_many(self):
+        master = P('master', np.ma.arange(16.0), frequency=4, offset=0.1)
+        slaves = [
+            P('slave 1', np.ma.arange(4.0), frequency=1, offset=0.5),
+            None,
+            P('slave 2', np.ma.arange(8.0) * 2, frequency=2, offset=0.2),
+            P('slave 3', np.ma.arange(16.0), frequency=4, offset=0.1),
+            P('slave 4', np.ma.array([1.0, 2, 3, 4], mask=[0, 1, 0, 0]),
+              frequency=1, offset=0.5),
+        ]
+        result = align_many(slaves, master)
+        self.assertEqual(result.shape, (4, 16))
+        for row, slave in zip(result, [s for s in slaves if s]):
+            ma_test.assert_array_equal(row, align(slave, master))
+
+    def test_align_many_multistate(self):
+        master = P('master', np.ma.arange(4.0), frequency=2, offset=0.0)
+        slave = M('slave', MappedArray([0, 1], values_mapping={0: 'Off',
+                                                               1: 'On'}),
+                  frequency=1, offset=0.6)
+        result = align_many([slave, slave], master)
+        self.assertEqual(result.dtype, int)
+        ma_test.assert_array_equal(result[0], align(slave, master))
+
+    def test_align_many_invalid(self):
+        master = P('master', np.ma.arange(8.0), frequency=2, offset=0.0)
+        self.assertRaises(ValueError, align_many, [None], master)
+        self.assertRaises(ValueError, align_many, [
+            P('slave 1', np.ma.arange(4.0), frequency=1, offset=0.5),
+            P('slave 2', np.ma.arange(6.0), frequency=1, offset=0.5)],
+            master)
+
+    def test_align_many_large_data(self):
+        master = P('master', np.ma.arange(4 * 3600 * 10.0), frequency=4,
+                   offset=0.1)
+        slaves = [P('Eng (%d) N1' % n, np.ma.arange(3600 * 10.0), frequency=1,
+                    offset=0.2 * n) for n in range(1, 5)]
+        result = align_many(slaves, master)
+        for slave, aligned in zip(slaves, result):
+            ma_test.assert_array_equal(aligned, align(slave, master))
+
+    @benchmark
+    def test_time_taken(self):
+        from timeit import Timer
+        master = P('master', np.ma.arange(4 * 3600 * 10.0), frequency=4,
+                   offset=0.1)
+        slaves = [P('Eng (%d) N1' % n, np.ma.arange(3600 * 10.0), frequency=1,
+                    offset=0.2 * n) for n in range(1, 5)]
+        timer = Timer(lambda: align_many(slaves, master))
+        time = min(timer.repeat(3, 1))
+        print 'Time taken %s secs' % time
+        self.assertLess(time, 0.5, msg='Took too long')
+
+
 class TestCasAlt2Mach(unittest.TestCase):
     @unittest.skip('Not Implemented')
     def test_cas_alt2mach(self):
@@ -1286,6 +1374,82 @@ class TestClip(unittest.TestCase):
         expected = np.ma.array(data=[0]*16,mask=[1]*16)
         ma_test.assert_masked_array_approx_equal(result, expected)
 
+    def test_clip_overlap_exact(self):
+        # Overlapping peaks and troughs are averaged exactly as
+        # np.ma.average sums each window.
+        an_array = np.ma.array([8.9, -1.9, -11.8, 8.8, -8.0, -4.1, 5.9, -7.5])
+        result = clip(an_array, 5)
+        self.assertEqual(result.compressed().tolist(),
+                         [-10.260000000000002, -6.412000000000001])
+
+    def test_clip_masked_window(self):
+        # Windows without any valid samples are masked.
+        an_array = np.ma.array([1,2,3,4,5,6,7,8,9,10,11,12,13,14,15,16],
+                               mask=[0,0,0,0,1,1,1,1,1,1,1,1,0,0,0,0],
+                               dtype=float)
+        result = clip(an_array, 3, remove='peaks')
+        expected = np.ma.array(data=[0,0,3,4,0,0,0,0,0,0,0,0,13,14,0,0],
+                               mask=[1,1,0,0,1,1,1,1,1,1,1,1,0,0,1,1])
+        ma_test.assert_masked_array_approx_equal(result, expected)
+
+    def test_clip_large_data(self):
+        # 20 minute clip of four hours of 1Hz data, checked against values
+        # from the previous implementation.
+        array = np.ma.array(np.sin(np.arange(4 * 3600) / 300.0) * 100.0 +
+                            np.random.RandomState(1).randn(4 * 3600))
+        result = clip(array, 1200)
+        self.assertEqual(np.ma.count(result), 13198)
+        self.assertAlmostEqual(result.sum(), 16778.023883415026, places=6)
+        self.assertAlmostEqual(result.min(), -43.073602254372126)
+        self.assertAlmostEqual(result.max(), 91.28568077369734)
+
+    @benchmark
+    def test_time_taken(self):
+        from timeit import Timer
+        # 20 minute clip of four hours of 1Hz data.
+        array = np.ma.array(np.sin(np.arange(4 * 3600) / 300.0) * 100.0 +
+                            np.random.RandomState(1).randn(4 * 3600))
+        timer = Timer(lambda: clip(array, 1200))
+        time_taken = min(timer.repeat(3, 1))
+        print 'Time taken %s secs' % time_taken
+        self.assertLess(time_taken, 0.5, msg='Took too long')
+
+
+class TestMultistateMatch(unittest.TestCase):
+    def setUp(self):
+        self.array = MappedArray(
+            np.ma.array([1, 2, 3, 2, 2, 1, 1], mask=[0, 0, 0, 0, 0, 0, 1]),
+            values_mapping={1: 'one', 2: 'two', 3: 'three'})
+
+    def test_single_state(self):
+        result = multistate_match(self.array, 'two')
+        ma_test.assert_masked_array_equal(result, self.array == 'two')
+        self.assertEqual(result.dtype, bool)
+        result = multistate_match(self.array, 'two', condition=False)
+        ma_test.assert_masked_array_equal(result, self.array != 'two')
+
+    def test_multiple_states(self):
+        result = multistate_match(self.array, ['one', 'three'])
+        ma_test.assert_masked_array_equal(
+            result, self.array.any_of('one', 'three'))
+        result = multistate_match(self.array, ['one', 'three'],
+                                  condition=False)
+        ma_test.assert_masked_array_equal(
+            result, np.ma.array([0, 1, 0, 1, 1, 0, 0],
+                                mask=[0, 0, 0, 0, 0, 0, 1], dtype=bool))
+
+    def test_state_lookup(self):
+        result = multistate_match(self.array, 'two', state_lookup={'two': 1})
+        ma_test.assert_masked_array_equal(result, self.array == 'one')
+
+    def test_unknown_state(self):
+        self.assertRaises(KeyError, multistate_match, self.array, 'four')
+
+    def test_mask_not_shared(self):
+        result = multistate_match(self.array, 'two')
+        result.mask[0] = True
+        self.assertFalse(self.array.mask[0])
+
 
 class TestClumpMultistate(unittest.TestCase):
     # Reminder: clump_multistate(array, state, _slices, condition=True)
@@ -1436,6 +1600,15 @@ class TestCycleCounter(unittest.TestCase):
         self.assertEqual(index, None)
         self.assertEqual(count, None)
 
+    def test_cycle_counter_carries_shorter_runs(self):
+        # The run of three half cycles is fewer than the first run of six so
+        # is added to the following run of five.
+        array = np.ma.array([0, 5, 0, 5, 0, 5, 0, 0, 0, 0, 0, 0, 5, 0, 5,
+                             0, 0, 0, 0, 0, 0, 0, 5, 0, 5, 0, 5, 0, 0.0])
+        index, count = cycle_counter(array, 3.0, 3, 1.0, 0)
+        self.assertEqual(index, 28)
+        self.assertEqual(count, 4)
+
 
 class TestCycleSelect(unittest.TestCase):
 
@@ -1481,6 +1654,12 @@ class TestCycleSelect(unittest.TestCase):
         self.assertEqual(index, 2)
         self.assertEqual(value, 4.0)
 
+    def test_cycle_select_latest_of_equal_cycles(self):
+        array = np.ma.array([0, 4, 0, 0, 0, 4, 0, 0, 0, 4, 0.0])
+        index, value = cycle_select(array, 3.0, 10, 1.0, 0)
+        self.assertEqual(index, 9)
+        self.assertEqual(value, 4.0)
+
 
 class TestCycleFinder(unittest.TestCase):
 
@@ -1519,6 +1698,43 @@ class TestCycleFinder(unittest.TestCase):
         np.testing.assert_array_equal(idxs, [0, 5, 7, 14])
         np.testing.assert_array_equal(vals, [0, 3, 1, 6])
 
+    def test_cycle_finder_removes_first_of_equal_steps(self):
+        array = np.ma.array([0, 3, 2, 3, 2, 5, 4, 5, 0.0])
+        idxs, vals = cycle_finder(array, min_step=1.5)
+        np.testing.assert_array_equal(idxs, [0, 7, 8])
+        np.testing.assert_array_equal(vals, [0, 5, 0])
+
+    def test_cycle_finder_large_data(self):
+        # Two hours of a noisy control column recorded at 16Hz, checked
+        # against values from the previous implementation.
+        np.random.seed(0)
+        samples = 2 * 3600 * 16
+        array = np.ma.array(np.cumsum(np.random.randn(samples)) * 0.2 +
+                            np.random.randn(samples) * 0.5)
+        idxs, vals = cycle_finder(array, min_step=2.0)
+        self.assertEqual(len(idxs), 5146)
+        np.testing.assert_array_equal(idxs[:5], [0, 29, 76, 137, 143])
+        self.assertAlmostEqual(np.sum(vals), -84277.05995426406, places=6)
+        self.assertEqual(cycle_counter(array, 2.0, 10, 16.0), (115198, 1911.5))
+        index, value = cycle_select(array, 2.0, 10, 16.0)
+        self.assertEqual(index, 23604)
+        self.assertAlmostEqual(value, 6.276212992435838)
+
+    @benchmark
+    def test_time_taken(self):
+        # Two hours of a noisy control column recorded at 16Hz.
+        np.random.seed(0)
+        samples = 2 * 3600 * 16
+        array = np.ma.array(np.cumsum(np.random.randn(samples)) * 0.2 +
+                            np.random.randn(samples) * 0.5)
+        from timeit import Timer
+        timer = Timer(lambda: (cycle_finder(array, min_step=2.0),
+                               cycle_counter(array, 2.0, 10, 16.0),
+                               cycle_select(array, 2.0, 10, 16.0)))
+        time = min(timer.repeat(3, 1))
+        print "Time taken %s secs" % time
+        self.assertLess(time, 1.0, msg="Took too long")
+
 
 class TestCycleMatch(unittest.TestCase):
     def test_find_a_match(self):
@@ -1796,6 +2012,45 @@ class TestFirstOrderLag(unittest.TestCase):
         ma_test.assert_mask_eqivalent(result.mask, [0,0,0,1,0],
                                       err_msg='Masks are not equal')
 
+    def test_firstorderlag_restarts_after_mask(self):
+        array = np.ma.array([2.0, 2.0, 0.0, 4.0, 4.0], mask=[0, 0, 1, 0, 0])
+        result = first_order_lag(array, 2.0, 1.0)
+        # Each unmasked block restarts from the first value of the data.
+        ma_test.assert_masked_array_approx_equal(
+            result, np.ma.array([2.0, 2.0, 0.0, 2.4, 3.04],
+                                mask=[0, 0, 1, 0, 0]))
+
+    def test_firstorderlag_2d(self):
+        array = np.ma.array(np.random.RandomState(0).randn(3, 100))
+        array[0, 10:20] = np.ma.masked
+        array[2, ::7] = np.ma.masked
+        result = first_order_lag(array, 2.0, 1.0)
+        self.assertEqual(result.shape, (3, 100))
+        for row, expected in zip(array, result):
+            ma_test.assert_masked_array_approx_equal(
+                first_order_lag(row, 2.0, 1.0), expected)
+
+    def test_firstorderlag_large_data(self):
+        # Checked against values from the previous implementation.
+        array = np.ma.arange(16 * 3600 * 5.0)
+        array[::50] = np.ma.masked
+        result = first_order_lag(array, 5.0, 16.0)
+        self.assertEqual(np.ma.count(result), 282240)
+        self.assertAlmostEqual(result.sum(), 10250892633.010279, places=3)
+        ma_test.assert_masked_array_approx_equal(
+            result[-3:], [126938.75759050259, 128939.48730987521,
+                          130915.37566627428])
+
+    @benchmark
+    def test_time_taken(self):
+        from timeit import Timer
+        array = np.ma.arange(16 * 3600 * 5.0)
+        array[::50] = np.ma.masked
+        timer = Timer(lambda: first_order_lag(array, 5.0, 16.0))
+        time = min(timer.repeat(3, 1))
+        print 'Time taken %s secs' % time
+        self.assertLess(time, 0.5, msg='Took too long')
+
 
 class TestFirstOrderWashout(unittest.TestCase):
 
@@ -1856,6 +2111,15 @@ class TestFirstOrderWashout(unittest.TestCase):
         ma_test.assert_mask_eqivalent(result.mask, [0,0,0,1,0],
                                       err_msg='Masks are not equal')
 
+    def test_firstorderwashout_2d(self):
+        array = np.ma.array(np.random.RandomState(0).randn(2, 50))
+        array[1, 5:8] = np.ma.masked
+        result = first_order_washout(array, 2.0, 1.0, initial_value=0.0)
+        for row, expected in zip(array, result):
+            ma_test.assert_masked_array_approx_equal(
+                first_order_washout(row, 2.0, 1.0, initial_value=0.0),
+                expected)
+
 
 class TestFirstValidSample(unittest.TestCase):
     def test_first_valid_sample(self):
@@ -2096,10 +2360,46 @@ class TestHysteresis(unittest.TestCase):
         np.testing.assert_array_equal(result.filled(999),
                                       [999,1,1,1,999,0,5,6,6,0.5])
 
-    """
-    Hysteresis may need to be speeded up, in which case this test can be
-    reinstated.
+    def test_hysteresis_matches_loop(self):
+        # Compare with applying hysteresis one sample at a time, forwards
+        # and then backwards.
+        def apply_hysteresis(values, quarter_range):
+            old = values[0]
+            result = []
+            for new in values:
+                if new - old > quarter_range:
+                    old = new - quarter_range
+                elif new - old < -quarter_range:
+                    old = new + quarter_range
+                result.append(old)
+            return result
 
+        data = np.ma.array(np.cumsum(np.random.RandomState(0).randn(1000)))
+        data[[0, 10, 11, 500, 999]] = np.ma.masked
+        half_done = apply_hysteresis(np.ma.compressed(data), 2.5)
+        expected = np.ma.copy(data)
+        expected[~data.mask] = apply_hysteresis(half_done[::-1], 2.5)[::-1]
+        ma_test.assert_masked_array_equal(hysteresis(data, 10), expected)
+
+    def test_hysteresis_large_data(self):
+        result = self.using_large_data()
+        self.assertEqual(np.ma.count(result), 98999)
+        ma_test.assert_masked_array_approx_equal(
+            result[:4], np.ma.array([0, 3.5, 3.5, 3.5], mask=[1, 0, 0, 0]))
+        ma_test.assert_masked_array_approx_equal(
+            result[98997:99001],
+            np.ma.array([98996.5] * 3 + [0], mask=[0, 0, 0, 1]))
+
+    def test_hysteresis_16hz_10_hours(self):
+        # Checked against values from the previous implementation.
+        data = np.ma.array(np.cumsum(
+            np.random.RandomState(0).randn(16 * 3600 * 10)))
+        data[::100] = np.ma.masked
+        result = hysteresis(data, 10)
+        self.assertEqual(np.ma.count(result), 570240)
+        self.assertAlmostEqual(result.sum(), 392576500.9394972, places=3)
+
+    @benchmark
     def test_time_taken(self):
         from timeit import Timer
         timer = Timer(self.using_large_data)
@@ -2111,9 +2411,18 @@ class TestHysteresis(unittest.TestCase):
         data = np.ma.arange(100000)
         data[0] = np.ma.masked
         data[-1000:] = np.ma.masked
-        res = hysteresis(data, 10)
-        pass
-    """
+        return hysteresis(data, 10)
+
+    @benchmark
+    def test_time_taken_16hz_10_hours(self):
+        from timeit import Timer
+        data = np.ma.array(np.cumsum(
+            np.random.RandomState(0).randn(16 * 3600 * 10)))
+        data[::100] = np.ma.masked
+        timer = Timer(lambda: hysteresis(data, 10))
+        time = min(timer.repeat(3, 1))
+        print "Time taken %s secs" % time
+        self.assertLess(time, 1.0, msg="Took too long")
 
 
 class TestIndexAtValue(unittest.TestCase):
@@ -2238,6 +2547,82 @@ class TestIndexAtValue(unittest.TestCase):
         self.assertEqual(index_at_value(array,2.5, slice(0,3), endpoint='closing'), None)
 
 
+class TestIndexAtValues(unittest.TestCase):
+    def _compare(self, array, thresholds, _slice, endpoint='exact'):
+        self.assertEqual(
+            index_at_values(array, thresholds, _slice, endpoint),
+            [index_at_value(array, threshold, _slice, endpoint)
+             for threshold in thresholds])
+
+    def test_index_at_values_basic(self):
+        array = np.ma.arange(4)
+        self.assertEqual(index_at_values(array, [1.5, 2, 5], slice(0, 3)),
+                         [1.5, 2.0, None])
+
+    def test_index_at_values_backwards(self):
+        array = np.ma.array([0, 1, 2, 3, 2, 1, 2, 1])
+        self.assertEqual(index_at_values(array, [1.5, 2.5, 3.5],
+                                         slice(7, 0, -1)),
+                         [6.5, 3.5, None])
+
+    def test_index_at_values_masked(self):
+        array = np.ma.arange(10.0)
+        array[3:6] = np.ma.masked
+        # The crossing of 4 is masked, so 8.5 is found in the second run
+        # rather than the first.
+        self.assertEqual(index_at_values(array, [1.5, 4, 8.5], slice(0, 10)),
+                         [1.5, None, 8.5])
+
+    def test_index_at_values_endpoints(self):
+        array = np.ma.array([0, 1, 2, 1, 2, 3, 2, 1])
+        for endpoint in ('exact', 'closing', 'nearest'):
+            self._compare(array, [0.5, 2.5, 3.1], slice(1, 8), endpoint)
+            self._compare(array, [0.5, 2.5, 3.1], slice(7, 0, -1), endpoint)
+
+    def test_index_at_values_random(self):
+        random = np.random.RandomState(0)
+        for n in range(100):
+            array = np.ma.array(np.cumsum(random.randn(50)) * 10)
+            array[random.rand(50) < 0.2] = np.ma.masked
+            thresholds = list(random.uniform(-50, 50, 10))
+            self._compare(array, thresholds, slice(5, 45))
+            self._compare(array, thresholds, slice(45, 5, -1))
+            self._compare(array, thresholds, slice(None, None, -1))
+
+    def test_index_at_values_no_range(self):
+        array = np.ma.arange(10)
+        self.assertEqual(index_at_values(array, [1, 2], slice(5, 5)),
+                         [None, None])
+        self.assertEqual(index_at_values(array, [1, 2], slice(5, 6)),
+                         [None, None])
+        self.assertEqual(index_at_values(array, [], slice(None)), [])
+
+    def test_index_at_values_negative_start(self):
+        array = np.ma.array(np.cumsum(np.random.RandomState(1).randn(30)))
+        thresholds = np.linspace(array.min(), array.max(), 20)
+        for _slice in (slice(-1, 4, -1), slice(-5, None, -1),
+                       slice(-10, 25)):
+            for endpoint in ('exact', 'closing', 'nearest'):
+                self._compare(array, thresholds, _slice, endpoint)
+
+    def test_index_at_values_large_data(self):
+        array = np.ma.concatenate([np.linspace(0, 40000, 16 * 3600),
+                                   np.linspace(40000, 0, 16 * 3600)])
+        self._compare(array, range(100, 40000, 100), slice(None, None, -1))
+
+    @benchmark
+    def test_time_taken(self):
+        from timeit import Timer
+        array = np.ma.concatenate([np.linspace(0, 40000, 16 * 3600),
+                                   np.linspace(40000, 0, 16 * 3600)])
+        thresholds = range(100, 40000, 100)
+        timer = Timer(lambda: index_at_values(array, thresholds,
+                                              slice(None, None, -1)))
+        time = min(timer.repeat(3, 1))
+        print 'Time taken %s secs' % time
+        self.assertLess(time, 0.5, msg='Took too long')
+
+
 class TestIndexClosestValue(unittest.TestCase):
     def test_index_closest_value(self):
         array = np.ma.array([1, 2, 3, 4, 5, 4, 3])
@@ -2943,6 +3328,65 @@ class TestBlendParameters(unittest.TestCase):
         expected = []
         ma_test.assert_almost_equal(result[30], 14.225, decimal=2)
         ma_test.assert_almost_equal(result[80], 1208.451, decimal=2)
+
+    def test_blend_params_linear(self):
+        result = blend_parameters(self.params, offset=0.0, frequency=2.0,
+                                  method='linear')
+        ma_test.assert_almost_equal(result[30], 19.45, decimal=2)
+        ma_test.assert_almost_equal(result[80], 1208.425, decimal=2)
+        self.assertEqual(np.ma.count_masked(result), 2)
+
+    def test_blend_params_hermite(self):
+        result = blend_parameters(self.params, offset=0.0, frequency=2.0,
+                                  method='hermite')
+        ma_test.assert_almost_equal(result[30], 15.665, decimal=2)
+        ma_test.assert_almost_equal(result[80], 1208.672, decimal=2)
+        self.assertEqual(np.ma.count_masked(result), 2)
+
+    def test_blend_params_method_error(self):
+        self.assertRaises(ValueError, blend_parameters, self.params,
+                          method='quadratic')
+
+    def _large_params(self):
+        # Three hours of three radio altimeters with a few masked samples.
+        np.random.seed(0)
+        params = []
+        for name, frequency, offset in (('A', 0.5, 0.1), ('B', 0.25, 1.1),
+                                        ('C', 0.25, 3.1)):
+            samples = int(3 * 3600 * frequency)
+            array = np.ma.array(np.cumsum(np.random.randn(samples)) * 10)
+            array[np.random.rand(samples) < 0.02] = np.ma.masked
+            params.append(P('Altitude Radio (%s)' % name, array=array,
+                            frequency=frequency, offset=offset))
+        return params
+
+    def test_blend_params_large_data(self):
+        # The spline values were checked against the previous implementation.
+        params = self._large_params()
+        for method, expected in (
+            ('spline', [63.12383372574587, -74.3907974224882]),
+            ('linear', [62.8513583289344, -74.29893059302815]),
+            ('hermite', [63.18008846010284, -74.55006406769728])):
+            result = blend_parameters(params, offset=0.0, frequency=2.0,
+                                      method=method)
+            self.assertEqual(len(result), 21600)
+            self.assertEqual(np.ma.count(result), 21558)
+            ma_test.assert_almost_equal(result[[100, 10000]], expected)
+        self.assertAlmostEqual(
+            blend_parameters(params, offset=0.0, frequency=2.0).sum(),
+            -3282924.936846104, places=3)
+
+    @benchmark
+    def test_time_taken(self):
+        params = self._large_params()
+        from timeit import Timer
+        for method in ('spline', 'linear', 'hermite'):
+            timer = Timer(lambda: blend_parameters(params, offset=0.0,
+                                                   frequency=2.0,
+                                                   method=method))
+            time = min(timer.repeat(3, 1))
+            print "Time taken %s secs" % time
+            self.assertLess(time, 0.5, msg="Took too long")
         
         
     def test_blend_two_parameters_p2_before_p1_equal_spacing(self):
@@ -3778,6 +4222,50 @@ class TestRepairMask(unittest.TestCase):
         expected = np.ma.array([0,0,6,7,0,0,0],mask=[0,0,0,0,0,0,0])
         ma_test.assert_array_equal(res, expected)
 
+    def test_raise_duration_exceedance(self):
+        array = np.ma.array([0,1,2,3,4,5,6,7,8,9,10,11,12,13,14,15],
+                            mask=[0,1,0,0,1,1,1,1,0,0,1,0,0,0,0,0],
+                            dtype=float)
+        self.assertRaises(ValueError, repair_mask, array, repair_duration=3,
+                          raise_duration_exceedance=True)
+        # Sections before the one which is too long have been repaired.
+        ma_test.assert_masked_array_equal(array, np.ma.array(
+            [0,1,2,3,4,5,6,7,8,9,10,11,12,13,14,15],
+            mask=[0,0,0,0,1,1,1,1,0,0,1,0,0,0,0,0], dtype=float))
+
+    def test_repair_many_sections(self):
+        array = np.ma.array([10,20,0,40,0,0,70,0,0,20,0,0,0,0,0,80],
+                            mask=[0,0,1,0,1,1,0,0,1,0,1,1,1,1,1,0],
+                            dtype=float)
+        res = repair_mask(array, repair_duration=3, repair_above=5)
+        # The section after 0 is not repaired as it is not above 5 and the
+        # last section is too long.
+        ma_test.assert_masked_array_approx_equal(res, np.ma.array(
+            [10,20,30,40,50,60,70,0,0,20,0,0,0,0,0,80],
+            mask=[0,0,0,0,0,0,0,0,1,0,1,1,1,1,1,0]))
+
+    def test_repair_large_data(self):
+        # Four hours of 16Hz data with one sample in twenty masked.
+        array = np.ma.array(np.random.RandomState(0).randn(16 * 3600 * 4))
+        array[np.random.RandomState(1).rand(len(array)) < 0.05] = np.ma.masked
+        res = repair_mask(array, copy=True)
+        self.assertFalse(np.ma.is_masked(res))
+        valid = np.flatnonzero(~array.mask)
+        np.testing.assert_array_almost_equal(
+            res.data, np.interp(np.arange(len(array)), valid,
+                                array.data[valid]))
+
+    @benchmark
+    def test_time_taken(self):
+        from timeit import Timer
+        # Four hours of 16Hz data with one sample in twenty masked.
+        array = np.ma.array(np.random.RandomState(0).randn(16 * 3600 * 4))
+        array[np.random.RandomState(1).rand(len(array)) < 0.05] = np.ma.masked
+        timer = Timer(lambda: repair_mask(array, copy=True))
+        time_taken = min(timer.repeat(3, 1))
+        print 'Time taken %s secs' % time_taken
+        self.assertLess(time_taken, 0.1, msg='Took too long')
+
 
 class TestResample(unittest.TestCase):
     def test_resample_upsample(self):
@@ -4823,6 +5311,41 @@ class TestStepValues(unittest.TestCase):
         exc_edges = find_edges(res)
         self.assertEqual(exc_edges,
             [369.5, 407.5, 421.5, 5732.5, 5839.5, 5938.5, 5945.5, 5995.5, 6024.5])
+
+    def _hovering_flap(self):
+        # Three hours of flap at 8Hz hovering between settings, so that it
+        # changes step every few seconds.
+        np.random.seed(0)
+        return np.ma.array(np.repeat(
+            np.random.choice([0.0, 1.0, 5.0, 15.0], 8 * 3600 * 3 / 40), 40) +
+            np.random.randn(8 * 3600 * 3) * 0.1)
+
+    def test_step_values_large_data(self):
+        # Checked against values from the previous implementation.
+        array = self._hovering_flap()
+        for step_at, edges, total in (
+            ('move_start', [39, 79, 119, 159], 453001.0),
+            ('move_stop', [41, 82, 120, 160], 452900.0),
+            ('including_transition', [39, 82, 120, 159], 464194.0),
+            ('excluding_transition', [41, 79, 119, 160], 441707.0)):
+            res = step_values(array, (0, 1, 5, 15), 8.0, step_at)
+            self.assertEqual(np.ma.count(res), len(array))
+            changes = np.flatnonzero(np.diff(res.data))
+            self.assertEqual(len(changes), 1644)
+            self.assertEqual(changes[:4].tolist(), edges)
+            self.assertEqual(res.sum(), total)
+
+    @benchmark
+    def test_time_taken(self):
+        array = self._hovering_flap()
+        from timeit import Timer
+        for step_at in ('move_start', 'move_stop', 'including_transition',
+                        'excluding_transition'):
+            timer = Timer(lambda: step_values(array, (0, 1, 5, 15), 8.0,
+                                              step_at))
+            time = min(timer.repeat(3, 1))
+            print "Time taken %s secs" % time
+            self.assertLess(time, 0.5, msg="Took too long")
                          
 class TestCompressIterRepr(unittest.TestCase):
     def test_compress_iter_repr(self):
@@ -5212,6 +5735,79 @@ class TestValueAtIndex(unittest.TestCase):
             self.assertEquals(value_at_index(array, x, interpolate=False), expected)
 
 
+class TestValuesAtIndices(unittest.TestCase):
+    def test_values_at_indices_basic(self):
+        array = np.ma.arange(4)
+        ma_test.assert_array_equal(
+            values_at_indices(array, [1.5, 3.7, -0.5, 2]), [1.5, 3, 0, 2])
+
+    def test_values_at_indices_masked(self):
+        array = np.ma.arange(6.0)
+        array[2] = np.ma.masked
+        array[4:] = np.ma.masked
+        result = values_at_indices(array, [2, 1.5, 2.5, 4.5, 3.5, 9, None])
+        ma_test.assert_masked_array_approx_equal(
+            result, np.ma.array([0, 1, 3, 0, 3, 0, 0],
+                                mask=[1, 0, 0, 1, 0, 1, 1]))
+
+    def test_values_at_indices_non_interpolated(self):
+        array = np.ma.arange(4)
+        array[2] = np.ma.masked
+        result = values_at_indices(array, [1.25, 1.5, 2.0, 2.25, 3.0],
+                                   interpolate=False)
+        ma_test.assert_masked_array_approx_equal(
+            result, np.ma.array([1, 1, 0, 3, 3], mask=[0, 0, 1, 0, 0]))
+
+    def test_values_at_indices_matches_value_at_index(self):
+        random = np.random.RandomState(0)
+        array = np.ma.array(random.randn(50))
+        array[random.rand(50) < 0.3] = np.ma.masked
+        indices = list(random.uniform(-5, 55, 200)) + range(-2, 52)
+        for interpolate in (True, False):
+            result = values_at_indices(array, indices,
+                                       interpolate=interpolate)
+            for index, value in zip(indices, result):
+                expected = value_at_index(array, index,
+                                          interpolate=interpolate)
+                if expected is None or expected is np.ma.masked:
+                    self.assertIs(value, np.ma.masked)
+                else:
+                    self.assertEqual(value, expected)
+
+    def test_values_at_times(self):
+        array = np.ma.arange(8.0)
+        array[5] = np.ma.masked
+        times = [0.0, 0.75, 2.5, 5.0, 100.0, None]
+        result = values_at_times(array, 2, 0.25, times)
+        for time, value in zip(times[:-1], result):
+            self.assertEqual(value, value_at_time(array, 2, 0.25, time))
+        self.assertIs(result[-1], np.ma.masked)
+
+    def test_values_at_indices_large_data(self):
+        array = np.ma.arange(100000.0)
+        array[::7] = np.ma.masked
+        indices = np.linspace(0, 99999, 10000)
+        result = values_at_indices(array, indices)
+        self.assertEqual(len(result), 10000)
+        for index, value in zip(indices[::10], result[::10]):
+            expected = value_at_index(array, index)
+            if expected is None or expected is np.ma.masked:
+                self.assertIs(value, np.ma.masked)
+            else:
+                self.assertEqual(value, expected)
+
+    @benchmark
+    def test_time_taken(self):
+        from timeit import Timer
+        array = np.ma.arange(100000.0)
+        array[::7] = np.ma.masked
+        indices = np.linspace(0, 99999, 10000)
+        timer = Timer(lambda: values_at_indices(array, indices))
+        time = min(timer.repeat(3, 1))
+        print 'Time taken %s secs' % time
+        self.assertLess(time, 0.1, msg='Took too long')
+
+
 class TestVspeedLookup(unittest.TestCase):
     def test_vspdlkup_basic(self):
         self.assertEqual(vspeed_lookup('V2', 'B737-300', None, '15', 65000), 152)
@@ -5247,6 +5843,13 @@ class TestVstackParams(unittest.TestCase):
         )
         self.assertRaises(ValueError, vstack_params, None, None, None)
 
+    def test_vstack_params_align_many(self):
+        master = P('master', np.ma.arange(8.0), frequency=2, offset=0.0)
+        slave = P('slave', np.ma.arange(4.0), frequency=1, offset=0.25)
+        aligned = align_many([slave, slave], master)
+        ma_test.assert_array_equal(vstack_params(aligned), aligned)
+        self.assertEqual(vstack_params(aligned, master).shape, (3, 8))
+
 
 class TestVstackParamsWhereState(unittest.TestCase):
     def test_vstack_only_one_param(self):
@@ -5559,6 +6162,65 @@ class TestIsDay(unittest.TestCase):
         self.assertEqual(is_day(datetime(2012,6,4,1,12), lat, lon), True)
 
 
+class TestIsDayArray(unittest.TestCase):
+    def test_is_day_array(self):
+        when = np.array([datetime(2012,6,20,20,25), datetime(2012,6,20,20,27),
+                         datetime(2013,1,1,14,32), datetime(2013,1,1,14,34),
+                         datetime(2013,1,2,18,48), datetime(2013,1,2,18,50)],
+                        dtype='datetime64[s]')
+        lat = np.ma.array([51.1789]*2 + [33.449291]*2 + [-33.85]*2)
+        lon = np.ma.array([-1.8264]*2 + [-112.359015]*2 + [151.21]*2)
+        result = is_day_array(when, lat, lon, twilight=None)
+        self.assertEqual(result.tolist(),
+                         [True, False, False, True, False, True])
+
+    def test_is_day_array_masked(self):
+        when = np.array(['2013-06-04T04:54', '2013-06-04T04:52',
+                         '2013-06-04T04:29'], dtype='datetime64[s]')
+        lat = np.ma.array([0.454927]*3, mask=[False, False, True])
+        lon = np.ma.array([9.411872]*3)
+        result = is_day_array(when, lat, lon)
+        self.assertEqual(result.tolist(), [True, False, None])
+        result = is_day_array(when, lat, lon, twilight='nautical')
+        self.assertEqual(result.tolist(), [True, True, None])
+
+    def test_is_day_array_twilight_error(self):
+        when = np.array(['2013-06-04T04:54'], dtype='datetime64[s]')
+        self.assertRaises(ValueError, is_day_array, when, np.ma.array([0.0]),
+                          np.ma.array([0.0]), twilight='dusk')
+
+    def _flight(self):
+        # A ten hour flight from London to Mexico City sampled at 1Hz.
+        samples = 10 * 3600
+        when = np.datetime64('2012-06-20T16:00:00') + \
+            np.arange(samples).astype('timedelta64[s]')
+        lat = np.ma.array(np.linspace(51.47, 19.44, samples))
+        lon = np.ma.array(np.linspace(-0.45, -99.07, samples))
+        return samples, when, lat, lon
+
+    def test_is_day_array_matches_is_day(self):
+        samples, when, lat, lon = self._flight()
+        result = is_day_array(when, lat, lon)
+        whens = when.tolist()
+        for n in xrange(0, samples, 60):
+            self.assertEqual(result[n], is_day(whens[n], lat[n], lon[n]))
+
+    @benchmark
+    def test_time_taken(self):
+        samples, when, lat, lon = self._flight()
+        from timeit import Timer
+        whens = when.tolist()
+        per_sample = Timer(lambda: [is_day(whens[n], lat[n], lon[n])
+                                    for n in xrange(samples)])
+        array = Timer(lambda: is_day_array(when, lat, lon))
+        per_sample_time = min(per_sample.repeat(1, 1))
+        array_time = min(array.repeat(3, 1))
+        print "Time taken %s secs (per sample %s secs)" % (array_time,
+                                                          per_sample_time)
+        self.assertLess(array_time, per_sample_time / 10,
+                        msg="Took too long")
+
+
 class TestSecondWindow(unittest.TestCase):
     
     def test_three_second_window_incrementing(self):
@@ -5583,7 +6245,18 @@ class TestSecondWindow(unittest.TestCase):
                                mask=17 * [False] + 3 * [True]))
     
     def test_second_window_invalid_frequency(self):
-        self.assertRaises(ValueError, second_window, np.ma.arange(10), 1, 3)
+        self.assertRaises(ValueError, second_window, np.ma.arange(10), 0, 3)
+        self.assertRaises(ValueError, second_window, np.ma.arange(10), 1, -1)
+
+    def test_three_second_window_1hz(self):
+        # An even number of samples within the window.
+        expected = np.ma.masked_array([0, 0.5, 1, 1.5, 2, 2.5, 3, 3.5, 4, 4,
+                                       4, 4, 4, 3.5, 3, 2.5, 2, 1.5, 1, 0],
+                                      mask=19 * [False] + [True])
+        array = np.ma.concatenate([np.ma.arange(0, 5, 0.5),
+                                   np.ma.arange(5, 0, -0.5)])
+        ma_test.assert_almost_equal(second_window(array, 1, 3), expected)
+        ma_test.assert_almost_equal(second_window(array, 0.5, 6), expected)
     
     def test_three_second_window_basic_trough(self):
         ma_test.assert_almost_equal(
@@ -5646,6 +6319,107 @@ class TestSecondWindow(unittest.TestCase):
         res = second_window(amv2.array, amv2.frequency, 3)
         self.assertEqual(np.ma.count(res), 40975)
 
+    def test_second_window_large_data(self):
+        # Checked against values from the previous implementation.
+        array = np.ma.array(np.cumsum(
+            np.random.RandomState(0).randn(8 * 3600 * 4)))
+        array[::1000] = np.ma.masked
+        res = second_window(array, 8, 5)
+        self.assertEqual(np.ma.count(res), 112764)
+        self.assertAlmostEqual(res.sum(), -9282896.828512885, places=3)
+        self.assertAlmostEqual(res[100], 5.578812190003792)
+
+    @benchmark
+    def test_time_taken(self):
+        from timeit import Timer
+        # Five seconds of four hours of 8Hz data.
+        array = np.ma.array(np.cumsum(
+            np.random.RandomState(0).randn(8 * 3600 * 4)))
+        array[::1000] = np.ma.masked
+        timer = Timer(lambda: second_window(array, 8, 5))
+        time_taken = min(timer.repeat(3, 1))
+        print 'Time taken %s secs' % time_taken
+        self.assertLess(time_taken, 0.5, msg='Took too long')
+
+
+class TestUnmaskedFastPaths(unittest.TestCase):
+    '''
+    Compares results for arrays without any masked values against the same
+    data with a single masked sample outside the area of interest, which
+    forces the masked array code path. The time taken is also compared when
+    BENCHMARK is set.
+    '''
+    def setUp(self):
+        self.unmasked = np.ma.sin(np.ma.arange(100000) / 1000.0) * 100.0
+        self.masked = self.unmasked.copy()
+        self.masked[-1] = np.ma.masked
+
+    def _compare(self, function, *args, **kwargs):
+        from timeit import Timer
+        unmasked_result = function(self.unmasked, *args, **kwargs)
+        masked_result = function(self.masked, *args, **kwargs)
+        if not BENCHMARK:
+            return unmasked_result, masked_result
+        unmasked = min(Timer(lambda: function(self.unmasked, *args, **kwargs))
+                       .repeat(3, 10))
+        masked = min(Timer(lambda: function(self.masked, *args, **kwargs))
+                     .repeat(3, 10))
+        print 'Time taken %.4fs (masked %.4fs) for %s' % (
+            unmasked, masked, function.__name__)
+        self.assertLess(unmasked, 1.0, msg='Took too long: %.3fs' % unmasked)
+        return unmasked_result, masked_result
+
+    def test_repair_mask(self):
+        unmasked, masked = self._compare(repair_mask, copy=True)
+        self.assertFalse(np.ma.is_masked(unmasked))
+        ma_test.assert_array_equal(unmasked[:-1], masked[:-1])
+
+    def test_align(self):
+        slave = P('Slave', frequency=1, offset=0.5)
+        master = P('Master', frequency=2, offset=0.1)
+        def _align(array):
+            slave.array = array
+            return align(slave, master)
+        _align.__name__ = 'align'
+        unmasked, masked = self._compare(_align)
+        self.assertIsInstance(unmasked, np.ma.MaskedArray)
+        self.assertEqual(np.ma.count_masked(unmasked), 2)
+        ma_test.assert_array_almost_equal(unmasked[:-3], masked[:-3])
+
+    def test_max_value(self):
+        unmasked, masked = self._compare(max_value, _slice=slice(10, 90000))
+        self.assertEqual(unmasked, masked)
+        unmasked, masked = self._compare(min_value, _slice=slice(10, 90000))
+        self.assertEqual(unmasked, masked)
+
+    def test_index_at_value(self):
+        unmasked, masked = self._compare(index_at_value, 50.0,
+                                         _slice=slice(10000, 90000))
+        self.assertEqual(unmasked, masked)
+        unmasked, masked = self._compare(index_at_value, 50.0,
+                                         _slice=slice(90000, 10000, -1))
+        self.assertEqual(unmasked, masked)
+        unmasked, masked = self._compare(index_at_value, 500.0,
+                                         _slice=slice(10000, 90000))
+        self.assertEqual(unmasked, None)
+        self.assertEqual(masked, None)
+
+    def test_integrate(self):
+        unmasked, masked = self._compare(integrate, 1.0)
+        self.assertIsInstance(unmasked, np.ma.MaskedArray)
+        ma_test.assert_array_almost_equal(unmasked[:-1], masked[:-1])
+        unmasked, masked = self._compare(integrate, 1.0, direction='reverse')
+        # The reverse integral starts from the last unmasked sample, so only
+        # the increments away from the masked end are comparable.
+        ma_test.assert_array_almost_equal(np.ma.diff(unmasked[:-3]),
+                                          np.ma.diff(masked[:-3]))
+
+    def test_rate_of_change_array(self):
+        unmasked, masked = self._compare(rate_of_change_array, 1.0)
+        self.assertIsInstance(unmasked, np.ma.MaskedArray)
+        self.assertFalse(np.ma.is_masked(unmasked))
+        ma_test.assert_array_almost_equal(unmasked[:-2], masked[:-2])
+
 
 if __name__ == '__main__':
     suite = unittest.TestSuite()
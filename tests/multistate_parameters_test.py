@@ -369,6 +369,19 @@ class TestDaylight(unittest.TestCase):
         self.assertEqual(don.frequency, 0.25)
         self.assertEqual(don.offset, 0)
 
+    def test_daylight_civil_dusk(self):
+        # An hour at Stonehenge after sunset, with civil twilight ending
+        # between 21:13 and 21:14.
+        lat = P('Latitude', np.ma.array([51.1789]*3600))
+        lon = P('Longitude', np.ma.array([-1.8264]*3600))
+        start_dt = A('Start Datetime', datetime.datetime(2012,6,20, 20,30))
+        dur = A('HDF Duration', 3600)
+
+        don = Daylight()
+        don.get_derived((lat, lon, start_dt, dur))
+        # Samples are four seconds apart at 0.25Hz.
+        self.assertEqual(list(don.array), ['Day']*652 + ['Night']*248)
+
     def test_father_christmas(self):
         # Starting on the far side of the world, he flies all round
         # delivering parcels mostly by night (in the northern lands).
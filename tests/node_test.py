@@ -20,7 +20,12 @@ from analysis_engine.node import (
     Node, NodeManager,
     Parameter, P,
     MultistateDerivedParameterNode, M,
+    convert_to_mmap,
+    dump_mmap,
     load,
+    load_mmap,
+    load_mmap_header,
+    multistate_string_to_integer,
     powerset,
     SectionNode,
     Section,
@@ -30,9 +35,14 @@ from analysis_engine.node import (
 from hdfaccess.file import hdf_file
 from hdfaccess.parameter import MappedArray
 
+import flightdatautilities.masked_array_testutils as ma_test
+
 test_data_path = os.path.join(os.path.dirname(os.path.abspath(__file__)),
                               'test_data')
 
+benchmark = unittest.skipUnless(os.environ.get('BENCHMARK'),
+                                'Set BENCHMARK to run timing tests.')
+
 
 def _get_mock_params():
     param1 = mock.Mock()
@@ -327,6 +337,14 @@ class TestNode(unittest.TestCase):
         self.assertEqual(res.frequency, 2)
         self.assertEqual(res.offset, 1.2)
         os.remove(dest)
+        # save as memory-mapped node file without an array
+        dump_mmap(node, dest)
+        self.assertEqual(load_mmap_header(dest)[0]['blocks'].keys(), ['node'])
+        res = load(dest)
+        self.assertIsInstance(res, Node)
+        self.assertEqual(res.frequency, 2)
+        self.assertEqual(res.offset, 1.2)
+        os.remove(dest)
 
 
 class TestAttribute(unittest.TestCase):
@@ -441,16 +459,52 @@ class TestNodeManager(unittest.TestCase):
         self.assertEqual(mgr.keys(),
                          ['HDF Duration', 'Start Datetime'] +
                          list('abclmnopxyz'))
+        # can_operate arguments are inspected once per derived node class.
+        mgr.derived_nodes['y'] = mock_node = mock.Mock('can_operate')
+        mock_node.can_operate = mock.Mock(return_value=True)
         getargspec.return_value = ArgSpec(
             args=['cls', 'available', 'x'], varargs=None, keywords=None,
             defaults=(Attribute('o', None),))
         self.assertTrue(mgr.operational('y', ['o']))
         mock_node.can_operate.assert_called_with(['o'], Attribute('o', 2))
+        mgr.derived_nodes['y'] = mock_node = mock.Mock('can_operate')
+        mock_node.can_operate = mock.Mock(return_value=True)
         getargspec.return_value = ArgSpec(
             args=['cls', 'available', 'x'], varargs=None, keywords=None,
             defaults=(DerivedParameterNode('o'),))
         self.assertRaises(TypeError, mgr.operational, 'y', Attribute('o', 2))
 
+    def test_operational_cache(self):
+        calls = []
+
+        class Cached(DerivedParameterNode):
+            @classmethod
+            def can_operate(cls, available, family=Attribute('Family')):
+                calls.append(available)
+                return 'a' in available and family.value == 'B737'
+
+            def derive(self, a=P('a'), b=P('b')):
+                pass
+
+        def node_mgr(family):
+            return NodeManager(None, 10, ['a', 'b'], ['Cached'], [],
+                               {'Cached': Cached}, {'Family': family}, {})
+
+        self.assertTrue(node_mgr('B737').operational('Cached', ['a', 'b']))
+        self.assertEqual(len(calls), 1)
+        # The result is shared between flights with the same dependencies
+        # available and attribute values, regardless of order.
+        self.assertTrue(node_mgr('B737').operational('Cached', ['b', 'a']))
+        self.assertEqual(len(calls), 1)
+        self.assertFalse(node_mgr('B737').operational('Cached', ['b']))
+        self.assertEqual(len(calls), 2)
+        self.assertFalse(node_mgr('A320').operational('Cached', ['a', 'b']))
+        self.assertEqual(len(calls), 3)
+        # Unhashable attribute values are not cached.
+        self.assertFalse(node_mgr(['B737']).operational('Cached', ['a']))
+        self.assertFalse(node_mgr(['B737']).operational('Cached', ['a']))
+        self.assertEqual(len(calls), 5)
+
     def test_get_attribute(self):
         aci = {'a': 'a_value', 'b': None}
         afr = {'x': 'x_value', 'y': None}
@@ -1901,6 +1955,53 @@ class TestDerivedParameterNode(unittest.TestCase):
         self.assertGreater(os.path.getsize(dest), 20000)
         os.remove(dest)
 
+    def test_save_and_load_mmap(self):
+        node = P('Altitude AAL', np.ma.array([0,1,2,3], mask=[0,1,1,0]),
+              frequency=2, offset=0.123, data_type='Signed')
+        dest = os.path.join(test_data_path, 'altitude.nodm')
+        dump_mmap(node, dest)
+        self.assertTrue(os.path.isfile(dest))
+        header, start = load_mmap_header(dest)
+        self.assertEqual(header['name'], 'Altitude AAL')
+        self.assertEqual(header['frequency'], 2)
+        self.assertEqual(sorted(header['blocks']), ['data', 'mask', 'node'])
+        self.assertEqual(start % 64, 0)
+        for res in (load_mmap(dest), load(dest)):
+            self.assertIsInstance(res, DerivedParameterNode)
+            self.assertEqual(res.name, 'Altitude AAL')
+            self.assertEqual(res.frequency, 2)
+            self.assertEqual(res.offset, 0.123)
+            # the data is memory-mapped rather than read into memory
+            base = res.array.data
+            while base is not None and not isinstance(base, np.memmap):
+                base = base.base
+            self.assertIsInstance(base, np.memmap)
+            self.assertEqual(list(res.array.data), [0,1,2,3])
+            self.assertEqual(list(res.array.mask), [0,1,1,0])
+        # modifying the loaded array does not change the file
+        res.array[0] = 10
+        self.assertEqual(load_mmap(dest).array[0], 0)
+        # unmasked arrays do not store a mask
+        node.array = np.ma.arange(5000)
+        dump_mmap(node, dest)
+        self.assertNotIn('mask', load_mmap_header(dest)[0]['blocks'])
+        res = load_mmap(dest)
+        self.assertEqual(res.array.mask, np.ma.nomask)
+        self.assertEqual(res.array.tolist(), range(5000))
+        os.remove(dest)
+
+    def test_convert_to_mmap(self):
+        path = os.path.join(test_data_path, '787_flap_angle_l.nod')
+        dest = os.path.join(test_data_path, '787_flap_angle_l_test.nodm')
+        self.assertEqual(convert_to_mmap(path, dest), dest)
+        expected = load(path)
+        res = load(dest)
+        self.assertEqual(res.name, expected.name)
+        self.assertEqual(res.frequency, expected.frequency)
+        self.assertEqual(res.offset, expected.offset)
+        ma_test.assert_masked_array_equal(res.array, expected.array)
+        os.remove(dest)
+
 
 
 class TestMultistateDerivedParameterNode(unittest.TestCase):
@@ -2012,6 +2113,25 @@ class TestMultistateDerivedParameterNode(unittest.TestCase):
                              [  3, 999, 999,   3,   4,   0,   1,   2, 999, 999])
             self.assertEqual(saved.array.data.dtype, np.int)
             
+    def test_state(self):
+        node = M('Test Node', np.ma.array([0, 1, 1, 0]),
+                 values_mapping={0: '-', 1: 'Engaged'})
+        self.assertEqual(node.state, {'-': 0, 'Engaged': 1})
+        node.values_mapping = {0: 'Off', 1: 'On'}
+        self.assertEqual(node.state, {'Off': 0, 'On': 1})
+
+    def test_match(self):
+        node = M('Test Node', np.ma.array([0, 1, 2, 1, 0], mask=[0, 0, 0, 0, 1]),
+                 values_mapping={0: '-', 1: 'Engaged', 2: 'Armed'})
+        ma_test.assert_masked_array_equal(node.match('Engaged'),
+                                          node.array == 'Engaged')
+        ma_test.assert_masked_array_equal(
+            node.match(['Engaged', 'Armed']),
+            node.array.any_of('Engaged', 'Armed'))
+        ma_test.assert_masked_array_equal(
+            node.match('Engaged', condition=False), node.array != 'Engaged')
+        self.assertRaises(KeyError, node.match, 'Unknown')
+
     def test_pickle_load_includes_values_mapping(self):
         mapping = {0:'zero', 1:'one', 2:'two', 3:'three'}
         input_array = np.ma.array(['one', 'two']*5, mask=[1,0,0,0,0,0,0,0,0,1], dtype=object)
@@ -2032,7 +2152,58 @@ class TestMultistateDerivedParameterNode(unittest.TestCase):
         expected = [np.ma.masked, 'two', 'one', 'two', 'one', 'two', 'one', 'two', 'one', np.ma.masked]
         self.assertEqual(list(res.array), expected)
         os.remove(dest)
+
+    def test_save_and_load_mmap(self):
+        mapping = {0:'zero', 1:'one', 2:'two', 3:'three'}
+        node = MultistateDerivedParameterNode(
+            'multi', array=np.ma.array([1, 2, 3, 0], mask=[1, 0, 0, 0]),
+            values_mapping=mapping)
+        dest = os.path.join(test_data_path, 'multistate.nodm')
+        dump_mmap(node, dest)
+        res = load(dest)
+        self.assertIsInstance(res, MultistateDerivedParameterNode)
+        self.assertIsInstance(res.array, MappedArray)
+        self.assertEqual(res.values_mapping, mapping)
+        self.assertEqual(res.array.values_mapping, mapping)
+        self.assertEqual(list(res.array),
+                         [np.ma.masked, 'two', 'three', 'zero'])
+        os.remove(dest)
         
+class TestMultistateStringToInteger(unittest.TestCase):
+    def test_multistate_string_to_integer(self):
+        mapping = {0: 'zero', 1: 'one', 2: 'two', 3: 'three'}
+        array = np.ma.array(['one', 'two', 'zonk', 'three', 'zero'],
+                            mask=[0, 0, 1, 0, 0], dtype=object)
+        result = multistate_string_to_integer(array, mapping)
+        self.assertEqual(result.dtype, int)
+        self.assertEqual(list(result), [1, 2, np.ma.masked, 3, 0])
+        self.assertEqual(result.data[2], 999999)
+        # string dtype
+        result = multistate_string_to_integer(array.astype(str), mapping)
+        self.assertEqual(list(result), [1, 2, np.ma.masked, 3, 0])
+        # unmasked values which are not in the mapping
+        array.mask = False
+        self.assertRaises(ValueError, multistate_string_to_integer, array,
+                          mapping)
+
+    def test_multistate_string_to_integer_large_array(self):
+        mapping = {0: 'zero', 1: 'one', 2: 'two', 3: 'three', 4: 'four',
+                   5: 'five', 6: 'six', 7: 'seven'}
+        array = np.ma.array(np.repeat(mapping.values(), 36000))
+        result = multistate_string_to_integer(array, mapping)
+        np.testing.assert_array_equal(result, np.repeat(mapping.keys(), 36000))
+
+    @benchmark
+    def test_time_taken(self):
+        from timeit import Timer
+        mapping = {0: 'zero', 1: 'one', 2: 'two', 3: 'three', 4: 'four',
+                   5: 'five', 6: 'six', 7: 'seven'}
+        array = np.ma.array(np.repeat(mapping.values(), 36000))
+        timer = Timer(lambda: multistate_string_to_integer(array, mapping))
+        time = min(timer.repeat(2, 1))
+        self.assertLess(time, 0.5, msg='Took too long: %.3fs' % time)
+
+
 class TestNodeTypeAbbreviation(unittest.TestCase):
     def test_node_type_abbr_attribute(self):
         class NAME(DerivedParameterNode):
@@ -0,0 +1,92 @@
+import copy
+import cPickle
+import os
+import sys
+import unittest
+
+from analysis_engine.recordtype import recordtype
+
+
+KPV = recordtype('KPV', 'index value name slice datetime latitude longitude',
+                 field_defaults={'slice': slice(None)}, default=None)
+
+# Timings depend on the machine so are only checked when BENCHMARK is set.
+benchmark = unittest.skipUnless(os.environ.get('BENCHMARK'),
+                                'Set BENCHMARK to run timing tests.')
+
+
+class DictKPV(object):
+    '''
+    Equivalent of KPV with a per-instance __dict__ for comparison.
+    '''
+    def __init__(self, index=None, value=None, name=None, slice=slice(None),
+                 datetime=None, latitude=None, longitude=None):
+        self.index = index
+        self.value = value
+        self.name = name
+        self.slice = slice
+        self.datetime = datetime
+        self.latitude = latitude
+        self.longitude = longitude
+
+
+class TestRecordType(unittest.TestCase):
+    def test_defaults(self):
+        kpv = KPV()
+        self.assertEqual(kpv.index, None)
+        self.assertEqual(kpv.slice, slice(None))
+        kpv = KPV(10, 20, 'Airspeed Max')
+        self.assertEqual(kpv.index, 10)
+        self.assertEqual(kpv.value, 20)
+        self.assertEqual(kpv.name, 'Airspeed Max')
+        self.assertEqual(kpv.latitude, None)
+
+    def test_mutable(self):
+        kpv = KPV(10, 20, 'Airspeed Max')
+        kpv.value = 30
+        kpv[0] = 15
+        self.assertEqual(kpv.index, 15)
+        self.assertEqual(kpv.value, 30)
+
+    def test_todict(self):
+        kpv = KPV(10, 20, 'Airspeed Max')
+        self.assertEqual(kpv.todict(), {
+            'index': 10, 'value': 20, 'name': 'Airspeed Max',
+            'slice': slice(None), 'datetime': None, 'latitude': None,
+            'longitude': None})
+        self.assertEqual(KPV(**kpv.todict()), kpv)
+
+    def test_slots(self):
+        kpv = KPV(10, 20, 'Airspeed Max')
+        self.assertFalse(hasattr(kpv, '__dict__'))
+        self.assertRaises(AttributeError, setattr, kpv, 'unknown', 1)
+
+    def test_pickle(self):
+        kpv = KPV(10, 20, 'Airspeed Max', slice(5, 15))
+        for protocol in range(cPickle.HIGHEST_PROTOCOL + 1):
+            self.assertEqual(cPickle.loads(cPickle.dumps(kpv, protocol)), kpv)
+        self.assertEqual(copy.copy(kpv), kpv)
+        self.assertEqual(copy.deepcopy(kpv), kpv)
+
+    def test_memory(self):
+        kpv = KPV(10, 20, 'Airspeed Max')
+        dict_kpv = DictKPV(10, 20, 'Airspeed Max')
+        self.assertLess(
+            sys.getsizeof(kpv),
+            sys.getsizeof(dict_kpv) + sys.getsizeof(dict_kpv.__dict__))
+
+    def test_pickle_size(self):
+        kpvs = [KPV(n, n, 'Airspeed Max') for n in range(1000)]
+        dict_kpvs = [DictKPV(n, n, 'Airspeed Max') for n in range(1000)]
+        self.assertLess(len(cPickle.dumps(kpvs, cPickle.HIGHEST_PROTOCOL)),
+                        len(cPickle.dumps(dict_kpvs, cPickle.HIGHEST_PROTOCOL)))
+
+    @benchmark
+    def test_time_taken(self):
+        from timeit import Timer
+        slotted = min(Timer(lambda: KPV(10, 20, 'Airspeed Max'))
+                      .repeat(3, 100000))
+        unslotted = min(Timer(lambda: DictKPV(10, 20, 'Airspeed Max'))
+                        .repeat(3, 100000))
+        print 'Time taken %.3fs (with __dict__ %.3fs)' % (slotted, unslotted)
+        self.assertLess(slotted, 1.0, msg='Took too long: %.3fs' % slotted)
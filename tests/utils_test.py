@@ -2,7 +2,10 @@ import unittest
 
 from mock import Mock, patch
 
+from analysis_engine import settings
+from analysis_engine.node import DerivedParameterNode, P
 from analysis_engine.utils import (
+    batch_derived_trimmer,
     derived_trimmer,
     list_derived_parameters,
     list_everything,
@@ -12,45 +15,101 @@ from analysis_engine.utils import (
     list_ktis,
     list_lfl_parameter_dependencies,
     list_parameters,
+    trimmer_parameters,
     )
 
+
+class IVVTest(DerivedParameterNode):
+    name = 'IVV'
+    def derive(self, alt=P('Altitude STD')):
+        pass
+
+
+class DMETest(DerivedParameterNode):
+    name = 'DME'
+    def derive(self, dme=P('DME (1)'), ivv=P('IVV')):
+        pass
+
+
 class TestTrimmer(unittest.TestCase):
-    '''
-    TODO: Functional test with fewer mocks.
-    '''
-    @patch('analysis_engine.utils.hdf_file')
-    @patch('analysis_engine.utils.datetime')
-    @patch('analysis_engine.utils.get_derived_nodes')
-    @patch('analysis_engine.utils.strip_hdf')
-    @patch('analysis_engine.utils.NODE_MODULES')
-    def test_derived_trimmer_mocked(self, node_modules, strip_hdf,
-                                    get_derived_nodes, datetime, file_patched):
-        '''
-        Mocks the majority of inputs and outputs.
-        '''
-        datetime.now = Mock()
-        hdf_contents = {'IVV': Mock(), 'DME': Mock(), 'WOW': Mock()}
+    def setUp(self):
+        self.hdf_contents = {'Altitude STD': Mock(), 'DME (1)': Mock(),
+                             'WOW': Mock()}
+        hdf_contents = self.hdf_contents
         class hdf_file(dict):
             duration = 10
             def valid_param_names(self):
                 return hdf_contents.keys()
             def __enter__(self, *args, **kwargs):
-                return hdf_file(hdf_contents)
+                return self
             def __exit__(self, *args, **kwargs):
                 return False
-        file_patched.return_value = hdf_file()
-        strip_hdf.return_value = ['IVV', 'DME']
-        derived_nodes = {'IVV': Mock(), 'DME': Mock(), 'WOW': Mock()}
-        get_derived_nodes.return_value = derived_nodes
+        self.hdf_file = hdf_file
+        self.derived_nodes = {'IVV': IVVTest, 'DME': DMETest}
+
+    @patch('analysis_engine.utils.hdf_file')
+    @patch('analysis_engine.utils.get_derived_nodes')
+    @patch('analysis_engine.utils.strip_hdf')
+    def test_derived_trimmer_mocked(self, strip_hdf, get_derived_nodes,
+                                    file_patched):
+        file_patched.return_value = self.hdf_file()
+        strip_hdf.return_value = ['Altitude STD', 'DME (1)']
+        get_derived_nodes.return_value = self.derived_nodes
         in_path = 'in.hdf5'
         out_path = 'out.hdf5'
         dest = derived_trimmer(in_path, ['IVV', 'DME'], out_path)
         file_patched.assert_called_once_with(in_path)
-        get_derived_nodes.assert_called_once_with(node_modules)
-        strip_hdf.assert_called_once_with(
-            in_path, ['IVV', 'DME'], out_path)
+        get_derived_nodes.assert_called_once_with(settings.NODE_MODULES)
+        self.assertEqual(strip_hdf.call_count, 1)
+        args = strip_hdf.call_args[0]
+        self.assertEqual(args[0], in_path)
+        self.assertEqual(sorted(args[1]), ['Altitude STD', 'DME (1)'])
+        self.assertEqual(args[2], out_path)
         self.assertEqual(dest, strip_hdf.return_value)
 
+    def test_trimmer_parameters(self):
+        hdf_keys = self.hdf_contents.keys()
+        self.assertEqual(
+            trimmer_parameters(hdf_keys, ['IVV'], self.derived_nodes),
+            ['Altitude STD'])
+        self.assertEqual(
+            sorted(trimmer_parameters(hdf_keys, ['IVV', 'DME'],
+                                      self.derived_nodes)),
+            ['Altitude STD', 'DME (1)'])
+        self.assertEqual(
+            trimmer_parameters(hdf_keys, ['WOW'], self.derived_nodes),
+            ['WOW'])
+
+    @patch('analysis_engine.utils.trimmer_parameters')
+    @patch('analysis_engine.utils.hdf_file')
+    @patch('analysis_engine.utils.get_derived_nodes')
+    @patch('analysis_engine.utils.strip_hdf')
+    def test_batch_derived_trimmer(self, strip_hdf, get_derived_nodes,
+                                   file_patched, trimmer_params):
+        file_patched.return_value = self.hdf_file()
+        get_derived_nodes.return_value = self.derived_nodes
+        trimmer_params.return_value = ['Altitude STD']
+        strip_hdf.side_effect = lambda path, params, dest: params
+        in_paths = ['a/1.hdf5', 'a/2.hdf5', 'b/3.hdf5']
+        trimmed = batch_derived_trimmer(in_paths, ['IVV'], 'out')
+        # The dependencies are found once for the shared set of parameters.
+        self.assertEqual(trimmer_params.call_count, 1)
+        self.assertEqual(get_derived_nodes.call_count, 1)
+        self.assertEqual([c[0] for c in strip_hdf.call_args_list], [
+            ('a/1.hdf5', ['Altitude STD'], 'out/1.hdf5'),
+            ('a/2.hdf5', ['Altitude STD'], 'out/2.hdf5'),
+            ('b/3.hdf5', ['Altitude STD'], 'out/3.hdf5'),
+        ])
+        self.assertEqual(trimmed, dict.fromkeys(in_paths, ['Altitude STD']))
+        # A different set of parameters is processed separately.
+        self.hdf_contents['Heading'] = Mock()
+        trimmed = batch_derived_trimmer(in_paths[:1], ['IVV'], 'out')
+        self.assertEqual(trimmer_params.call_count, 2)
+        # Nothing is trimmed when any file in the batch would be overwritten.
+        strip_hdf.reset_mock()
+        self.assertRaises(ValueError, batch_derived_trimmer,
+                          ['b/3.hdf5', 'a/1.hdf5'], ['IVV'], 'a')
+        self.assertFalse(strip_hdf.called)
 
 
 class TestGetNames(unittest.TestCase):